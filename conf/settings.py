@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 import os
 
 # Application constants
@@ -12,8 +13,8 @@ if (_DEBUG):
 _DATA_DIR = '/data/'
 
 # command-line options
-_ALLOWED_FILE_EXTENSIONS = ['.tsv','.csv']
-_TYPES = ['DiioAirport', 'FlightGlobal', 'FixAirports']
+_ALLOWED_FILE_EXTENSIONS = ['.tsv','.csv','.ssim']
+_TYPES = ['DiioAirport', 'FlightGlobal', 'SSIM', 'FixAirports']
 
 # default strftime format for a records date field
 _STRFTIME_FORMAT = '%b %Y'
@@ -22,6 +23,24 @@ _STRFTIME_FORMAT = '%b %Y'
 _AIRPORT_COLLECTION_NAME = 'airports'
 _FLIGHT_COLLECTION_NAME = 'flights'
 _INVALID_RECORD_COLLECTION_NAME = 'invalidRecords'
+# a document with the counts of each import, see tools.grits_counts
+_HISTORICAL_DATA_COLLECTION_NAME = 'historicalData'
+
+# the format of the flight _id, an md5 of the effective date, carrier and
+# flight number: 'hex' (32 character string), 'binary' (16 byte BinData) or
+# 'int64' (the first 8 bytes as a 64-bit integer).  A collection holds a single
+# format, convert existing flights with grits_migrate_keys.py
+_FLIGHT_KEY_FORMAT = 'hex'
+
+# history (grits_consume.py --history).  The changes each FlightGlobal
+# deliverable makes to the flights are appended to _HISTORY_COLLECTION_NAME and
+# every _HISTORY_BASE_INTERVAL deliverables a full copy is stored in
+# _HISTORY_BASE_COLLECTION_NAME, from which tools.grits_history.snapshot
+# rebuilds the flights as of any deliverable
+_HISTORY_COLLECTION_NAME = 'flightHistory'
+_HISTORY_BASE_COLLECTION_NAME = 'flightHistoryBases'
+_HISTORY_DELIVERABLE_COLLECTION_NAME = 'flightHistoryDeliverables'
+_HISTORY_BASE_INTERVAL = 12
 
 # schema
 _DISABLE_SCHEMA_MATCH = True #raise exception for headers not in the schema?
@@ -33,15 +52,161 @@ _CHUNK_SIZE = 5000
 _NODES = 5
 _THREADING_ENABLED = True
 
+# the async engine (--async), for a remote high-latency mongoDB.  It needs the
+# optional motor driver.  The airports of each chunk are looked up
+# _ASYNC_LOOKUP_BATCH_SIZE codes per query, at most _ASYNC_CONCURRENCY lookups
+# and bulk writes are in flight at once and reading waits while more than
+# _ASYNC_PENDING_WRITES writes are outstanding
+_ASYNC_CONCURRENCY = 32
+_ASYNC_LOOKUP_BATCH_SIZE = 100
+_ASYNC_PENDING_WRITES = 8
+
+# bounded memory mode.  When _MAX_MEMORY_MB is set (or --max-memory is given)
+# the chunk size is adapted between _MIN_CHUNK_SIZE and _MAX_CHUNK_SIZE to keep
+# the resident set size of the import below the limit
+_MAX_MEMORY_MB = None
+# in bounded memory mode the rows of the --od-matrix, --graph and --columnar
+# stages are spilled to _SPILL_DIRECTORY (None uses the temporary directory)
+# until they are written
+_SPILL_DIRECTORY = None
+_MIN_CHUNK_SIZE = 100
+_MAX_CHUNK_SIZE = 50000
+
+# number of documents sent per bulk write, None writes each chunk in a single
+# bulk operation
+_BATCH_SIZE = None
+
+# valid records that share a key are coalesced before they are written, with
+# the row that wins chosen by _DEDUP_POLICY: 'last' (the latest row overwrites
+# earlier ones, as an ordered upsert of every row would) or 'first'.  None
+# writes every row
+_DEDUP_POLICY = 'last'
+
+# the order the valid records of each chunk are written in: 'key' (_id) or
+# 'departure' (the departure airport and dates that lead the compound flight
+# index).  None keeps the file order.  With _PRESORT the valid records of a
+# file are held back and written in _id order once it has been read, sorted on
+# disk in runs of _PRESORT_RUN_SIZE records in _PRESORT_DIRECTORY (None uses
+# the temporary directory)
+_WRITE_ORDER = None
+_PRESORT = False
+_PRESORT_RUN_SIZE = 100000
+_PRESORT_DIRECTORY = None
+
+# failed writes.  Transient errors, such as a primary stepping down, are
+# retried up to _WRITE_RETRIES times after _WRITE_BACKOFF_SECONDS, doubled for
+# each further retry up to _WRITE_BACKOFF_MAX_SECONDS.  Operations that still
+# fail, or fail for good, are appended to _DEAD_LETTER_FILE and are written
+# again by grits_replay.py
+_WRITE_RETRIES = 5
+_WRITE_BACKOFF_SECONDS = 0.5
+_WRITE_BACKOFF_MAX_SECONDS = 30
+_DEAD_LETTER_FILE = os.path.join(os.path.expanduser('~'), '.grits', 'dead_letters.jsonl')
+
+# compute the greatCircleDistance, legDistances and routeDistance of the
+# flights from the loc of their airports, chunk by chunk, see
+# tools/grits_distances.py
+_FLIGHT_DISTANCES = True
+
+# the operating days of the flights are stored as days, a 7-bit integer with
+# bit 0 for Monday, from which the weeklyFrequency is counted.  The day1 to
+# day7 booleans are kept in the flights for the readers of the old fields;
+# turn this off to write only days
+_FLIGHT_DAY_FIELDS = True
+
+# origin-destination matrix (grits_consume.py --od-matrix).  The weekly seats
+# and flights of the imported flights are summed per month, departure and
+# arrival airport and written to _OD_MATRIX_PATH, a directory of .npy arrays
+# loaded with tools.grits_od_matrix.ODMatrix.  A flight counts in at most
+# _OD_MATRIX_MAX_MONTHS months from its effective date
+_OD_MATRIX_PATH = None
+_OD_MATRIX_MAX_MONTHS = 24
+
+# flight network graph (grits_consume.py --graph).  The legs and through
+# edges of the imported flights, with their weekly seats, weekly flights and
+# great-circle distance, are written to _GRAPH_PATH as CSR arrays in a .npz
+# file loaded with tools.grits_graph.FlightGraph
+_GRAPH_PATH = None
+
+# columnar snapshot (grits_consume.py --columnar).  The fields of the imported
+# flights are written to _COLUMNAR_PATH, a directory of a .npy file per field
+# of the FlightRecord schema with dictionary encoded strings, read with
+# tools.grits_columnar.ColumnarSnapshot
+_COLUMNAR_PATH = None
+
+# reverse geocoding of the airports of a FixAirports run (--geocoder).
+# 'opencage' asks the OpenCage API for each airport.  'offline' answers from
+# the nearest place of _GEOCODER_PLACES, a CSV of lat, lon, name (city),
+# admin1 (state) and cc (country code) columns such as the rg_cities1000.csv of
+# GeoNames, or when None from the nearest other airport in mongoDB.  The places
+# are indexed in a grid of cells of _GEOCODER_CELL_KM.  _COUNTRIES_FILE holds
+# the name and center of each country code
+_GEOCODER = 'offline'
+_GEOCODER_PLACES = None
+_GEOCODER_CELL_KM = 100
+_COUNTRIES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tools', 'AirportOutlier', 'res', 'countries.txt')
+
+# airport location outliers (--airport-outliers), the port of
+# tools/AirportOutlier.  An airport of a country with more than
+# _AIRPORT_OUTLIER_MIN_AIRPORTS airports is an outlier when the normal
+# distribution of the distances of the airports of its country to its center
+# puts its distance above _AIRPORT_OUTLIER_P_VALUE.  _AIRPORT_OUTLIER_ACTION
+# 'flag' sets locationOutlier on the airports, 'quarantine' also moves the loc
+# of the outliers to quarantinedLoc
+_AIRPORT_OUTLIERS_PATH = None
+_AIRPORT_OUTLIER_ACTION = 'flag'
+_AIRPORT_OUTLIER_P_VALUE = 0.97
+_AIRPORT_OUTLIER_MIN_AIRPORTS = 5
+
+# the OpenCage geocoder.  Its answers are appended to _GEOCODER_CACHE, keyed
+# by the coordinates rounded to _GEOCODER_CACHE_DIGITS decimals (4 is about
+# 10 meters), and only the coordinates missing from it are requested, by
+# _OPENCAGE_THREADS threads at most _OPENCAGE_RATE requests per second in all
+# (1 on the free plan).  The OPENCAGE_KEY environment variable overrides
+# _OPENCAGE_KEY, see below
+_GEOCODER_CACHE = os.path.join(os.path.expanduser('~'), '.grits', 'geocoder_cache.jsonl')
+_GEOCODER_CACHE_DIGITS = 4
+_OPENCAGE_URL = 'https://api.opencagedata.com/geocode/v1/json'
+_OPENCAGE_THREADS = 4
+_OPENCAGE_RATE = 10
+_OPENCAGE_TIMEOUT = 10
+
+# calibration (grits_consume.py --calibrate).  Trial imports of the first
+# _CALIBRATION_ROWS rows are run against a scratch collection for every
+# combination of the grids below.  The fastest combination is stored in
+# _CALIBRATION_PROFILE, keyed by host and mongoDB target, and replaces
+# _NODES, _CHUNK_SIZE and _BATCH_SIZE on later runs against the same target.
+_CALIBRATION_PROFILE = os.path.join(os.path.expanduser('~'), '.grits', 'calibration.json')
+_CALIBRATION_ROWS = 10000
+_CALIBRATION_NODES = sorted(set([1, 2, 4, 2 * multiprocessing.cpu_count()]))
+_CALIBRATION_CHUNK_SIZES = [1000, 5000, 10000]
+_CALIBRATION_BATCH_SIZES = [None, 1000]
+_CALIBRATION_COLLECTION_NAME = 'calibration'
+
 # drop indexes?  Setting this to 'true' will drop any existing indexes in the
 # database.  This is most likely desirable, as bulk upserts should be faster
 # without any indexes on the collection.  However, it is important to remember
 # to then build the indexes through grits_ensure_index.py
 _DROP_INDEXES = True
 
+# mongoDB connection profiles, chosen with --mongo-profile.  Each profile holds
+# the pymongo.MongoClient options of its clients, such as the write concern
+# ('w', 'j'), 'maxPoolSize' and wire 'compressors', and 'fsync' to flush the
+# writes to disk once the tool is done.  'bulk-load' does not wait on the
+# journal during an import and fsyncs at the end, 'serving' is for tools that
+# run against a database applications read from
+_MONGO_PROFILES = {
+    'default': {},
+    'bulk-load': {'w': 1, 'j': False, 'maxPoolSize': 32, 'compressors': 'zlib',
+        'fsync': True},
+    'serving': {'w': 'majority', 'j': True, 'maxPoolSize': 100,
+        'compressors': 'zlib'},
+}
+
 # default command-line options
 # Allow environment variables for MONGO_HOST, MONGO_DATABASE, MONGO_USERNAME,
-# and MONGO_PASSWORD to override these settings
+# MONGO_PASSWORD, MONGO_PROFILE and OPENCAGE_KEY to override these settings
 if 'MONGO_HOST' in os.environ:
     _MONGO_HOST = os.environ['MONGO_HOST']
 else:
@@ -62,3 +227,14 @@ if 'MONGO_PASSWORD' in os.environ:
 else:
     #Warning: setting _MONGO_PASSWORD here will be saved as plain-text
     _MONGO_PASSWORD = None
+
+if 'MONGO_PROFILE' in os.environ:
+    _MONGO_PROFILE = os.environ['MONGO_PROFILE']
+else:
+    _MONGO_PROFILE = 'default'
+
+if 'OPENCAGE_KEY' in os.environ:
+    _OPENCAGE_KEY = os.environ['OPENCAGE_KEY']
+else:
+    #Warning: setting _OPENCAGE_KEY here will be saved as plain-text
+    _OPENCAGE_KEY = '84d572528e84d94f59e429867dbd1bed'
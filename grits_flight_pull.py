@@ -76,7 +76,7 @@ for entry in ls:
       # get the modified date for the latest file
       modDate = datetime.strptime(entryAttr[2].split("=")[1], "%Y%m%d%H%M%S.%f")
       # get the date that the last update was performed
-      mongo_connection = GritsMongoConnection(program_args)
+      mongo_connection = GritsMongoConnection(program_args, read_only=True)
       db = mongo_connection.db;
       lastUpdate = db.historicalData.find().sort("date",pymongo.DESCENDING)[0];
 
@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+from tools.grits_migrate_keys import GritsMigrateKeys
+
+
+""" wrapper for running GritsMigrateKeys """
+if __name__ == '__main__':
+
+    cmd = GritsMigrateKeys()
+    cmd.run()
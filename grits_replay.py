@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+from tools.grits_replay import GritsReplay
+
+
+""" wrapper for running GritsReplay """
+if __name__ == '__main__':
+
+    cmd = GritsReplay()
+    cmd.run()
@@ -1,7 +1,8 @@
 import sys
 import argparse
 import datetime
-from tools.grits_mongo import GritsMongoConnection
+from tools.grits_counts import totals
+from tools.grits_mongo import GritsMongoConnection, registry
 
 from conf import settings
 
@@ -32,6 +33,12 @@ def add_args():
         default=settings._MONGO_HOST,
         help='the hostname for mongoDB (Default: localhost)')
 
+    parser.add_argument('--mongo-profile',
+        choices=sorted(settings._MONGO_PROFILES.keys()),
+        default=settings._MONGO_PROFILE,
+        help='the write concern, pool size and compression of the mongoDB ' \
+            'client (Default: %s)' % settings._MONGO_PROFILE)
+
     parser.add_argument('infile',
         type=argparse.FileType('rb'),
         help="the file to be parsed")
@@ -41,17 +48,16 @@ if __name__ == '__main__':
   add_args()
   program_args = parser.parse_args(sys.argv)
   # print program_args
-  # setup the mongoDB connection
-  mongo_connection = GritsMongoConnection(program_args)
+  # setup the mongoDB connection, which keeps the indexes as the counts are
+  # only read
+  mongo_connection = GritsMongoConnection(program_args, read_only=True)
   db = mongo_connection.db;
-  num_flights = db.flights.count();
-  num_legs = db.legs.count();
+  # grits_consume.py stores the counts of each import itself, the estimated
+  # totals are read from the collection metadata instead of counting
   historyRecord = {
     'date': datetime.datetime.utcnow(),
-    'counts': {
-      'legs': num_legs,
-      'flights': num_flights
-    }
+    'counts': totals(db)
   }
 
-  db.historicalData.insert(historyRecord)
\ No newline at end of file
+  db[settings._HISTORICAL_DATA_COLLECTION_NAME].insert_one(historyRecord)
+  registry.close()
@@ -0,0 +1,36 @@
+""" the records the tests of the import stages are given
+
+The stages read the id and the fields of a FlightRecord or an AirportRecord,
+so the tests build them without parsing a row.
+"""
+
+class Record(object):
+    """ the id and fields of a record, without a RecordContext """
+    def __init__(self, id, **fields):
+        self.id = id
+        self.fields = fields
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    def set(self, name, value):
+        self.fields[name] = value
+
+def airport(code, longitude=None, latitude=None, **fields):
+    """ an airport document, as embedded in the flights """
+    document = {'_id': code}
+    if longitude is not None:
+        document['loc'] = {'type': 'Point', 'coordinates': [longitude, latitude]}
+    document.update(fields)
+    return document
+
+def airport_record(code, longitude=None, latitude=None, **fields):
+    """ an AirportRecord of the airport document """
+    document = airport(code, longitude, latitude, **fields)
+    return Record(document.pop('_id'), **document)
+
+def flight(id, route, **fields):
+    """ a flight along the airport documents of route, the departure airport,
+    any stops and the arrival airport """
+    return Record(id, departureAirport=route[0], arrivalAirport=route[-1],
+        stopCodes=list(route[1:-1]), **fields)
@@ -0,0 +1,122 @@
+import argparse
+import unittest
+import cStringIO
+
+import mongomock
+from tornado import gen
+
+from tools.grits_async import GritsAsyncEngine, GritsAsyncFileReader
+from tools.grits_mongo import AirportCache
+from tools.grits_provider_type import SSIMType
+
+from conf import settings
+from tests.test__tools_ssim_helpers import leg_record
+
+class FakeMotorCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @gen.coroutine
+    def to_list(self, length):
+        yield gen.sleep(0.001)
+        raise gen.Return(list(self.cursor))
+
+class FakeMotorCollection(object):
+    """ the motor interface over a mongomock collection, with a round trip """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return FakeMotorCursor(self.collection.find(*args, **kwargs))
+
+    @gen.coroutine
+    def bulk_write(self, requests, ordered=True):
+        yield gen.sleep(0.001)
+        raise gen.Return(self.collection.bulk_write(requests, ordered=ordered))
+
+    @gen.coroutine
+    def insert_many(self, documents):
+        yield gen.sleep(0.001)
+        raise gen.Return(self.collection.insert_many(documents))
+
+class FakeMotorDatabase(object):
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return FakeMotorCollection(self.db[name])
+
+_CODES = ['A%02d' % number for number in range(12)]
+
+def legs():
+    """ a leg between each pair of neighbouring airports, an invalid leg to
+    an unknown airport and a later leg that repeats the key of the second """
+    lines = []
+    for number, (departure, arrival) in enumerate(zip(_CODES, _CODES[1:] + _CODES[:1])):
+        lines.append(leg_record(carrier='AA', flightNumber='%4d' % number,
+            serviceType='J', effectiveDate='05NOV15', discontinuedDate='12MAR16',
+            daysOfOperation='1 3 5 7', departureAirport=departure,
+            departureTimePub='0830', arrivalAirport=arrival,
+            arrivalTimePub='1159', aircraftConfiguration='Y150'))
+    lines.append(lines[1].replace(_CODES[2], 'ZZZ').replace('AA   1', 'AA  99'))
+    lines.append(lines[1].replace('Y150', 'Y180'))
+    return ''.join(lines)
+
+class TestGritsAsyncFileReader(unittest.TestCase):
+    def setUp(self):
+        self.settings = (settings._CHUNK_SIZE, settings._ASYNC_LOOKUP_BATCH_SIZE)
+        settings._CHUNK_SIZE = 4
+        settings._ASYNC_LOOKUP_BATCH_SIZE = 3
+        self.db = mongomock.MongoClient().db
+        self.db[settings._AIRPORT_COLLECTION_NAME].insert_many([{'_id': code,
+            'loc': {'type': 'Point', 'coordinates': [number, number]}}
+            for number, code in enumerate(_CODES)])
+        self.engine = GritsAsyncEngine(db=FakeMotorDatabase(self.db), concurrency=2)
+
+    def tearDown(self):
+        settings._CHUNK_SIZE, settings._ASYNC_LOOKUP_BATCH_SIZE = self.settings
+        self.engine.close()
+
+    def test_process(self):
+        airport_cache = AirportCache(self.db)
+        program_arguments = argparse.Namespace(verbose=False, infile=cStringIO.StringIO(legs()))
+        reader = GritsAsyncFileReader(SSIMType(), program_arguments, airport_cache, self.engine)
+        reader.process(None)
+
+        flights = self.db[settings._FLIGHT_COLLECTION_NAME]
+        self.assertEqual(len(_CODES), flights.count_documents({}))
+        self.assertEqual(1, reader.deduplicator.overwritten)
+        self.assertEqual(reader.invalid_count, self.db[settings._INVALID_RECORD_COLLECTION_NAME].count_documents({}))
+        self.assertEqual(1, reader.invalid_count)
+        # the repeated key of the later chunk is written last
+        flight = flights.find_one({'flightNumber': 1})
+        self.assertEqual(180, flight['totalSeats'])
+        self.assertEqual(self.db.airports.find_one({'_id': _CODES[1]}), flight['departureAirport'])
+        # every airport was fetched once, in lookups bounded by the semaphore
+        self.assertEqual(len(_CODES) + 1, airport_cache.misses)
+        self.assertTrue(0 < self.engine.max_in_flight <= 2)
+        self.assertEqual([], reader.pending)
+
+    def test_multi_leg_flight(self):
+        # AA 7 from A01 to A03 by way of A02, with the same key for both legs
+        lines = [leg_record(carrier='AA', flightNumber='   7', itineraryVariation='01',
+            legSequence='%02d' % (number + 1), serviceType='J', effectiveDate='05NOV15',
+            discontinuedDate='12MAR16', daysOfOperation='1 3 5 7',
+            departureAirport=_CODES[number + 1], departureTimePub='0830',
+            arrivalAirport=_CODES[number + 2], arrivalTimePub='1159',
+            aircraftConfiguration='Y150') for number in range(2)]
+        airport_cache = AirportCache(self.db)
+        program_arguments = argparse.Namespace(verbose=False,
+            infile=cStringIO.StringIO(''.join(lines)))
+        reader = GritsAsyncFileReader(SSIMType(), program_arguments, airport_cache, self.engine)
+        reader.process(None)
+
+        flights = self.db[settings._FLIGHT_COLLECTION_NAME]
+        self.assertEqual(1, flights.count_documents({}))
+        self.assertEqual(0, reader.deduplicator.overwritten)
+        flight = flights.find_one()
+        airport = lambda code: self.db.airports.find_one({'_id': code})
+        self.assertEqual(airport(_CODES[1]), flight['departureAirport'])
+        self.assertEqual(airport(_CODES[3]), flight['arrivalAirport'])
+        self.assertEqual([airport(_CODES[2])], flight['stopCodes'])
+        self.assertEqual(1, flight['stops'])
@@ -0,0 +1,53 @@
+import os
+import shutil
+import argparse
+import unittest
+import tempfile
+
+from datetime import datetime
+
+from tools.grits_batch import GritsBatch, batch_files, deliverable_date
+from tools.grits_dry_run import GritsDryRunConnection
+from tools.grits_mongo import AirportCache
+from tools.grits_provider_type import DiioAirportType
+
+from conf import settings
+
+_SCRIPT_DIR = os.path.dirname(__file__)
+
+class TestGritsBatch(unittest.TestCase):
+    def setUp(self):
+        self.threading_enabled = settings._THREADING_ENABLED
+        settings._THREADING_ENABLED = False
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(_SCRIPT_DIR, 'data/MiExpressAllAirportCodes.tsv'), 'rb') as f:
+            lines = [f.readline() for i in range(30)]
+        for name in ['Airports_20151102.tsv', 'Airports_20150728.tsv', 'notes.txt']:
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(''.join(lines))
+
+    def tearDown(self):
+        settings._THREADING_ENABLED = self.threading_enabled
+        shutil.rmtree(self.directory)
+
+    def test_deliverable_date(self):
+        self.assertEqual(datetime(2015, 7, 28), deliverable_date('/data/GlobalDirectsSample_20150728.csv'))
+
+    def test_batch_files_in_date_order(self):
+        names = [os.path.basename(path) for path in batch_files(self.directory)]
+        self.assertEqual(['Airports_20150728.tsv', 'Airports_20151102.tsv'], names)
+        names = [os.path.basename(path) for path in batch_files(os.path.join(self.directory, '*_2015110*'))]
+        self.assertEqual(['Airports_20151102.tsv'], names)
+
+    def test_run(self):
+        airport_cache = AirportCache()
+        connection = GritsDryRunConnection(airport_cache)
+        program_arguments = argparse.Namespace(verbose=False, infile=None)
+        batch = GritsBatch(DiioAirportType(), program_arguments, connection,
+            airport_cache, concurrency=2)
+        summaries = batch.run(batch_files(self.directory))
+        self.assertEqual(2, len(summaries))
+        self.assertEqual([], batch.failed())
+        self.assertEqual(summaries[0]['valid'], summaries[1]['valid'])
+        # the second file repeats every airport of the first
+        self.assertEqual(summaries[1]['valid'], connection.duplicate_keys)
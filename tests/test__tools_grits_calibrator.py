@@ -0,0 +1,118 @@
+import os
+import shutil
+import argparse
+import tempfile
+import cStringIO
+import unittest
+
+import mongomock
+
+from tools.grits_calibrator import apply_profile, load_profiles, save_profile
+from tools.grits_calibrator import profile_key, GritsCalibrator, SampleType
+from tools.grits_metrics import metrics
+from tools.grits_profiler import profiler
+from tools.grits_provider_type import FlightGlobalType
+from tools import grits_consumer
+
+from conf import settings
+
+class TestGritsCalibratorProfile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles', 'calibration.json')
+        self.program_arguments = argparse.Namespace(mongohost='localhost', database='grits')
+        self.saved = (settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE)
+
+    def tearDown(self):
+        settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_missing_profile(self):
+        self.assertEqual({}, load_profiles(self.path))
+        self.assertEqual(None, apply_profile(self.program_arguments, self.path))
+        self.assertEqual(self.saved, (settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE))
+
+    def test_save_and_apply(self):
+        save_profile(self.program_arguments, {'nodes': 3, 'chunk_size': 2000,
+            'batch_size': 500, 'rows_per_second': 1234.0,
+            'date': '2016-01-01T00:00:00'}, self.path)
+        self.assertTrue(profile_key(self.program_arguments) in load_profiles(self.path))
+        apply_profile(self.program_arguments, self.path)
+        self.assertEqual((3, 2000, 500), (settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE))
+
+    def test_other_target_is_not_applied(self):
+        remote = argparse.Namespace(mongohost='remote', database='grits')
+        save_profile(remote, {'nodes': 3, 'chunk_size': 2000,
+            'batch_size': 500, 'rows_per_second': 1234.0,
+            'date': '2016-01-01T00:00:00'}, self.path)
+        self.assertEqual(None, apply_profile(self.program_arguments, self.path))
+
+class Connection(object):
+    def __init__(self):
+        self.db = mongomock.MongoClient().db
+
+class TestGritsCalibrator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved = (settings._CALIBRATION_ROWS, settings._CALIBRATION_PROFILE)
+        settings._CALIBRATION_PROFILE = os.path.join(self.directory, 'calibration.json')
+        self.program_arguments = argparse.Namespace(mongohost='localhost', database='grits',
+            infile=cStringIO.StringIO('carrier,notes\nAA,"two\nlines"\nBA,one\nCX,three\n'))
+
+    def tearDown(self):
+        settings._CALIBRATION_ROWS, settings._CALIBRATION_PROFILE = self.saved
+        profiler.enabled = False
+        profiler.reset()
+        metrics.reset()
+        shutil.rmtree(self.directory)
+
+    def test_read_sample(self):
+        settings._CALIBRATION_ROWS = 2
+        calibrator = GritsCalibrator(FlightGlobalType(), self.program_arguments, Connection())
+        rows = calibrator.read_sample()
+        # the quoted newline is one field, not the end of the sample
+        self.assertEqual([['carrier', 'notes'], ['AA', 'two\nlines'], ['BA', 'one']], rows)
+        self.assertEqual(2, calibrator.sample_rows)
+        sample_type = SampleType(calibrator.provider_type, rows)
+        self.assertEqual(rows, list(sample_type.reader(None)))
+        self.assertEqual(settings._CALIBRATION_COLLECTION_NAME, sample_type.collection_name)
+        self.assertEqual(1, sample_type.data_position)
+
+    def test_trials_are_not_measured(self):
+        calibrator = GritsCalibrator(FlightGlobalType(), self.program_arguments, Connection())
+        def trial(sample, nodes, chunk_size, batch_size):
+            metrics.inc('grits_rows_read_total', len(sample))
+            profiler.add('parse', 1.0)
+            return float(nodes * chunk_size)
+        calibrator.trial = trial
+        profiler.enable()
+        calibration = calibrator.run()
+        self.assertEqual(max(settings._CALIBRATION_NODES), calibration['nodes'])
+        self.assertEqual(0, metrics.counter_value('grits_rows_read_total'))
+        self.assertEqual({}, dict(profiler.stages))
+        self.assertEqual(True, profiler.enabled)
+
+class TestGritsCalibrateCommand(unittest.TestCase):
+    def test_calibrate_is_read_only(self):
+        connections = []
+        calibrations = []
+        class Connection(object):
+            def __init__(self, program_arguments, read_only=False):
+                connections.append(read_only)
+        class Calibrator(object):
+            def __init__(self, provider_type, program_arguments, mongo_connection):
+                pass
+            def run(self):
+                calibrations.append(True)
+        saved = (grits_consumer.GritsMongoConnection, grits_consumer.GritsCalibrator)
+        grits_consumer.GritsMongoConnection, grits_consumer.GritsCalibrator = Connection, Calibrator
+        try:
+            consumer = grits_consumer.GritsConsumer()
+            consumer.program_args = argparse.Namespace(type='FlightGlobal', dry_run=False, calibrate=True)
+            # a connection that drops the indexes, or a clear of the legs,
+            # would fail on the fake connection
+            consumer.process()
+        finally:
+            grits_consumer.GritsMongoConnection, grits_consumer.GritsCalibrator = saved
+        self.assertEqual([True], connections)
+        self.assertEqual([True], calibrations)
@@ -0,0 +1,125 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+import mongomock
+import pymongo
+
+from tools.grits_chunk_writer import DeadLetterFile, GritsChunkWriter, is_transient, replay
+
+from tests.records import Record
+
+class FlakyCollection(object):
+    """ a mongomock collection whose bulk writes fail as scripted
+
+        Each failure is an exception to raise, or a dict of the index of an
+        operation within the write to the code of its write error.
+    """
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+        self.writes = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.writes.append(len(requests))
+        failure = self.failures.pop(0) if len(self.failures) > 0 else None
+        if isinstance(failure, Exception):
+            raise failure
+        if failure is None:
+            return self.collection.bulk_write(requests, ordered=ordered)
+        errors = []
+        applied = []
+        for index, request in enumerate(requests):
+            if index in failure:
+                errors.append({'index': index, 'code': failure[index], 'errmsg': 'error %d' % failure[index]})
+                if ordered:
+                    break
+            else:
+                applied.append(request)
+        result = self.collection.bulk_write(applied, ordered=ordered) if applied else None
+        details = dict(result.bulk_api_result) if result else {}
+        details.update({'writeErrors': errors, 'writeConcernErrors': []})
+        raise pymongo.errors.BulkWriteError(details)
+
+class FlakyDatabase(object):
+    def __init__(self, db, failures):
+        self.collection = FlakyCollection(db.flights, failures)
+
+    def __getitem__(self, name):
+        return self.collection
+
+class TestGritsChunkWriter(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dead_letters.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writer(self, *failures):
+        self.flaky = FlakyDatabase(self.db, list(failures))
+        return GritsChunkWriter(self.flaky, retries=2, backoff=0, dead_letter_file=DeadLetterFile(self.path))
+
+    def records(self, count):
+        return [Record('key%d' % number, seats=number) for number in range(count)]
+
+    def test_transient_exception_is_retried(self):
+        writer = self.writer(pymongo.errors.AutoReconnect('primary stepped down'))
+        counts = writer.upsert('flights', self.records(3), ordered=False)
+        self.assertEqual(3, counts['nUpserted'])
+        self.assertEqual([3, 3], self.flaky.collection.writes)
+        self.assertEqual(0, writer.failed)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_only_failed_operations_are_requeued(self):
+        writer = self.writer({1: 189, 2: 121})
+        writer.upsert('flights', self.records(4), ordered=False)
+        # the step down is retried alone, the validation error is a dead letter
+        self.assertEqual([4, 1], self.flaky.collection.writes)
+        self.assertEqual(['key0', 'key1', 'key3'], sorted(doc['_id'] for doc in self.db.flights.find()))
+        entries = list(DeadLetterFile.read(self.path))
+        self.assertEqual(1, len(entries))
+        self.assertEqual(('upsert', 121, 'key2'), (entries[0]['op'], entries[0]['code'], entries[0]['document']['_id']))
+
+        # the replay writes the dead letter once the cause is fixed
+        summary = replay(self.db, self.path)
+        self.assertEqual((1, 0), (summary['entries'], summary['failed']))
+        self.assertEqual(2, self.db.flights.find_one({'_id': 'key2'})['seats'])
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(summary['replayed']))
+
+    def test_ordered_write_continues_after_the_error(self):
+        writer = self.writer({1: 121})
+        writer.upsert('flights', self.records(4), ordered=True)
+        # the operations after the error were never applied and are sent again
+        self.assertEqual([4, 2], self.flaky.collection.writes)
+        self.assertEqual(3, self.db.flights.count_documents({}))
+        self.assertEqual(1, writer.failed)
+
+    def test_retries_are_exhausted(self):
+        error = pymongo.errors.NetworkTimeout('timed out')
+        writer = self.writer(error, error, error)
+        writer.upsert('flights', self.records(2))
+        self.assertEqual(3, len(self.flaky.collection.writes))
+        self.assertEqual(2, writer.failed)
+        self.assertEqual(2, len(list(DeadLetterFile.read(self.path))))
+
+    def test_permanent_exception(self):
+        writer = self.writer(pymongo.errors.OperationFailure('not authorized', 13))
+        writer.insert('flights', [{'row': 1}])
+        self.assertEqual(1, len(self.flaky.collection.writes))
+        self.assertEqual(1, writer.failed)
+
+    def test_duplicate_insert_was_applied(self):
+        writer = self.writer({0: 11000})
+        counts = writer.insert('flights', [{'row': 1}, {'row': 2}])
+        self.assertEqual(0, writer.failed)
+        self.assertEqual(2, counts['nInserted'])
+
+    def test_is_transient(self):
+        self.assertTrue(is_transient(pymongo.errors.AutoReconnect('')))
+        self.assertTrue(is_transient(pymongo.errors.OperationFailure('', 11602)))
+        self.assertFalse(is_transient(pymongo.errors.OperationFailure('', 13)))
+        self.assertFalse(is_transient(ValueError()))
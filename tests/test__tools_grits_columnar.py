@@ -0,0 +1,105 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from datetime import datetime
+
+import numpy as np
+
+from bson.binary import Binary
+
+from tools.grits_columnar import ColumnarSnapshot, ColumnarSnapshotBuilder
+
+from tests.records import airport, flight
+
+_JFK = airport('JFK', countryName='United States')
+_LHR = airport('LHR', countryName='United Kingdom')
+_CDG = airport('CDG', countryName=u'France')
+
+_FLIGHTS = [
+    flight('a', [_JFK, _LHR], carrier='AA', flightNumber=1, effectiveDate=datetime(2015, 11, 1),
+        discontinuedDate=datetime(2015, 11, 30), totalSeats=100, day1=True, day2=False),
+    flight('b', [_LHR, _JFK, _CDG], carrier='BA', flightNumber=1, effectiveDate=datetime(2015, 12, 1),
+        discontinuedDate=datetime(2016, 1, 31), legDistances=[5540, None], day1=True, day2=False),
+    flight('c', [_CDG, _LHR], carrier='AF', flightNumber=1, effectiveDate=datetime(2016, 2, 1),
+        discontinuedDate=datetime(2016, 3, 31), totalSeats=80, day1=True, day2=False),
+]
+# the flight a of a later deliverable
+_LATER = flight('a', [_JFK, _LHR], carrier='AA', flightNumber=1, effectiveDate=datetime(2015, 11, 1),
+    discontinuedDate=datetime(2015, 12, 15), totalSeats=120, day1=True, day2=False)
+
+class TestColumnarSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'flights')
+        builder = ColumnarSnapshotBuilder(self.path)
+        builder.add(_FLIGHTS)
+        # a later deliverable replaces the flight
+        builder.add([_LATER])
+        builder.write()
+        self.snapshot = ColumnarSnapshot(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_columns(self):
+        self.assertEqual(3, len(self.snapshot))
+        self.assertEqual(['a', 'b', 'c'], self.snapshot.values('_id').tolist())
+        self.assertTrue(isinstance(self.snapshot.column('carrier'), np.memmap))
+        self.assertEqual(np.int32, self.snapshot.column('carrier').dtype)
+        self.assertEqual(['AA', 'BA', 'AF'], self.snapshot.values('carrier').tolist())
+        # the airport columns share a dictionary
+        self.assertEqual(['JFK', 'LHR', 'CDG'], self.snapshot.values('departureAirport').tolist())
+        self.assertEqual([[], ['JFK'], []], [stops.tolist() for stops in self.snapshot.values('stopCodes')])
+        legs = self.snapshot.values('legDistances')
+        self.assertEqual([[], [], 5540.0], [legs[0].tolist(), legs[2].tolist(), legs[1][0]])
+        self.assertTrue(np.isnan(legs[1][1]))
+        self.assertEqual(['United Kingdom', 'France', 'United Kingdom'],
+            self.snapshot.values('arrivalAirportCountryName').tolist())
+        self.assertEqual([120, np.iinfo(np.int64).min, 80], self.snapshot.values('totalSeats').tolist())
+        self.assertEqual([1, 1, 1], self.snapshot.values('day1').tolist())
+        # a column without any value
+        self.assertEqual(['', '', ''], self.snapshot.values('serviceType').tolist())
+
+    def test_spilled_rows(self):
+        path = os.path.join(self.directory, 'spilled')
+        builder = ColumnarSnapshotBuilder(path)
+        builder.spill = True
+        builder.add(_FLIGHTS[:1])
+        builder.add(_FLIGHTS[1:2])
+        builder.add([_LATER])
+        spilled = builder.directory
+        builder.write()
+        self.assertFalse(os.path.exists(spilled))
+        snapshot = ColumnarSnapshot(path)
+        self.assertEqual(['a', 'b'], snapshot.keys())
+        self.assertEqual([120, np.iinfo(np.int64).min], snapshot.values('totalSeats').tolist())
+        self.assertEqual([[], ['JFK']], [stops.tolist() for stops in snapshot.values('stopCodes')])
+        self.assertEqual(5540.0, snapshot.values('legDistances')[1][0])
+
+    def test_binary_keys(self):
+        path = os.path.join(self.directory, 'binary')
+        # md5 digests may end in NUL bytes
+        keys = [Binary('\x01' * 15 + '\x00'), Binary('\x00' * 16), Binary('\x02' * 16)]
+        builder = ColumnarSnapshotBuilder(path)
+        builder.add([flight(key, [_JFK, _LHR], carrier='AA', flightNumber=1)
+            for key in keys])
+        builder.write()
+        snapshot = ColumnarSnapshot(path)
+        self.assertEqual(keys, snapshot.keys())
+        self.assertTrue(all(isinstance(key, Binary) for key in snapshot.keys()))
+        self.assertEqual([keys[1]], snapshot.keys(np.array([False, True, False])))
+        self.assertEqual(['a', 'b', 'c'], self.snapshot.keys())
+
+    def test_filters(self):
+        december = self.snapshot.operating(datetime(2015, 12, 1), datetime(2015, 12, 31))
+        self.assertEqual([True, True, False], december.tolist())
+        self.assertEqual([True, False, True], self.snapshot.carrier(['AA', 'AF', 'ZZ']).tolist())
+        self.assertEqual([False, False, False], self.snapshot.carrier('ZZ').tolist())
+        # a stop is neither the departure nor the arrival
+        self.assertEqual([True, False, False], self.snapshot.airport('JFK').tolist())
+        self.assertEqual([False, True, False], self.snapshot.airport('LHR', arrival=False).tolist())
+        selected = self.snapshot.select(december & self.snapshot.airport('LHR'), ['carrier', 'effectiveDate'])
+        self.assertEqual(['AA', 'BA'], selected['carrier'].tolist())
+        self.assertEqual(np.datetime64('2015-11-01T00:00:00'), selected['effectiveDate'][0])
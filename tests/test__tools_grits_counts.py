@@ -0,0 +1,53 @@
+import unittest
+import mongomock
+
+from tools.grits_chunk_writer import GritsChunkWriter
+from tools.grits_counts import ImportCounts
+from tools.grits_mongo import GritsMongoConnection
+from tools.grits_provider_type import FlightGlobalType, SSIMType
+
+from conf import settings
+from tests.records import airport, airport_record, flight
+
+_JFK = airport('JFK', countryName='United States')
+_UVF = airport('UVF', countryName='St. Lucia')
+
+class TestImportCounts(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.writer = GritsChunkWriter(self.db)
+        self.counts = ImportCounts()
+
+    def write(self, provider_type, records):
+        """ upsert the records and count them, as GritsFileReader.write_chunk """
+        result = GritsMongoConnection.format_bulk_write_results(
+            self.writer.upsert(settings._FLIGHT_COLLECTION_NAME, records))
+        self.counts.add_records(provider_type, records)
+        self.counts.add_result(result)
+
+    def test_counts(self):
+        self.write(FlightGlobalType(), [flight('a', [_JFK, _UVF], carrier='AA', totalSeats=100),
+            flight('b', [_UVF, _JFK], carrier='AA', totalSeats=120),
+            flight('c', [_JFK, _UVF], carrier='BA', totalSeats=90)])
+        self.write(SSIMType(), [flight('a', [_JFK, _UVF], carrier='AA', totalSeats=100),
+            flight('b', [_UVF, _JFK], carrier='AA', totalSeats=150)])
+        self.counts.add_invalid(2)
+
+        self.db.legs.insert_one({})
+        document = self.counts.store(self.db)
+        self.assertEqual({'legs': 1, 'flights': 3}, document['counts'])
+        summary = document['import']
+        self.assertEqual((3, 1, 1, 2), (summary['inserted'], summary['updated'],
+            summary['unchanged'], summary['invalid']))
+        self.assertEqual([{'carrier': 'AA', 'count': 4}, {'carrier': 'BA', 'count': 1}], summary['carriers'])
+        self.assertEqual([{'country': 'United States', 'count': 3}, {'country': 'St. Lucia', 'count': 2}],
+            summary['departureCountries'])
+        self.assertEqual([{'providerType': 'FlightGlobalType', 'count': 3}, {'providerType': 'SSIMType', 'count': 2}],
+            summary['providerTypes'])
+        self.assertEqual(1, self.db[settings._HISTORICAL_DATA_COLLECTION_NAME].count_documents({}))
+
+    def test_airports(self):
+        self.counts.add_records(SSIMType(), [airport_record('JFK', countryName='United States')])
+        summary = self.counts.document()['import']
+        self.assertEqual([], summary['carriers'])
+        self.assertEqual([], summary['departureCountries'])
@@ -0,0 +1,39 @@
+import unittest
+
+from tools.grits_dedup import InvalidDedupPolicy, KeyDeduplicator, compact_key
+
+class Record(object):
+    def __init__(self, id, row_count):
+        self.id = id
+        self.row_count = row_count
+
+class TestKeyDeduplicator(unittest.TestCase):
+    def setUp(self):
+        self.first_chunk = [Record('a' * 32, 1), Record('b' * 32, 2), Record('a' * 32, 3)]
+        self.second_chunk = [Record('b' * 32, 4), Record('c' * 32, 5)]
+
+    def test_last_wins(self):
+        deduplicator = KeyDeduplicator('last')
+        records = deduplicator.coalesce(self.first_chunk)
+        self.assertEqual([2, 3], [record.row_count for record in records])
+        records = deduplicator.coalesce(self.second_chunk)
+        self.assertEqual([4, 5], [record.row_count for record in records])
+        self.assertEqual(1, deduplicator.coalesced)
+        self.assertEqual(1, deduplicator.overwritten)
+        self.assertEqual(3, len(deduplicator.written))
+
+    def test_first_wins(self):
+        deduplicator = KeyDeduplicator('first')
+        records = deduplicator.coalesce(self.first_chunk)
+        self.assertEqual([1, 2], [record.row_count for record in records])
+        records = deduplicator.coalesce(self.second_chunk)
+        self.assertEqual([5], [record.row_count for record in records])
+        self.assertEqual(1, deduplicator.dropped)
+        self.assertEqual(2, deduplicator.duplicates)
+
+    def test_invalid_policy(self):
+        self.assertRaises(InvalidDedupPolicy, KeyDeduplicator, 'legs')
+
+    def test_compact_key(self):
+        self.assertEqual(16, len(compact_key('e771a9abf7b892fb5628f7672d4407f5')))
+        self.assertEqual('JFK', compact_key('JFK'))
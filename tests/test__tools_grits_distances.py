@@ -0,0 +1,48 @@
+import unittest
+
+import mongomock
+
+from conf import settings
+from tools.grits_distances import distance_query, set_distances
+
+from tests.records import airport, flight
+
+_JFK = airport('JFK', -73.7781, 40.6413)
+_LHR = airport('LHR', -0.4543, 51.47)
+_CDG = airport('CDG', 2.55, 49.0097)
+
+class TestGritsDistances(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            flight('a', [_JFK, _LHR]),
+            flight('b', [_JFK, _LHR, _CDG]),
+            # a stop without a location
+            flight('c', [_LHR, airport('XXX', loc=None), _CDG]),
+        ]
+        set_distances(self.records)
+
+    def test_set_distances(self):
+        fields = [record.fields for record in self.records]
+        self.assertEqual(5540, fields[0]['greatCircleDistance'])
+        self.assertEqual([5540], fields[0]['legDistances'])
+        self.assertEqual(5540, fields[0]['routeDistance'])
+        self.assertEqual(5834, fields[1]['greatCircleDistance'])
+        self.assertEqual([5540, 347], fields[1]['legDistances'])
+        self.assertEqual(5540 + 347, fields[1]['routeDistance'])
+        self.assertEqual(347, fields[2]['greatCircleDistance'])
+        self.assertEqual([None, None], fields[2]['legDistances'])
+        self.assertEqual(None, fields[2]['routeDistance'])
+
+    def test_distance_query(self):
+        flights = mongomock.MongoClient().db[settings._FLIGHT_COLLECTION_NAME]
+        flights.insert_many([dict(record.fields, _id=record.id) for record in self.records])
+        ids = lambda query: sorted(flight['_id'] for flight in flights.find(query))
+        self.assertEqual(['a', 'b'], ids(distance_query(minimum=5000)))
+        self.assertEqual(['c'], ids(distance_query(maximum=1000)))
+        self.assertEqual(['b'], ids(distance_query(5600, 6000, field='routeDistance')))
+        self.assertEqual(['b'], ids(distance_query(300, 400, field='legDistances')))
+        self.assertEqual(['a', 'b'], ids(distance_query(field='routeDistance')))
+        self.assertRaises(ValueError, distance_query, field='flightDistance')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import argparse
+import unittest
+import cStringIO
+
+from tools.grits_dry_run import GritsDryRunConnection
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_metrics import metrics
+from tools.grits_mongo import AirportCache
+from tools.grits_provider_type import DiioAirportType
+from tools.grits_record import InvalidRecord
+
+from conf import settings
+from tests.records import airport_record
+
+_SCRIPT_DIR = os.path.dirname(__file__)
+
+class TestGritsDryRunConnection(unittest.TestCase):
+    def setUp(self):
+        self.threading_enabled = settings._THREADING_ENABLED
+        settings._THREADING_ENABLED = False
+        metrics.reset()
+        self.airport_cache = AirportCache()
+        self.connection = GritsDryRunConnection(self.airport_cache)
+
+    def tearDown(self):
+        settings._THREADING_ENABLED = self.threading_enabled
+
+    def test_airport_file(self):
+        with open(os.path.join(_SCRIPT_DIR, 'data/MiExpressAllAirportCodes.tsv'), 'rb') as f:
+            lines = [f.readline() for i in range(50)]
+        # repeat the last airport
+        lines.append(lines[-1])
+        program_arguments = argparse.Namespace(verbose=False,
+            infile=cStringIO.StringIO(''.join(lines)))
+        GritsFileReader(DiioAirportType(), program_arguments, self.airport_cache).process(self.connection)
+
+        report = self.connection.report()
+        # the repeated airport is coalesced before it reaches the connection
+        self.assertEqual(1, report['duplicatesCoalesced'])
+        self.assertEqual(0, report['duplicateKeys'])
+        self.assertEqual(report['valid'], len(self.airport_cache))
+        self.assertTrue(report['valid'] > 0)
+
+    def test_airport_fields(self):
+        record = airport_record('JFK', -73.7781, 40.6413, countryName='United States')
+        self.connection.bulk_upsert(settings._AIRPORT_COLLECTION_NAME, [record])
+        self.assertEqual('JFK', self.airport_cache.get('JFK')['_id'])
+        # the fields of the record are left as the other stages read them
+        self.assertFalse('_id' in record.fields)
+
+    def test_invalid_records(self):
+        errors = {'departureAirport': 'must be of dict type', 'fields': '{}'}
+        self.connection.insert_many('invalidRecords', [InvalidRecord(errors, 'FlightRecord', 2)])
+        self.assertEqual(1, self.connection.invalid)
+        self.assertEqual({'departureAirport': 1}, dict(self.connection.invalid_by_field))
+        self.assertEqual({'FlightRecord': 1}, dict(self.connection.invalid_by_record_type))
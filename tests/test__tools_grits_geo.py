@@ -0,0 +1,27 @@
+import unittest
+
+import numpy as np
+
+from tools.grits_geo import airport_location, haversine, load_countries
+
+class TestGritsGeo(unittest.TestCase):
+    def test_haversine(self):
+        # JFK to LHR and to itself
+        distances = haversine([-73.7781, -73.7781], [40.6413, 40.6413],
+            [-0.4543, -73.7781], [51.4700, 40.6413])
+        self.assertAlmostEqual(5540.0, distances[0], delta=1.0)
+        self.assertEqual(0.0, distances[1])
+        self.assertAlmostEqual(np.pi * 6371.0088, haversine(0, 0, 180, 0), places=6)
+        self.assertTrue(np.isnan(haversine(np.nan, 0, 0, 0)))
+
+    def test_airport_location(self):
+        self.assertEqual((1.5, 2.0), airport_location({'loc': {'type': 'Point', 'coordinates': [1.5, 2]}}))
+        self.assertEqual(None, airport_location({'loc': {'coordinates': [None, None]}}))
+        self.assertEqual(None, airport_location(None))
+
+    def test_load_countries(self):
+        countries = load_countries()
+        self.assertEqual('Afghanistan', countries['AF'][0])
+        self.assertAlmostEqual(67.709953, countries['AF'][1])
+        self.assertEqual('U.S. Minor Outlying Islands', countries['UM'][0])
+        self.assertTrue(np.isnan(countries['UM'][1]))
@@ -0,0 +1,144 @@
+import os
+import json
+import shutil
+import urlparse
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+
+import mongomock
+import numpy as np
+
+from conf import settings
+from tools.grits_geo import haversine
+from tools.grits_geocoder import (GeocodeCache, GridIndex, InvalidGeocoder, OfflineGeocoder,
+    OpenCageGeocoder, create_geocoder, location)
+
+def airport(code, longitude, latitude, city, country):
+    return {'_id': code, 'city': city, 'country': country, 'countryName': None,
+        'stateName': None, 'globalRegion': None,
+        'loc': {'type': 'Point', 'coordinates': [longitude, latitude]}}
+
+class TestGritsGeocoder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_nearest_is_exact(self):
+        random = np.random.RandomState(7)
+        longitudes = random.uniform(-180, 180, 500)
+        latitudes = np.degrees(np.arcsin(random.uniform(-1, 1, 500)))
+        # small cells, so most queries search several shells
+        index = GridIndex(longitudes, latitudes, cell_km=50)
+        for longitude, latitude in zip(random.uniform(-180, 180, 50), random.uniform(-90, 90, 50)):
+            distances = haversine(longitude, latitude, longitudes, latitudes)
+            position, distance = index.nearest(longitude, latitude)
+            self.assertEqual(distances.argmin(), position)
+            self.assertAlmostEqual(distances.min(), distance, places=6)
+
+    def test_nearest_without_points(self):
+        self.assertEqual(None, GridIndex([], []).nearest(0, 0))
+
+    def test_from_file(self):
+        path = os.path.join(self.directory, 'places.csv')
+        with open(path, 'w') as f:
+            f.write('lat,lon,name,admin1,admin2,cc\n')
+            f.write('51.50853,-0.12574,London,England,Greater London,GB\n')
+            f.write('48.85341,2.3488,Paris,Ile-de-France,Paris,FR\n')
+        geocoder = OfflineGeocoder.from_file(path)
+        # LHR and CDG
+        self.assertEqual([
+            location('London', 'England', 'GB', 'United Kingdom'),
+            location('Paris', 'Ile-de-France', 'FR', 'France'),
+        ], geocoder.reverse([(-0.4543, 51.47), (2.55, 49.0097)]))
+
+    def test_create_geocoder(self):
+        db = mongomock.MongoClient().db
+        db[settings._AIRPORT_COLLECTION_NAME].insert_many([
+            airport('JFK', -73.7781, 40.6413, 'New York', 'US'),
+            airport('LHR', -0.4543, 51.47, 'London', 'GB'),
+            # the airport being fixed, with the wrong country
+            airport('LGW', -0.1821, 51.1537, 'Crawley', 'FR'),
+        ])
+        geocoder = create_geocoder('offline', db, exclude=['LGW'])
+        self.assertEqual(2, len(geocoder))
+        self.assertEqual('GB', geocoder.reverse([(-0.1821, 51.1537)])[0]['country'])
+        self.assertRaises(InvalidGeocoder, create_geocoder, 'google', db)
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ answers like the OpenCage API, GB north of latitude 50 and nothing
+    south of the equator """
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        self.server.queries.append(query['q'][0])
+        if query['key'][0] != 'test-key':
+            self.send_response(401)
+            self.end_headers()
+            return
+        latitude, longitude = [float(value) for value in query['q'][0].split(',')]
+        if latitude > 50:
+            results = [{'components': {'town': 'Crawley', 'state': 'England',
+                'country_code': 'gb', 'country': 'United Kingdom'}}]
+        elif latitude > 0:
+            # a server error, which is not cached
+            self.send_response(500)
+            self.end_headers()
+            return
+        else:
+            results = []
+        body = json.dumps({'results': results})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestGritsOpenCage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.queries = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/geocode/v1/json' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def geocoder(self, path, key='test-key'):
+        return OpenCageGeocoder(GeocodeCache(path), url=self.url, key=key, threads=3, rate=0)
+
+    def test_reverse_is_cached(self):
+        path = os.path.join(self.directory, 'cache.jsonl')
+        coordinates = [(-0.1821, 51.1537), (-0.18212, 51.15371), (0.5, -20.0), (10.0, 20.0)]
+        crawley = location('Crawley', 'England', 'gb', 'United Kingdom')
+        self.assertEqual([crawley, crawley, None, None], self.geocoder(path).reverse(coordinates))
+        # the two first coordinates share a key
+        self.assertEqual(3, len(self.server.queries))
+
+        # a rerun only asks for the coordinate that failed
+        self.server.queries = []
+        geocoder = self.geocoder(path)
+        self.assertEqual(2, len(geocoder.cache))
+        self.assertEqual([crawley, crawley, None, None], geocoder.reverse(coordinates))
+        self.assertEqual(['20.0,10.0'], self.server.queries)
+        self.assertEqual(1, geocoder.failures)
+
+    def test_reverse_with_a_wrong_key(self):
+        geocoder = self.geocoder(None, key='wrong')
+        self.assertEqual([None], geocoder.reverse([(-0.1821, 51.1537)]))
+        self.assertEqual(0, len(geocoder.cache))
+        self.assertEqual(1, geocoder.failures)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from tools.grits_graph import FlightGraph, FlightGraphBuilder, flight_edges
+
+from tests.records import airport, flight
+
+_JFK = airport('JFK', -73.7781, 40.6413)
+_LHR = airport('LHR', -0.4543, 51.4700)
+_DUB = airport('DUB', -6.2700, 53.4213)
+
+class TestFlightGraph(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'graph.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_flight_edges(self):
+        self.assertEqual([('JFK', 'DUB'), ('DUB', 'LHR'), ('JFK', 'LHR')],
+            flight_edges(flight('a', [_JFK, _DUB, _LHR]).fields))
+        self.assertEqual([('JFK', 'LHR')], flight_edges(flight('a', [_JFK, _LHR]).fields))
+
+    def test_build_and_load(self):
+        builder = FlightGraphBuilder(self.path)
+        builder.add([flight('a', [_JFK, _LHR], totalSeats=100, weeklyFrequency=7),
+            flight('b', [_JFK, _DUB, _LHR], totalSeats=50, weeklyFrequency=2),
+            flight('c', [_LHR, _JFK], totalSeats=10, weeklyFrequency=1)])
+        # a later deliverable replaces the flight
+        builder.add([flight('c', [_LHR, _JFK], totalSeats=20, weeklyFrequency=1)])
+        builder.write()
+
+        graph = FlightGraph(self.path)
+        self.assertEqual(['DUB', 'JFK', 'LHR'], graph.airports.tolist())
+        self.assertEqual([0, 1, 3, 4], graph.indptr.tolist())
+        self.assertEqual({'DUB': 100, 'LHR': 800}, graph.neighbours('JFK'))
+        self.assertEqual({'DUB': 2, 'LHR': 9}, graph.neighbours('JFK', 'frequency'))
+        self.assertEqual(20, graph.edge('LHR', 'JFK'))
+        self.assertEqual(None, graph.edge('LHR', 'DUB'))
+        self.assertAlmostEqual(5540.0, graph.edge('JFK', 'LHR', 'distance'), delta=1.0)
+        self.assertEqual(graph.edge('JFK', 'LHR', 'distance'), graph.edge('LHR', 'JFK', 'distance'))
+        self.assertEqual([0, 1, 1, 2], graph.origins().tolist())
@@ -0,0 +1,54 @@
+import unittest
+import mongomock
+
+from datetime import datetime
+
+from tools.grits_history import GritsHistory, InvalidDeliverable, deliverables, snapshot
+
+from conf import settings
+from tests.records import Record
+
+class TestGritsHistory(unittest.TestCase):
+    def setUp(self):
+        self.base_interval = settings._HISTORY_BASE_INTERVAL
+        settings._HISTORY_BASE_INTERVAL = 3
+        self.db = mongomock.MongoClient().db
+
+    def tearDown(self):
+        settings._HISTORY_BASE_INTERVAL = self.base_interval
+
+    def deliver(self, day, records):
+        """ import the records as the deliverable of the day """
+        history = GritsHistory(self.db, datetime(2015, 7, day))
+        history.record(records)
+        for record in records:
+            self.db.flights.update_one({'_id': record.id}, {'$set': record.fields}, upsert=True)
+        return history.finish()
+
+    def flights(self, day):
+        return dict((doc['_id'], doc['seats']) for doc in snapshot(self.db, datetime(2015, 7, day)))
+
+    def test_snapshots(self):
+        self.assertTrue(self.deliver(1, [Record('a', seats=1), Record('b', seats=2)])['base'])
+        summary = self.deliver(2, [Record('b', seats=3), Record('c', seats=4)])
+        self.assertFalse(summary['base'])
+        self.assertEqual((1, 1, 1, 0), (summary['insert'], summary['update'],
+            summary['remove'], summary['unchanged']))
+        summary = self.deliver(3, [Record('b', seats=3), Record('a', seats=5)])
+        self.assertEqual((1, 0, 1, 1), (summary['insert'], summary['update'],
+            summary['remove'], summary['unchanged']))
+        self.assertTrue(self.deliver(4, [Record('a', seats=6)])['base'])
+
+        self.assertEqual({'a': 1, 'b': 2}, self.flights(1))
+        self.assertEqual({'b': 3, 'c': 4}, self.flights(2))
+        self.assertEqual({'a': 5, 'b': 3}, self.flights(3))
+        self.assertEqual({'a': 6}, self.flights(4))
+        self.assertEqual({}, dict((doc['_id'], doc) for doc in snapshot(self.db, datetime(2015, 6, 1))))
+        self.assertEqual(4, len(deliverables(self.db)))
+        # the history grows with the changes, not with a copy per deliverable
+        self.assertEqual(5, self.db[settings._HISTORY_COLLECTION_NAME].count_documents({}))
+
+    def test_out_of_order(self):
+        self.deliver(2, [Record('a', seats=1)])
+        self.assertRaises(InvalidDeliverable, GritsHistory, self.db, datetime(2015, 7, 1))
+        self.assertRaises(InvalidDeliverable, GritsHistory, self.db, datetime(2015, 7, 2))
@@ -0,0 +1,39 @@
+import hashlib
+import unittest
+import mongomock
+
+from bson.binary import Binary
+from bson.int64 import Int64
+
+from tools.grits_keys import InvalidKeyFormat, convert_key, encode_digest, key_format_of, to_hex
+from tools.grits_migrate_keys import migrate_keys
+
+class TestGritsKeys(unittest.TestCase):
+    def setUp(self):
+        self.digest = hashlib.md5('2015-07-28T00:00:00AA100').digest()
+        self.hex_key = hashlib.md5('2015-07-28T00:00:00AA100').hexdigest()
+
+    def test_encode_digest(self):
+        self.assertEqual(self.hex_key, encode_digest(self.digest, 'hex'))
+        self.assertEqual(Binary(self.digest), encode_digest(self.digest, 'binary'))
+        self.assertTrue(isinstance(encode_digest(self.digest, 'int64'), Int64))
+        self.assertRaises(InvalidKeyFormat, encode_digest, self.digest, 'base64')
+
+    def test_round_trip(self):
+        binary_key = convert_key(self.hex_key, 'binary')
+        self.assertEqual('binary', key_format_of(binary_key))
+        self.assertEqual(self.hex_key, to_hex(binary_key))
+        self.assertEqual(self.hex_key, convert_key(binary_key, 'hex'))
+        int64_key = convert_key(binary_key, 'int64')
+        self.assertEqual(self.hex_key[:16], to_hex(int64_key))
+        self.assertRaises(InvalidKeyFormat, convert_key, int64_key, 'hex')
+
+    def test_migrate_keys(self):
+        db = mongomock.MongoClient().db
+        db.flights.insert_many([{'_id': hashlib.md5(str(i)).hexdigest(), 'flightNumber': i} for i in range(25)])
+        result = migrate_keys(db, 'binary', batch_size=10)
+        self.assertEqual({'copied': 25, 'collisions': 0}, result)
+        self.assertEqual(25, db.flights.count_documents({}))
+        flight = db.flights.find_one({'_id': convert_key(hashlib.md5('7').hexdigest(), 'binary')})
+        self.assertEqual(7, flight['flightNumber'])
+        self.assertEqual(['flights'], [name for name in db.list_collection_names() if name.startswith('flights')])
@@ -0,0 +1,31 @@
+import unittest
+
+from tools.grits_memory import MemoryBudget, current_rss, peak_rss
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_rss(self):
+        self.assertTrue(current_rss() > 0)
+        self.assertTrue(peak_rss() >= current_rss() / 2)
+
+    def test_shrinks_over_limit(self):
+        budget = MemoryBudget(1, 1000, 100, 5000)
+        budget.start_chunk()
+        self.assertEqual(500, budget.end_chunk(1000))
+        budget.start_chunk()
+        budget.end_chunk(500)
+        budget.start_chunk()
+        budget.end_chunk(250)
+        budget.start_chunk()
+        self.assertEqual(100, budget.end_chunk(125))
+
+    def test_growth_is_bounded(self):
+        budget = MemoryBudget(100 * current_rss(), 1000, 100, 5000)
+        budget.start_chunk()
+        rows = [object() for i in range(1000)]
+        budget.sample()
+        size = budget.end_chunk(len(rows))
+        self.assertTrue(1000 <= size <= 2000)
+        for i in range(5):
+            budget.start_chunk()
+            size = budget.end_chunk(size)
+        self.assertEqual(5000, size)
@@ -0,0 +1,48 @@
+import json
+import urllib2
+import unittest
+import mongomock
+
+from tools.grits_metrics import GritsMetrics
+from tools.grits_mongo import AirportCache
+
+from conf import settings
+
+class TestGritsMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = GritsMetrics()
+        self.metrics.inc('grits_rows_read_total', 10)
+        self.metrics.inc('grits_invalid_records_total', 2, record_type='FlightRecord')
+        self.metrics.observe('grits_mongo_write_seconds', 0.02, op='bulk_upsert')
+
+    def tearDown(self):
+        self.metrics.shutdown()
+
+    def test_render(self):
+        text = self.metrics.render()
+        self.assertTrue('grits_rows_read_total 10\n' in text)
+        self.assertTrue('grits_invalid_records_total{record_type="FlightRecord"} 2\n' in text)
+        self.assertTrue('grits_mongo_write_seconds_bucket{op="bulk_upsert",le="0.01"} 0\n' in text)
+        self.assertTrue('grits_mongo_write_seconds_bucket{op="bulk_upsert",le="0.025"} 1\n' in text)
+        self.assertTrue('grits_mongo_write_seconds_count{op="bulk_upsert"} 1\n' in text)
+        self.assertTrue('# TYPE grits_rows_per_second gauge\n' in text)
+
+    def test_summary_is_json(self):
+        summary = json.loads(json.dumps(self.metrics.summary()))
+        self.assertEqual(10, summary['counters']['grits_rows_read_total'])
+
+    def test_serve(self):
+        port = self.metrics.serve(0)
+        body = urllib2.urlopen('http://127.0.0.1:%d/metrics' % port).read()
+        self.assertTrue('grits_rows_read_total 10' in body)
+
+    def test_airport_cache_hit_ratio(self):
+        db = mongomock.MongoClient().db
+        db[settings._AIRPORT_COLLECTION_NAME].insert_one({'_id': 'JFK'})
+        cache = AirportCache(db)
+        self.metrics.airport_cache = cache
+        self.assertEqual('JFK', cache.get('JFK')['_id'])
+        self.assertEqual('JFK', cache.get('JFK')['_id'])
+        self.assertEqual(None, cache.get('XXX'))
+        self.assertEqual(None, cache.get('XXX'))
+        self.assertEqual(0.5, self.metrics.gauges()['grits_airport_cache_hit_ratio'])
@@ -0,0 +1,40 @@
+import argparse
+import unittest
+
+from tools.grits_mongo import ConnectionRegistry, InvalidMongoProfile, GritsMongoConnection, registry
+
+
+class TestConnectionRegistry(unittest.TestCase):
+    def setUp(self):
+        # clients connect in the background, so no mongoDB is needed
+        self.registry = ConnectionRegistry()
+
+    def tearDown(self):
+        self.registry.close()
+
+    def test_shared_client(self):
+        client = self.registry.client('mongodb://localhost/grits', 'serving')
+        self.assertTrue(client is self.registry.client('mongodb://localhost/grits', 'serving'))
+        self.assertFalse(client is self.registry.client('mongodb://localhost/grits', 'default'))
+        self.assertFalse(client is self.registry.client('mongodb://otherhost/grits', 'serving'))
+
+    def test_profile_options(self):
+        options = ConnectionRegistry.options('bulk-load')
+        self.assertEqual((1, False), (options['w'], options['j']))
+        # the fsync is run by close, it is not a client option
+        self.assertFalse('fsync' in options)
+        client = self.registry.client('mongodb://localhost/grits', 'serving')
+        self.assertEqual({'w': 'majority', 'j': True}, client.write_concern.document)
+        self.assertEqual(100, client.max_pool_size)
+
+    def test_unknown_profile(self):
+        self.assertRaises(InvalidMongoProfile, self.registry.client, 'mongodb://localhost/grits', 'fastest')
+
+    def test_connections_share_a_client(self):
+        program_arguments = argparse.Namespace(mongohost='localhost', username=None,
+            password=None, database='grits', mongo_profile='serving')
+        first = GritsMongoConnection(program_arguments, read_only=True)
+        second = GritsMongoConnection(program_arguments, read_only=True)
+        self.assertTrue(first.db.client is second.db.client)
+        self.assertEqual('serving', first.profile)
+        registry.close()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from datetime import datetime
+
+import numpy as np
+
+from tools.grits_od_matrix import ODMatrix, ODMatrixBuilder
+
+from conf import settings
+from tests.records import Record, airport, flight
+
+_JFK = airport('JFK')
+_LHR = airport('LHR')
+_CDG = airport('CDG')
+
+class TestODMatrix(unittest.TestCase):
+    def setUp(self):
+        self.max_months = settings._OD_MATRIX_MAX_MONTHS
+        settings._OD_MATRIX_MAX_MONTHS = 3
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'od')
+
+    def tearDown(self):
+        settings._OD_MATRIX_MAX_MONTHS = self.max_months
+        shutil.rmtree(self.directory)
+
+    def test_build_and_load(self):
+        builder = ODMatrixBuilder(self.path)
+        builder.add([
+            flight('a', [_JFK, _LHR], effectiveDate=datetime(2015, 11, 5),
+                discontinuedDate=datetime(2016, 1, 10), totalSeats=100, weeklyFrequency=7),
+            flight('b', [_JFK, _LHR], effectiveDate=datetime(2015, 12, 1),
+                discontinuedDate=datetime(2015, 12, 31), totalSeats=50, weeklyFrequency=2),
+            flight('c', [_LHR, _CDG], effectiveDate=datetime(2015, 11, 1),
+                discontinuedDate=datetime(2017, 1, 1), totalSeats=80, weeklyFrequency=1),
+            Record('d', departureAirport=None)])
+        # a later deliverable replaces the flight
+        builder.add([flight('b', [_JFK, _LHR], effectiveDate=datetime(2015, 12, 1),
+            discontinuedDate=datetime(2015, 12, 31), totalSeats=60, weeklyFrequency=2)])
+        builder.write()
+
+        matrix = ODMatrix(self.path)
+        self.assertEqual(['CDG', 'JFK', 'LHR'], matrix.airports.tolist())
+        self.assertEqual(['2015-11', '2015-12', '2016-01'], [str(month) for month in matrix.months])
+        self.assertEqual(1, builder.skipped)
+        self.assertTrue(isinstance(matrix.origin, np.memmap))
+
+        jfk, lhr, cdg = matrix.number('JFK'), matrix.number('LHR'), matrix.number('CDG')
+        december = matrix.dense(datetime(2015, 12, 24))
+        self.assertEqual(700 + 120, december[jfk, lhr])
+        self.assertEqual(80, december[lhr, cdg])
+        self.assertEqual(900, december.sum())
+        self.assertEqual(9, matrix.dense('2015-12', 'flights')[jfk, lhr])
+
+        months, seats = matrix.series('JFK', 'LHR')
+        self.assertEqual([700, 820, 700], seats.tolist())
+        # the open-ended flight is cut at _OD_MATRIX_MAX_MONTHS
+        months, seats = matrix.series(destination='CDG', start='2015-12')
+        self.assertEqual(['2015-12', '2016-01'], [str(month) for month in months])
+        self.assertEqual([80, 80], seats.tolist())
+        self.assertEqual(0, len(matrix.cells('2016-02')[0]))
+        self.assertRaises(KeyError, matrix.number, 'SFO')
+
+    def test_empty(self):
+        ODMatrixBuilder(self.path).write()
+        matrix = ODMatrix(self.path)
+        self.assertEqual(0, len(matrix))
+        self.assertEqual(0, len(matrix.series()[1]))
@@ -0,0 +1,82 @@
+import os
+import csv
+import math
+import shutil
+import unittest
+import tempfile
+
+import mongomock
+import numpy as np
+
+from conf import settings
+from tools.grits_chunk_writer import GritsChunkWriter
+from tools.grits_outliers import AirportOutlierStage, location_outliers, normal_cdf
+
+from tests.records import airport_record
+
+class Connection(object):
+    def __init__(self, db):
+        self.db = db
+        self.writer = GritsChunkWriter(db)
+
+def airport(code, longitude, latitude, country_name):
+    return airport_record(code, longitude, latitude, name=code.lower(), country=None, countryName=country_name)
+
+# eight airports around the center of France, one in the Pacific and three in
+# Belgium, too few to be scored
+_AIRPORTS = [airport('FR%d' % number, 2.2137 + (number % 3 - 1), 46.2276 + (number % 4 - 1.5), u'France')
+    for number in range(8)] + [
+    airport('XMU', -140.0, -10.0, u'France'),
+    airport('BE0', 4.4, 50.5, u'Belgium'),
+    airport('BE1', 4.5, 50.6, u'Belgium'),
+    airport('BE2', 40.0, 10.0, u'Belgium'),
+]
+
+class TestGritsOutliers(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'outliers.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_normal_cdf(self):
+        for z in [-3.0, -1.0, 0.0, 0.5, 1.8808, 4.0]:
+            self.assertAlmostEqual(0.5 * (1.0 + math.erf(z / math.sqrt(2.0))), normal_cdf(z), places=6)
+
+    def test_location_outliers(self):
+        countries = [record.fields['countryName'] for record in _AIRPORTS]
+        coordinates = np.array([record.fields['loc']['coordinates'] for record in _AIRPORTS])
+        scores = location_outliers(countries, coordinates[:, 0], coordinates[:, 1])
+        self.assertEqual(['XMU'], [_AIRPORTS[position].id for position in np.flatnonzero(scores['outlier'])])
+        self.assertTrue(scores['p'][8] > 0.97)
+        # Belgium has too few airports to be scored
+        self.assertTrue(np.isnan(scores['p'][-1]))
+        # without a known center the median of the airports is used
+        scores = location_outliers(countries, coordinates[:, 0], coordinates[:, 1], centers={})
+        self.assertEqual([8], np.flatnonzero(scores['outlier']).tolist())
+
+    def test_write(self):
+        stage = AirportOutlierStage(self.path)
+        stage.add(_AIRPORTS[:6])
+        stage.add(_AIRPORTS[6:])
+        outliers = stage.write()
+        self.assertEqual(['XMU'], [outlier[0] for outlier in outliers])
+        with open(self.path) as f:
+            self.assertEqual([['XMU', 'xmu', '', 'France']], list(csv.reader(f)))
+
+    def test_quarantine(self):
+        db = mongomock.MongoClient().db
+        db[settings._AIRPORT_COLLECTION_NAME].insert_many([dict(record.fields, _id=record.id)
+            for record in _AIRPORTS])
+        stage = AirportOutlierStage(self.path, Connection(db), action='quarantine')
+        stage.add(_AIRPORTS)
+        stage.write()
+        airports = dict((airport['_id'], airport) for airport in db[settings._AIRPORT_COLLECTION_NAME].find())
+        self.assertEqual(['XMU'], sorted(code for code in airports if airports[code]['locationOutlier']))
+        self.assertEqual(None, airports['XMU']['loc'])
+        self.assertEqual([-140.0, -10.0], airports['XMU']['quarantinedLoc']['coordinates'])
+        self.assertEqual([4.4, 50.5], airports['BE0']['loc']['coordinates'])
+
+if __name__ == '__main__':
+    unittest.main()
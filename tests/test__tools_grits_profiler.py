@@ -0,0 +1,70 @@
+import unittest
+import threading
+
+from tools.grits_profiler import GritsProfiler, StackSampler, StageStats
+
+class TestStageStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = StageStats()
+
+    def test_empty(self):
+        self.assertEqual(0, self.stats.count)
+        self.assertEqual(0.0, self.stats.mean)
+        self.assertEqual(0.0, self.stats.percentile(99))
+
+    def test_percentiles(self):
+        for i in range(99):
+            self.stats.add(0.001)
+        self.stats.add(1.0)
+        self.assertEqual(100, self.stats.count)
+        self.assertEqual(1.0, self.stats.max)
+        # estimates are the upper bound of a bucket that is 25% wide
+        self.assertTrue(0.001 <= self.stats.percentile(50) < 0.00125)
+        self.assertEqual(1.0, self.stats.percentile(100))
+
+class TestGritsProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = GritsProfiler()
+
+    def test_disabled_collects_nothing(self):
+        with self.profiler.timer('read'):
+            pass
+        self.profiler.add('coerce', 1.0)
+        self.assertEqual(0, len(self.profiler.stages))
+
+    def test_enabled_collects_stages(self):
+        self.profiler.enable()
+        with self.profiler.timer('read'):
+            pass
+        self.profiler.add('coerce', 1.0)
+        self.assertEqual(['read', 'coerce'], list(self.profiler.stages.keys()))
+        self.assertTrue('coerce' in self.profiler.report())
+
+    def test_slowest_chunk(self):
+        self.profiler.enable()
+        self.profiler.start_chunk()
+        self.profiler.end_chunk(0)
+        self.assertEqual(0, self.profiler.slowest_chunk)
+        self.assertEqual(1, self.profiler.stages['chunk'].count)
+
+    def test_concurrent_chunks(self):
+        self.profiler.enable(dump_path='unused')
+        started = threading.Event()
+        ended = threading.Event()
+        def chunk():
+            self.profiler.start_chunk()
+            started.set()
+            ended.wait()
+            self.profiler.end_chunk(1)
+        worker = threading.Thread(target=chunk)
+        worker.start()
+        started.wait()
+        # a chunk of this thread starts and ends while the other one runs
+        self.profiler.start_chunk()
+        self.profiler.end_chunk(0)
+        ended.set()
+        worker.join()
+        self.assertEqual(2, self.profiler.stages['chunk'].count)
+        self.assertEqual(1, self.profiler.slowest_chunk)
+        # every sampler was stopped
+        self.assertEqual([], [thread for thread in threading.enumerate() if isinstance(thread, StackSampler)])
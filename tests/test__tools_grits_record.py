@@ -1,10 +1,11 @@
 import os
 import unittest
 import math
+import datetime
 import mongomock
 import logging
 
-from tools.grits_record import Record, FlightRecord, AirportRecord
+from tools.grits_record import Record, FlightRecord, AirportRecord, RecordContext
 from tools.grits_record import InvalidRecordProperty, InvalidRecordLength
 from tools.grits_provider_type import FlightGlobalType, DiioAirportType
 
@@ -183,6 +184,94 @@ class TestGritsFlightRecord(unittest.TestCase):
         self.valid_obj.create(self.row)
         self.assertEqual(True, self.valid_obj.validate())
 
+    def test_create_document(self):
+        # the document of the row before the records kept only their values,
+        # without the fields added since
+        airport = self.mongo_connection.db[settings._AIRPORT_COLLECTION_NAME].find_one({})
+        document = [('carrier', 'AA'), ('flightNumber', 5020), ('serviceType', 'J'),
+            ('effectiveDate', datetime.datetime(2015, 11, 5)),
+            ('discontinuedDate', datetime.datetime(2016, 3, 12)),
+            ('day1', True), ('day2', True), ('day3', True), ('day4', True),
+            ('day5', True), ('day6', True), ('day7', True),
+            ('departureAirport', airport), ('departureCity', 'ABE'),
+            ('departureState', 'PA'), ('departureCountry', 'US'),
+            ('departureTimePub', '08:30:00'), ('departureUTCVariance', -500),
+            ('arrivalAirport', airport), ('arrivalCity', 'BNA'),
+            ('arrivalState', 'TN'), ('arrivalCountry', 'US'),
+            ('arrivalTimePub', '11:59:00'), ('arrivalUTCVariance', -600),
+            ('flightArrivalDayIndicator', '0'), ('stops', 1), ('stopCodes', [airport]),
+            ('weeklyFrequency', 7), ('totalSeats', 84)]
+        self.valid_obj.create(self.row)
+        fields = self.valid_obj.fields.copy()
+        # 08:30 at UTC-05:00 to 11:59 at UTC-06:00
+        self.assertEqual((13 * 60 + 30, 17 * 60 + 59),
+            (fields['departureMinuteOfDayUTC'], fields['arrivalMinuteOfDayUTC']))
+        for name in ('days', 'departureMinutesUTC', 'arrivalMinutesUTC',
+                'departureMinuteOfDayUTC', 'arrivalMinuteOfDayUTC'):
+            fields.pop(name)
+        self.assertEqual(document, fields.items())
+
+    def test_fields_cache(self):
+        self.valid_obj.create(self.row)
+        fields = self.valid_obj.fields
+        self.assertIs(fields, self.valid_obj.fields)
+        self.valid_obj.set('totalSeats', 90)
+        self.assertIsNot(fields, self.valid_obj.fields)
+        self.assertEqual(84, fields['totalSeats'])
+        self.assertEqual(90, self.valid_obj.fields['totalSeats'])
+
+    def test_unset_fields(self):
+        record = self.valid_obj
+        self.assertEqual(0, len(record.fields))
+        self.assertEqual(None, record.get('totalSeats'))
+        self.assertEqual(0, record.get('totalSeats', 0))
+        record.set('totalSeats', None)
+        self.assertEqual([('totalSeats', None)], record.fields.items())
+        self.assertEqual(None, record.get('totalSeats', 0))
+        self.assertRaises(KeyError, record.get, 'unknown')
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.valid_obj, '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.valid_obj, 'fields', {})
+
+    def test_context(self):
+        context = self.valid_obj.context
+        # the headers are mapped once, flightnumber to the schema's flightNumber
+        self.assertEqual(['carrier', 'flightNumber', 'serviceType'], context.headers[:3])
+        self.assertEqual(None, context.map_header('unknown'))
+        # the columns first, then the other fields of the schema by name
+        self.assertEqual(('carrier', 'flightNumber', 'serviceType'), context.field_names[:3])
+        self.assertEqual(sorted(FlightRecord.schema), sorted(context.field_names))
+        self.assertEqual(len(FlightRecord.schema), len(set(context.field_names)))
+        for name, position in context.positions.items():
+            self.assertEqual(name, context.field_names[position])
+        self.assertIs(context.validator, context.validator)
+        record = context.create_record(301)
+        self.assertIs(context, record.context)
+        self.assertEqual(301, record.row_count)
+
+    def test_create_days(self):
+        row = list(self.row)
+        # operates on Monday, Wednesday and Sunday
+        row[5:12] = ["1", "0", "1", "0", "0", "0", "1"]
+        self.valid_obj.create(row)
+        self.assertEqual(0b1000101, self.valid_obj.get('days'))
+        self.assertEqual(3, self.valid_obj.get('weeklyFrequency'))
+        self.assertEqual(False, self.valid_obj.get('day2'))
+        self.assertEqual(True, self.valid_obj.validate())
+
+    def test_create_days_without_day_fields(self):
+        day_fields = settings._FLIGHT_DAY_FIELDS
+        settings._FLIGHT_DAY_FIELDS = False
+        try:
+            self.valid_obj.create(self.row)
+        finally:
+            settings._FLIGHT_DAY_FIELDS = day_fields
+        self.assertEqual(0b1111111, self.valid_obj.get('days'))
+        self.assertEqual(7, self.valid_obj.get('weeklyFrequency'))
+        self.assertNotIn('day1', self.valid_obj.fields)
+        self.assertEqual(True, self.valid_obj.validate())
+
 class TestGritsAirportRecord(unittest.TestCase):
     def setUp(self):
         self.headers = [u'Code', u'Name', u'City', u'State', u'State Name',
@@ -214,6 +303,15 @@ class TestGritsAirportRecord(unittest.TestCase):
         self.valid_obj.create(self.invalid_row)
         self.assertEquals(False, self.valid_obj.validate())
 
+    def test_create_document(self):
+        self.valid_obj.create(self.row)
+        self.assertEqual(u'AAA', self.valid_obj.id)
+        self.assertEqual([('name', u'Anaa'), ('city', u'Anaa'), ('state', None),
+            ('stateName', None), ('country', None), ('countryName', u'French Polynesia'),
+            ('globalRegion', u'Australasia'), ('WAC', 823), ('notes', None),
+            ('loc', {'type': 'Point', 'coordinates': [-145.4978, -17.3517]})],
+            self.valid_obj.fields.items())
+
     def test_create_valid_obj_is_valid(self):
         self.valid_obj.create(self.row)
         self.assertEquals(True, self.valid_obj.validate())
@@ -0,0 +1,132 @@
+import unittest
+
+import mongomock
+
+from conf import settings
+from tools.grits_schedule import (clock_minutes, day_count, day_mask, day_minute, day_window_query,
+    days_query, mask_days, offset_minutes, operating_days, schedule_day_minutes, schedule_minutes,
+    time_window_query, week_minutes)
+
+def flight(id, days, departure, departure_variance, arrival, arrival_variance, indicator='0'):
+    fields = {'_id': id, 'departureTimePub': departure, 'departureUTCVariance': departure_variance,
+        'arrivalTimePub': arrival, 'arrivalUTCVariance': arrival_variance,
+        'flightArrivalDayIndicator': indicator}
+    for day in range(1, 8):
+        fields['day%d' % day] = day in days
+    fields['days'] = day_mask(days)
+    fields['departureMinutesUTC'], fields['arrivalMinutesUTC'] = schedule_minutes(fields)
+    fields['departureMinuteOfDayUTC'], fields['arrivalMinuteOfDayUTC'] = schedule_day_minutes(fields)
+    return fields
+
+class TestGritsSchedule(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(18 * 60 + 50, clock_minutes('18:50:00'))
+        self.assertEqual(8 * 60 + 30, clock_minutes('0830'))
+        self.assertEqual(None, clock_minutes(''))
+        self.assertEqual(None, clock_minutes(None))
+        self.assertEqual(-300, offset_minutes(-500))
+        self.assertEqual(330, offset_minutes(530))
+        self.assertEqual(-570, offset_minutes(-930))
+        self.assertEqual(0, offset_minutes(None))
+
+    def test_week_minutes(self):
+        # 18:50 at UTC-05:00 is 23:50 UTC of the same day
+        self.assertEqual([1430, 5750], week_minutes([1, 4], '18:50:00', -500))
+        # 01:00 at UTC+09:00 on Monday is Sunday 16:00 UTC
+        self.assertEqual([6 * 1440 + 960], week_minutes([1], '01:00:00', 900))
+        self.assertEqual(None, week_minutes([1], None, 0))
+
+    def test_schedule_minutes(self):
+        # JFK 18:50 on Sunday to LHR 07:00 the next day
+        fields = flight('a', [7], '18:50:00', -500, '07:00:00', 0, indicator='1')
+        self.assertEqual([6 * 1440 + 1430], fields['departureMinutesUTC'])
+        self.assertEqual([420], fields['arrivalMinutesUTC'])
+        self.assertEqual((1430, 420), (fields['departureMinuteOfDayUTC'], fields['arrivalMinuteOfDayUTC']))
+        fields = flight('b', [], '18:50:00', -500, '07:00:00', 0)
+        self.assertEqual([], fields['departureMinutesUTC'])
+        # the minute of the day does not depend on the operating days
+        self.assertEqual(1430, fields['departureMinuteOfDayUTC'])
+
+    def test_day_minute(self):
+        self.assertEqual(1430, day_minute('18:50:00', -500))
+        # 00:30 at UTC+01:00 is 23:30 UTC of the day before
+        self.assertEqual(1410, day_minute('00:30:00', 100))
+        self.assertEqual(960, day_minute('01:00:00', 900))
+        self.assertEqual(None, day_minute(None, 0))
+
+    def test_time_window_query(self):
+        flights = mongomock.MongoClient().db[settings._FLIGHT_COLLECTION_NAME]
+        flights.insert_many([
+            # Monday 06:30 UTC
+            flight('a', [1], '01:30:00', -500, '08:00:00', -500),
+            # Monday 12:00 UTC
+            flight('b', [1, 3], '12:00:00', 0, '14:00:00', 0),
+            # Monday 00:30 at UTC+01:00 is Sunday 23:30 UTC
+            flight('c', [1], '00:30:00', 100, '02:00:00', 100),
+            # Wednesday 07:00 UTC
+            flight('d', [3], '07:00:00', 0, '09:00:00', 0),
+        ])
+        ids = lambda query: sorted(document['_id'] for document in flights.find(query))
+        self.assertEqual(['a'], ids(time_window_query([1], '06:00', '09:00')))
+        self.assertEqual(['a', 'd'], ids(time_window_query([1, 3], '06:00', '09:00')))
+        # a window of Sunday night that ends on Monday
+        self.assertEqual(['a', 'c'], ids(time_window_query([7], '23:00', '07:00')))
+        self.assertEqual(['b'], ids(time_window_query([3], '13:00', '15:00', field='arrivalMinutesUTC')))
+        self.assertRaises(ValueError, time_window_query, [1], '06:00', '09:00', field='departureTimePub')
+
+    def test_day_window_query(self):
+        flights = mongomock.MongoClient().db[settings._FLIGHT_COLLECTION_NAME]
+        flights.insert_many([
+            # Monday 06:30 UTC
+            flight('a', [1], '01:30:00', -500, '08:00:00', -500),
+            # 12:00 UTC on Monday and Wednesday
+            flight('b', [1, 3], '12:00:00', 0, '14:00:00', 0),
+            # Monday 00:30 at UTC+01:00 is Sunday 23:30 UTC
+            flight('c', [1], '00:30:00', 100, '02:00:00', 100),
+            # Wednesday 07:00 UTC
+            flight('d', [3], '07:00:00', 0, '09:00:00', 0),
+        ])
+        ids = lambda query: sorted(document['_id'] for document in flights.find(query, {'_id': 1}))
+        self.assertEqual(['a'], ids(day_window_query([1], '06:00', '09:00')))
+        self.assertEqual(['a', 'd'], ids(day_window_query([1, 3], '06:00', '09:00')))
+        # the window is matched on the time of day of the operating days
+        self.assertEqual(['a', 'c'], ids(day_window_query([1], '23:00', '07:00')))
+        self.assertEqual(['b'], ids(day_window_query([3], '13:00', '15:00', field='arrivalMinuteOfDayUTC')))
+        self.assertEqual(['b'], ids(day_window_query([1, 3], '00:00', '24:00', every=True)))
+        self.assertEqual([], ids(day_window_query([1], '06:00', '06:00')))
+        self.assertRaises(ValueError, day_window_query, [1], '06:00', '09:00', field='departureMinutesUTC')
+        # the filter only reads the fields of the idxFlights_DaysDepartureMinuteOfDayUTC index
+        query = day_window_query([1], '23:00', '07:00')
+        fields = set(query) - set(['$or']) | set(name for clause in query['$or'] for name in clause)
+        self.assertEqual(set(['days', 'departureMinuteOfDayUTC']), fields)
+
+    def test_day_mask(self):
+        self.assertEqual(0b1000101, day_mask([1, 3, 7]))
+        self.assertEqual([1, 3, 7], mask_days(0b1000101))
+        self.assertEqual(3, day_count(0b1000101))
+        self.assertEqual(0, day_count(0))
+        self.assertRaises(ValueError, day_mask, [0])
+        self.assertRaises(ValueError, day_mask, [8])
+        # days is read before the day fields
+        self.assertEqual([2], operating_days({'days': 0b10, 'day1': True}))
+        self.assertEqual([1, 5], operating_days({'day1': True, 'day5': True, 'day6': False}))
+
+    def test_days_query(self):
+        flights = mongomock.MongoClient().db[settings._FLIGHT_COLLECTION_NAME]
+        flights.insert_many([
+            {'_id': 'weekdays', 'days': day_mask([1, 2, 3, 4, 5])},
+            {'_id': 'weekends', 'days': day_mask([6, 7])},
+            {'_id': 'saturdays', 'days': day_mask([6])},
+            {'_id': 'never', 'days': 0},
+        ])
+        ids = lambda query: sorted(document['_id'] for document in flights.find(query))
+        self.assertEqual(['saturdays', 'weekends'], ids(days_query([6])))
+        self.assertEqual(['saturdays', 'weekdays', 'weekends'], ids(days_query([1, 6])))
+        self.assertEqual(['weekends'], ids(days_query([6, 7], every=True)))
+        self.assertEqual([], ids(days_query([1, 6], every=True)))
+        # the masks of $in are the masks a $bitsAnySet would match
+        self.assertEqual([mask for mask in range(128) if mask & 0b1000010],
+            days_query([2, 7])['days']['$in'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import argparse
+import unittest
+import tempfile
+import cStringIO
+
+import mongomock
+import numpy as np
+
+from bson.binary import Binary
+
+from tools.grits_dry_run import GritsDryRunConnection
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_mongo import AirportCache
+from tools.grits_od_matrix import ODMatrix, ODMatrixBuilder
+from tools.grits_provider_type import SSIMType
+from tools.grits_record import FlightRecord
+from tools.grits_stage import FlightRowStage, key_column
+
+from conf import settings
+from tests.records import Record, airport
+from tests.test__tools_ssim_helpers import leg_record
+
+class SeatsStage(FlightRowStage):
+    columns = [('seats', np.int64, False), ('stops', np.int32, True)]
+
+    def row(self, record):
+        if record.fields.get('seats') is None:
+            return None
+        return (record.fields['seats'], record.fields.get('stops', []))
+
+class TestFlightRowStage(unittest.TestCase):
+    def test_rows(self):
+        stage = SeatsStage()
+        stage.add([Record('a', seats=100), Record('b', seats=80, stops=[1, 2]), Record('c')])
+        # a flight written again keeps its position with its last row
+        stage.add([Record('c', seats=50), Record('a', seats=120, stops=[3])])
+        self.assertEqual(3, len(stage))
+        self.assertEqual(['a', 'b', 'c'], stage.keys().tolist())
+        self.assertEqual([120, 80, 50], stage.column('seats').tolist())
+        values, offsets = stage.column('stops')
+        self.assertEqual([3, 1, 2], values.tolist())
+        self.assertEqual([0, 1, 3, 3], offsets.tolist())
+        self.assertRaises(KeyError, stage.column, 'unknown')
+
+    def test_spill(self):
+        stage = SeatsStage(spill=True)
+        stage.add([Record('a', seats=100), Record('b', seats=80, stops=[1, 2])])
+        stage.add([Record('a', seats=120, stops=[3]), Record('c', seats=50)])
+        # nothing of the rows is held in memory
+        self.assertTrue(all(isinstance(path, str) for chunk in stage.chunks for path in chunk.values()))
+        # _id, seats, stops and stopsOffsets of two chunks
+        self.assertEqual(8, len(os.listdir(stage.directory)))
+        self.assertEqual(['a', 'b', 'c'], stage.keys().tolist())
+        self.assertEqual([120, 80, 50], stage.column('seats').tolist())
+        values, offsets = stage.column('stops')
+        self.assertEqual([3, 1, 2], values.tolist())
+        self.assertEqual([0, 1, 3, 3], offsets.tolist())
+        directory = stage.directory
+        stage.close()
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(0, len(stage))
+
+    def test_empty(self):
+        stage = SeatsStage()
+        self.assertEqual(0, len(stage))
+        self.assertEqual([], stage.column('seats').tolist())
+        values, offsets = stage.column('stops')
+        self.assertEqual(([], [0]), (values.tolist(), offsets.tolist()))
+
+    def test_key_column(self):
+        keys = [Binary('\x01' * 15 + '\x00'), Binary('\x00' * 16)]
+        column = key_column(keys)
+        self.assertEqual(np.dtype('V16'), column.dtype)
+        self.assertEqual([str(key) for key in keys], [key.tobytes() for key in column])
+        self.assertEqual(np.int64, key_column([1, 2]).dtype)
+        self.assertRaises(TypeError, key_column, ['a', 1, None])
+
+class RecordingStage(SeatsStage):
+    """ keeps the types of the records it is given """
+    def __init__(self):
+        super(RecordingStage, self).__init__()
+        self.types = set()
+
+    def row(self, record):
+        self.types.add(type(record))
+        return (record.get('totalSeats'), [])
+
+class TestFileReaderStages(unittest.TestCase):
+    """ the stages fed the FlightRecords of the chunks of a GritsFileReader """
+    def setUp(self):
+        self.settings = (settings._CHUNK_SIZE, settings._THREADING_ENABLED)
+        settings._CHUNK_SIZE = 2
+        settings._THREADING_ENABLED = False
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        settings._CHUNK_SIZE, settings._THREADING_ENABLED = self.settings
+        shutil.rmtree(self.directory)
+
+    def test_reader_chunks(self):
+        db = mongomock.MongoClient().db
+        db[settings._AIRPORT_COLLECTION_NAME].insert_many([
+            airport('JFK', -73.7781, 40.6413, countryName='United States'),
+            airport('LHR', -0.4543, 51.47, countryName='United Kingdom')])
+        legs = [leg_record(carrier='AA', flightNumber='%4d' % number, serviceType='J',
+            effectiveDate='05NOV15', discontinuedDate='12MAR16', daysOfOperation='1 3 5 7',
+            departureAirport=departure, departureTimePub='0830', departureUTCVariance='-0500',
+            arrivalAirport=arrival, arrivalTimePub='2030', arrivalUTCVariance='+0000',
+            aircraftConfiguration=configuration)
+            for number, departure, arrival, configuration in [
+                (1, 'JFK', 'LHR', 'Y100'), (2, 'LHR', 'JFK', 'Y150'),
+                (3, 'JFK', 'LHR', 'Y200'), (2, 'LHR', 'JFK', 'Y180')]]
+        airport_cache = AirportCache(db)
+        reader = GritsFileReader(SSIMType(), argparse.Namespace(verbose=False,
+            infile=cStringIO.StringIO(''.join(legs))), airport_cache)
+        recording = RecordingStage()
+        od = ODMatrixBuilder(os.path.join(self.directory, 'od'))
+        reader.exports = [recording, od]
+        reader.process(GritsDryRunConnection(airport_cache))
+
+        self.assertEqual(set([FlightRecord]), recording.types)
+        # the repeated leg of the later chunk replaces the flight
+        self.assertEqual([100, 180, 200], recording.column('seats').tolist())
+        self.assertEqual(recording.keys().tolist(), od.keys().tolist())
+        od.write()
+        matrix = ODMatrix(od.path)
+        december = matrix.dense('2015-12')
+        self.assertEqual(4 * (100 + 200), december[matrix.number('JFK'), matrix.number('LHR')])
+        self.assertEqual(4 * 180, december[matrix.number('LHR'), matrix.number('JFK')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import argparse
+import unittest
+import cStringIO
+
+from datetime import datetime
+from bson.binary import Binary
+
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_mongo import AirportCache
+from tools.grits_provider_type import DiioAirportType
+from tools.grits_write_order import ExternalSorter, InvalidWriteOrder, order_records
+
+from conf import settings
+
+_SCRIPT_DIR = os.path.dirname(__file__)
+
+class Context(object):
+    def __init__(self, *names):
+        self.positions = dict((name, position) for position, name in enumerate(names))
+
+class Record(object):
+    def __init__(self, id, context=None, **fields):
+        self.id = id
+        self.context = context or Context()
+        self.fields = fields
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+class RecordingConnection(object):
+    """ keeps the keys of every bulk upsert """
+    def __init__(self):
+        self.batches = []
+
+    def bulk_upsert(self, collection_name, records, ordered=True):
+        self.batches.append([record.id for record in records])
+
+    def insert_many(self, collection_name, records):
+        pass
+
+class TestOrderRecords(unittest.TestCase):
+    def test_key_order_is_stable(self):
+        records = [Record('c', row=1), Record('a', row=2), Record('b', row=3), Record('a', row=4)]
+        ordered = order_records(records, 'key')
+        self.assertEqual([('a', 2), ('a', 4), ('b', 3), ('c', 1)],
+            [(record.id, record.fields['row']) for record in ordered])
+
+    def test_departure_order(self):
+        context = Context('departureAirport', 'discontinuedDate', 'effectiveDate')
+        records = [Record('a', context, departureAirport={'_id': 'LAX'}, effectiveDate=datetime(2015, 1, 1)),
+            Record('b', context, departureAirport={'_id': 'JFK'}, effectiveDate=datetime(2015, 2, 1)),
+            Record('c', context, departureAirport={'_id': 'JFK'}, effectiveDate=datetime(2015, 1, 1))]
+        self.assertEqual(['c', 'b', 'a'], [record.id for record in order_records(records, 'departure')])
+        # records without a departure airport fall back to the key
+        self.assertEqual(['a', 'b', 'c'], [record.id for record in
+            order_records([Record('b'), Record('c'), Record('a')], 'departure')])
+
+    def test_unknown_order(self):
+        self.assertRaises(InvalidWriteOrder, order_records, [], 'random')
+
+class TestExternalSorter(unittest.TestCase):
+    def test_runs_are_merged(self):
+        sorter = ExternalSorter(run_size=2)
+        sorter.add([Record('d', row=1), Record('b', row=2), Record('a', row=3)])
+        sorter.add([Record('b', row=4), Record('c', row=5)])
+        self.assertEqual(2, len(sorter.runs))
+        records = list(sorter.records())
+        # the key added last wins
+        self.assertEqual([('a', 3), ('b', 4), ('c', 5), ('d', 1)],
+            [(record.id, record.fields['row']) for record in records])
+        self.assertEqual([3, 1], [len(batch) for batch in sorter.batches(3)])
+        runs = list(sorter.runs)
+        sorter.close()
+        self.assertFalse(any(os.path.exists(path) for path in runs))
+
+    def test_binary_keys(self):
+        sorter = ExternalSorter(run_size=1)
+        sorter.add([Record(Binary('\x02' * 16), row=1), Record(Binary('\x01' * 16), row=2)])
+        records = list(sorter.records())
+        sorter.close()
+        self.assertEqual([Binary('\x01' * 16), Binary('\x02' * 16)], [record.id for record in records])
+        self.assertTrue(isinstance(records[0].id, Binary))
+
+    def test_presort_import(self):
+        presort, chunk_size, run_size = settings._PRESORT, settings._CHUNK_SIZE, settings._PRESORT_RUN_SIZE
+        threading_enabled = settings._THREADING_ENABLED
+        settings._PRESORT, settings._CHUNK_SIZE, settings._PRESORT_RUN_SIZE = True, 10, 15
+        settings._THREADING_ENABLED = False
+        try:
+            with open(os.path.join(_SCRIPT_DIR, 'data/MiExpressAllAirportCodes.tsv'), 'rb') as f:
+                lines = [f.readline() for i in range(50)]
+            program_arguments = argparse.Namespace(verbose=False,
+                infile=cStringIO.StringIO(''.join(lines)))
+            connection = RecordingConnection()
+            reader = GritsFileReader(DiioAirportType(), program_arguments, AirportCache())
+            reader.process(connection)
+            keys = [key for batch in connection.batches for key in batch]
+            self.assertEqual(reader.valid_count, len(keys))
+            self.assertEqual(sorted(keys), keys)
+            self.assertTrue(max(len(batch) for batch in connection.batches) <= 10)
+        finally:
+            settings._PRESORT, settings._CHUNK_SIZE, settings._PRESORT_RUN_SIZE = presort, chunk_size, run_size
+            settings._THREADING_ENABLED = threading_enabled
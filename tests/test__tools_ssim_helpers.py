@@ -0,0 +1,107 @@
+import argparse
+import unittest
+import cStringIO
+
+from datetime import datetime
+
+from tools.grits_dry_run import GritsDryRunConnection
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_mongo import AirportCache
+from tools.grits_provider_type import SSIMType
+from tools.grits_record import FlightRecord, RecordContext
+from tools.ssim_helpers import SSIM_COLUMNS, SSIMReader, parse_leg, ssim_date
+
+from conf import settings
+
+def leg_record(**fields):
+    """ a type 3 record with the fields at their SSIM columns """
+    columns = {'carrier': 3, 'flightNumber': 6, 'itineraryVariation': 10,
+        'legSequence': 12, 'serviceType': 14,
+        'effectiveDate': 15, 'discontinuedDate': 22, 'daysOfOperation': 29,
+        'departureAirport': 37, 'departureTimePub': 40, 'departureUTCVariance': 48,
+        'arrivalAirport': 55, 'arrivalTimePub': 62, 'arrivalUTCVariance': 66,
+        'aircraftConfiguration': 173, 'arrivalDateVariation': 194}
+    line = ['3'] + [' '] * 199
+    for name, value in fields.items():
+        first = columns[name] - 1
+        line[first:first + len(value)] = list(value)
+    return ''.join(line) + '\n'
+
+_LEG = leg_record(carrier='AA', flightNumber='  12', serviceType='J',
+    effectiveDate='05NOV15', discontinuedDate='12MAR16', daysOfOperation='1 3 5 7',
+    departureAirport='JFK', departureTimePub='0830', departureUTCVariance='-0500',
+    arrivalAirport='LAX', arrivalTimePub='1159', arrivalUTCVariance='-0800',
+    aircraftConfiguration='J20Y150', arrivalDateVariation='A')
+
+class TestSSIMHelpers(unittest.TestCase):
+    def test_parse_leg(self):
+        row = dict(zip(SSIM_COLUMNS, parse_leg(_LEG)))
+        self.assertEqual('AA', row['carrier'])
+        self.assertEqual('12', row['flightNumber'])
+        self.assertEqual('05/11/2015', row['effectiveDate'])
+        self.assertEqual(['1', '0', '1', '0', '1', '0', '1'],
+            [row['day%d' % day] for day in range(1, 8)])
+        self.assertEqual('08:30:00', row['departureTimePub'])
+        self.assertEqual('-0500', row['departureUTCVariance'])
+        self.assertEqual('-1', row['flightArrivalDayIndicator'])
+        self.assertEqual('170', row['totalSeats'])
+
+    def test_trimmed_record(self):
+        self.assertEqual(parse_leg(_LEG), parse_leg(_LEG.rstrip() + '\r\n'))
+
+    def test_open_ended_date(self):
+        # a leg that runs until further notice
+        leg = _LEG.replace('12MAR16', '00XXX00')
+        airport_cache = AirportCache()
+        airport_cache.load([{'_id': 'JFK'}, {'_id': 'LAX'}])
+        provider_type = SSIMType()
+        context = RecordContext(FlightRecord, [column.lower() for column in SSIM_COLUMNS],
+            provider_type.map, provider_type.collection_name, None, airport_cache)
+        record = context.create_record(0)
+        record.create(parse_leg(leg))
+        self.assertTrue(record.validate(), record.validation_errors())
+        self.assertEqual(datetime(2099, 12, 31), record.get('discontinuedDate'))
+        self.assertEqual('', ssim_date('05XYZ15'))
+
+    def test_reader_skips_other_records(self):
+        data = '1AIRLINE STANDARD SCHEDULE DATA SET\n' + '0' * 200 + '\n2UAA\n' + _LEG + '5\n'
+        rows = list(SSIMReader(cStringIO.StringIO(data)))
+        self.assertEqual([SSIM_COLUMNS, parse_leg(_LEG)], rows)
+
+    def test_reader_merges_legs(self):
+        # AA 12 from JFK to LAX by way of ORD, followed by AA 13 of one leg
+        first = _LEG.replace('LAX', 'ORD')
+        first = first[:9] + '0101' + first[13:]
+        second = _LEG.replace('JFK', 'ORD').replace('Y150', 'Y100')
+        second = second[:9] + '0102' + second[13:]
+        other = _LEG.replace('AA   12', 'AA   13')
+        rows = list(SSIMReader(cStringIO.StringIO(first + second + other)))
+        self.assertEqual(3, len(rows))
+        row = dict(zip(SSIM_COLUMNS, rows[1]))
+        self.assertEqual('JFK', row['departureAirport'])
+        self.assertEqual('08:30:00', row['departureTimePub'])
+        self.assertEqual('LAX', row['arrivalAirport'])
+        self.assertEqual('11:59:00', row['arrivalTimePub'])
+        self.assertEqual('1', row['stops'])
+        self.assertEqual('ORD', row['stopCodes'])
+        self.assertEqual('170', row['totalSeats'])
+        self.assertEqual(parse_leg(other), rows[2])
+
+    def test_flight_records(self):
+        threading_enabled = settings._THREADING_ENABLED
+        settings._THREADING_ENABLED = False
+        try:
+            airport_cache = AirportCache()
+            airport_cache.load([{'_id': 'JFK', 'loc': {'type': 'Point', 'coordinates': [-73.8, 40.6]}},
+                {'_id': 'LAX', 'loc': {'type': 'Point', 'coordinates': [-118.4, 33.9]}}])
+            connection = GritsDryRunConnection(airport_cache)
+            # a leg to an unknown airport is invalid
+            legs = (_LEG + _LEG.replace('AA   12', 'AA   13') +
+                _LEG.replace('AA   12', 'AA   14').replace('LAX', 'ZZZ'))
+            program_arguments = argparse.Namespace(verbose=False, infile=cStringIO.StringIO(legs))
+            GritsFileReader(SSIMType(), program_arguments, airport_cache).process(connection)
+            # the first leg of the file is read
+            self.assertEqual(2, connection.valid)
+            self.assertEqual(1, connection.invalid)
+        finally:
+            settings._THREADING_ENABLED = threading_enabled
@@ -0,0 +1,74 @@
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+""" directories of .npy arrays written by the import stages
+
+Each array of an artifact is a .npy file of the directory, which np.load maps
+into memory instead of reading, with a meta.json of the scalars.  Artifacts
+are written to a temporary directory next to the target and renamed over it,
+so readers never see a partial artifact.
+"""
+
+_META_FILE = 'meta.json'
+
+def write_arrays(path, arrays, meta=None):
+    """ replace the artifact at path with the arrays
+
+        Parameters
+        ----------
+            path : str
+                The directory of the artifact
+            arrays : dict
+                The numpy arrays by name, or an iterable of (name, array)
+                pairs, which are written one at a time
+            meta : dict
+                Optional JSON values stored with the arrays
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    directory = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(path), dir=parent)
+    try:
+        for name, array in (arrays.items() if isinstance(arrays, dict) else arrays):
+            np.save(os.path.join(directory, name + '.npy'), array)
+        with open(os.path.join(directory, _META_FILE), 'w') as f:
+            json.dump(meta or {}, f, indent=2, sort_keys=True)
+        previous = None
+        if os.path.exists(path):
+            previous = directory + '.previous'
+            os.rename(path, previous)
+        os.rename(directory, path)
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+def load_arrays(path, names, mmap_mode='r'):
+    """ the arrays and the meta of an artifact
+
+        Parameters
+        ----------
+            path : str
+                The directory of the artifact
+            names : list
+                The names of the arrays
+            mmap_mode : str
+                The mode of np.load, None reads the arrays into memory
+
+        Returns
+        -------
+            tuple
+                The dict of the arrays by name and the dict of the meta
+    """
+    arrays = {}
+    for name in names:
+        arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+    with open(os.path.join(path, _META_FILE)) as f:
+        meta = json.load(f)
+    return arrays, meta
@@ -0,0 +1,367 @@
+import time
+import logging
+import threading
+
+try:
+    from concurrent import futures
+    from tornado import gen, locks
+    from tornado.ioloop import IOLoop
+    coroutine = gen.coroutine
+except ImportError:
+    gen = None
+    coroutine = lambda function: function
+try:
+    import motor.motor_tornado
+except ImportError:
+    motor = None
+
+from conf import settings
+from tools.grits_chunk_writer import GritsChunkWriter, new_counts
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_mongo import ConnectionRegistry, GritsMongoConnection
+from tools.grits_metrics import metrics
+from tools.grits_profiler import profiler
+
+""" an optional ingestion engine for a remote, high-latency mongoDB
+
+The threads of GritsFileReader mostly wait on the round trip of each airport
+find_one and each bulk write.  This engine runs the mongoDB operations on a
+single tornado event loop through the motor driver instead: the airports of a
+chunk are looked up in a few concurrent $in queries before its records are
+created, and the bulk writes of a chunk are left in flight while the next
+chunk is read.  The records are created and validated exactly as in
+GritsFileReader.
+"""
+
+class AsyncEngineUnavailable(Exception):
+    """ custom exception that is thrown when the async engine is used without
+    its optional dependencies """
+    def __init__(self, message, *args, **kwargs):
+        """ AsyncEngineUnavailable constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(AsyncEngineUnavailable, self).__init__(message)
+
+def _resolve(source, target):
+    """ copy the outcome of a tornado future onto a concurrent future """
+    exc_info = source.exc_info()
+    if exc_info is not None:
+        target.set_exception_info(exc_info[1], exc_info[2])
+    else:
+        target.set_result(source.result())
+
+class GritsAsyncEngine(object):
+    """ runs mongoDB operations concurrently on an event loop thread
+
+        The operations are submitted from the reading thread and return a
+        concurrent.futures.Future.  A semaphore keeps at most concurrency of
+        them in flight, the rest wait on the event loop.
+    """
+
+    def __init__(self, mongo_connection=None, db=None, concurrency=None):
+        """ GritsAsyncEngine constructor
+
+            Parameters
+            ----------
+                mongo_connection: object
+                    The GritsMongoConnection whose uri and database motor
+                    connects to
+                db : object
+                    Optional database with the motor interface, used instead
+                    of connecting through the mongo_connection
+                concurrency : int
+                    The number of operations in flight, defaults to
+                    settings._ASYNC_CONCURRENCY
+
+            Raises
+            ------
+                AsyncEngineUnavailable
+                    If tornado or motor is not installed
+        """
+        if gen is None or (motor is None and db is None):
+            raise AsyncEngineUnavailable('the async engine requires motor, install it with "pip install motor"')
+        self.concurrency = concurrency or settings._ASYNC_CONCURRENCY
+        self.semaphore = locks.Semaphore(self.concurrency)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop = IOLoop(make_current=False)
+        self.client = None
+        if db is None:
+            # a motor client belongs to its event loop, so it is not shared
+            # through the registry but has the options of the same profile
+            self.client = motor.motor_tornado.MotorClient(mongo_connection.uri(),
+                io_loop=self.loop, **ConnectionRegistry.options(mongo_connection.profile))
+            db = self.client[mongo_connection.db.name]
+        self.db = db
+        self.writer = GritsChunkWriter(db)
+        self._thread = threading.Thread(target=self._run_loop, name='grits-async')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_loop(self):
+        self.loop.make_current()
+        self.loop.start()
+
+    def close(self):
+        """ stop the event loop and close the motor client """
+        self.loop.add_callback(self.loop.stop)
+        self._thread.join()
+        if self.client is not None:
+            self.client.close()
+        self.loop.close()
+        logging.debug('async engine: at most %d of %d operations in flight',
+            self.max_in_flight, self.concurrency)
+
+    def submit(self, coroutine, *args):
+        """ run a coroutine on the event loop
+
+            Parameters
+            ----------
+                coroutine : function
+                    A tornado coroutine
+                args : list
+                    The arguments of the coroutine
+
+            Returns
+            -------
+                concurrent.futures.Future
+                    Resolved with the result of the coroutine
+        """
+        future = futures.Future()
+        def start():
+            coroutine(*args).add_done_callback(lambda result: _resolve(result, future))
+        self.loop.add_callback(start)
+        return future
+
+    @coroutine
+    def _bounded(self, operation, *args, **kwargs):
+        """ await operation(*args, **kwargs) once the semaphore allows it """
+        with (yield self.semaphore.acquire()):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                result = yield operation(*args, **kwargs)
+            finally:
+                self.in_flight -= 1
+        raise gen.Return(result)
+
+    @coroutine
+    def _find_airports(self, codes):
+        cursor = self.db[settings._AIRPORT_COLLECTION_NAME].find({'_id': {'$in': codes}})
+        airports = yield self._bounded(cursor.to_list, None)
+        raise gen.Return(airports)
+
+    def find_airports(self, codes):
+        """ look up airports in concurrent queries of
+        settings._ASYNC_LOOKUP_BATCH_SIZE codes
+
+            Parameters
+            ----------
+                codes : list
+                    The airport codes
+
+            Returns
+            -------
+                list
+                    The airport documents that exist
+        """
+        size = settings._ASYNC_LOOKUP_BATCH_SIZE
+        lookups = [self.submit(self._find_airports, codes[start:start + size])
+            for start in range(0, len(codes), size)]
+        airports = []
+        for lookup in lookups:
+            airports.extend(lookup.result())
+        return airports
+
+    @coroutine
+    def _write(self, collection_name, op, documents, ordered, stage):
+        """ drive the steps of GritsChunkWriter on the event loop, so the
+        retries and dead letters are those of a synchronous write """
+        counts = new_counts()
+        collection = self.db[collection_name]
+        steps = self.writer.steps(collection_name, op, documents, ordered, counts)
+        start = time.time()
+        try:
+            step = next(steps)
+            while True:
+                kind, value = step
+                if kind == 'sleep':
+                    yield gen.sleep(value)
+                    step = steps.send(None)
+                    continue
+                try:
+                    result = yield self._bounded(collection.bulk_write, value, ordered=ordered)
+                except Exception as e:
+                    step = steps.throw(e)
+                else:
+                    step = steps.send(result)
+        except StopIteration:
+            pass
+        elapsed = time.time() - start
+        profiler.add(stage, elapsed)
+        metrics.observe('grits_mongo_write_seconds', elapsed, op=stage)
+        metrics.inc('grits_mongo_documents_written_total', len(documents), op=stage)
+        raise gen.Return(GritsMongoConnection.format_bulk_write_results(counts))
+
+    def bulk_upsert(self, collection_name, records, ordered=True):
+        """ start the bulk upsert of records, as
+        GritsMongoConnection.bulk_upsert
+
+            Returns
+            -------
+                concurrent.futures.Future
+                    Resolved with the formatted result once written
+        """
+        documents = [{'_id': record.id, 'fields': record.fields} for record in records]
+        return self.submit(self._write, collection_name, 'upsert', documents, ordered, 'bulk_upsert')
+
+    def insert_many(self, collection_name, records):
+        """ start the insert of records, as GritsMongoConnection.insert_many
+
+            Returns
+            -------
+                concurrent.futures.Future
+                    Resolved with the formatted result once written
+        """
+        documents = [record.fields for record in records]
+        return self.submit(self._write, collection_name, 'insert', documents, False, 'insert_many')
+
+class GritsAsyncFileReader(GritsFileReader):
+    """ a GritsFileReader that looks up airports and writes through a
+    GritsAsyncEngine
+
+        The airports of a chunk that are not cached yet are fetched before
+        its rows are processed, so creating the records no longer waits on
+        mongoDB and needs no thread pool.  The writes of a chunk stay in
+        flight while the following chunks are read, up to
+        settings._ASYNC_PENDING_WRITES of them.  Writes are only overlapped
+        when they cannot touch the same flight: without a deduplicator, with
+        history, or when a chunk overwrites a key of an earlier chunk, the
+        earlier writes are awaited first.
+    """
+
+    def __init__(self, provider_type, program_arguments, airport_cache=None, engine=None):
+        """ GritsAsyncFileReader constructor
+
+            Parameters
+            ----------
+                provider_type : object
+                    A provider type object from grits_provider_type.py
+                program_arguments: dict
+                    A dict containing the argparse program arguments
+                airport_cache: object
+                    Optional AirportCache from grits_mongo.py, one is created
+                    from the mongo_connection when not provided
+                engine: object
+                    Optional GritsAsyncEngine shared with other readers, one
+                    is created for the file when not provided
+        """
+        GritsFileReader.__init__(self, provider_type, program_arguments, airport_cache)
+        self.engine = engine
+        self.pending = []
+        self.overwritten = 0
+
+    def process(self, mongo_connection):
+        """ process the file, see GritsFileReader.process """
+        own_engine = self.engine is None
+        if own_engine:
+            self.engine = GritsAsyncEngine(mongo_connection)
+        try:
+            GritsFileReader.process(self, mongo_connection)
+        finally:
+            if own_engine:
+                self.engine.close()
+                self.engine = None
+
+    def airport_codes(self, chunk):
+        """ the airport codes referenced by the rows of a chunk """
+        codes = set()
+        for position, header in enumerate(self.context.headers or []):
+            if header is None:
+                continue
+            header = header.lower()
+            if header not in ('departureairport', 'arrivalairport', 'stopcodes'):
+                continue
+            for row_number, row in chunk:
+                if position >= len(row):
+                    continue
+                if header == 'stopcodes':
+                    codes.update(code for code in row[position].split('!') if code != '')
+                else:
+                    codes.add(row[position])
+        return codes
+
+    def process_chunk(self, chunk):
+        """ prefetch the airports of the chunk, then create and validate its
+        records synchronously """
+        missing = self.airport_cache.missing(self.airport_codes(chunk))
+        if len(missing) > 0:
+            with profiler.timer('airport'):
+                airports = self.engine.find_airports(sorted(missing))
+            self.airport_cache.prefetched(missing, airports)
+
+        valid_records = []
+        invalid_records = []
+        for data in chunk:
+            valid, invalid = self.process_row(data)
+            if valid != None: valid_records.append(valid)
+            if invalid != None: invalid_records.append(invalid)
+        return valid_records, invalid_records
+
+    def write_chunk(self, mongo_connection, valid_records, invalid_records):
+        """ start the writes of a chunk without waiting for them """
+        overtakes = self.deduplicator is None or self.history is not None
+        if self.deduplicator is not None:
+            overtakes = overtakes or self.deduplicator.overwritten > self.overwritten
+            self.overwritten = self.deduplicator.overwritten
+        if overtakes:
+            # a flight of an earlier chunk must be written before it is
+            # compared or written again
+            self.flush()
+
+        ordered = self.deduplicator is None
+        for batch in GritsFileReader.gen_batches(valid_records, settings._BATCH_SIZE):
+            if len(batch) == 0:
+                continue
+            if self.history is not None:
+                self.history.record(batch)
+            if self.counts is not None:
+                self.counts.add_records(self.provider_type, batch)
+            for export in self.exports:
+                export.add(batch)
+            if ordered:
+                self.flush()
+            self.pending.append(self.engine.bulk_upsert(self.provider_type.collection_name, batch, ordered))
+        if self.counts is not None:
+            self.counts.add_invalid(len(invalid_records))
+        if len(invalid_records) > 0:
+            self.pending.append(self.engine.insert_many(self.invalid_collection_name, invalid_records))
+
+        # bound the records held by the writes in flight
+        while len(self.pending) > settings._ASYNC_PENDING_WRITES:
+            with profiler.timer('write_wait'):
+                done, not_done = futures.wait(self.pending, return_when=futures.FIRST_COMPLETED)
+            self.collect(done)
+            self.pending = list(not_done)
+
+    def collect(self, done):
+        """ log and count the results of finished writes, raising their
+        errors """
+        for write in done:
+            result = write.result()
+            logging.debug('write_result: %r', result)
+            if self.counts is not None:
+                self.counts.add_result(result)
+
+    def flush(self):
+        """ wait for every write in flight """
+        if len(self.pending) == 0:
+            return
+        with profiler.timer('write_wait'):
+            futures.wait(self.pending)
+        pending, self.pending = self.pending, []
+        self.collect(pending)
@@ -0,0 +1,212 @@
+import os
+import re
+import glob
+import time
+import Queue
+import logging
+import argparse
+import threading
+import collections
+
+from datetime import datetime
+
+from conf import settings
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_history import GritsHistory
+from tools.grits_mongo import AirportCache
+
+# deliverables are named with their date, e.g. EcoHealth_20151102.csv
+_FILENAME_DATE = re.compile(r'_(\d{8})(?:\D|$)')
+
+def deliverable_date(path):
+    """ the date of a deliverable, from its filename or else its modification
+    time
+
+        Parameters
+        ----------
+            path : str
+                The path of the file
+
+        Returns
+        -------
+            datetime
+                The date used to order the files of a batch
+    """
+    match = _FILENAME_DATE.search(os.path.basename(path))
+    if match is not None:
+        try:
+            return datetime.strptime(match.group(1), '%Y%m%d')
+        except ValueError:
+            pass
+    return datetime.utcfromtimestamp(os.path.getmtime(path))
+
+def batch_files(pattern):
+    """ the files of a batch in date order
+
+        Parameters
+        ----------
+            pattern : str
+                A directory or a glob pattern
+
+        Returns
+        -------
+            list
+                The paths with an allowed extension, oldest deliverable first
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    paths = [path for path in glob.glob(pattern) if os.path.isfile(path) and
+        os.path.splitext(path)[1].lower() in settings._ALLOWED_FILE_EXTENSIONS]
+    return sorted(paths, key=lambda path: (deliverable_date(path), path))
+
+class GritsBatch(object):
+    """ imports several files in one process
+
+        The files share the mongoDB connection, the airport cache and the
+        thread pool of the file readers, so the indexes are dropped, the legs
+        cleared and each airport read only once for the whole batch.  Files
+        are imported one after the other in date order, so a later deliverable
+        overwrites the flights of an earlier one.  With concurrency greater
+        than one several files are imported at the same time and that order
+        is no longer guaranteed.
+    """
+
+    def __init__(self, provider_type, program_arguments, mongo_connection,
+            airport_cache=None, concurrency=1, history=False, reader_class=GritsFileReader,
+            counts=None, exports=None):
+        """ GritsBatch constructor
+
+            Parameters
+            ----------
+                provider_type : object
+                    A provider type object from grits_provider_type.py
+                program_arguments: dict
+                    A dict containing the argparse program arguments
+                mongo_connection: object
+                    A GritsMongoConnection object from grits_mongo.py
+                airport_cache: object
+                    Optional AirportCache from grits_mongo.py, one is created
+                    from the mongo_connection when not provided
+                concurrency: int
+                    The number of files imported at the same time
+                history: bool
+                    Record the changes of each file in the flight history,
+                    which requires the files to be imported in date order
+                reader_class: class
+                    The reader created for each file, called with the
+                    provider type, the program arguments and the airport
+                    cache
+                counts: object
+                    Optional ImportCounts from grits_counts.py shared by the
+                    readers of the files
+                exports: list
+                    Optional stages, such as an ODMatrixBuilder, shared by
+                    the readers of the files
+        """
+        self.provider_type = provider_type
+        self.program_arguments = program_arguments
+        self.mongo_connection = mongo_connection
+        if airport_cache is None:
+            airport_cache = AirportCache(mongo_connection.db)
+        self.airport_cache = airport_cache
+        self.concurrency = max(concurrency, 1)
+        self.history = history
+        self.reader_class = reader_class
+        self.counts = counts
+        self.exports = exports or []
+        self.summaries = []
+        self._lock = threading.Lock()
+
+    def import_file(self, path):
+        """ import a single file of the batch
+
+            Parameters
+            ----------
+                path : str
+                    The path of the file
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The summary of the file
+        """
+        summary = collections.OrderedDict()
+        summary['file'] = path
+        start = time.time()
+        try:
+            file_arguments = argparse.Namespace(**vars(self.program_arguments))
+            with open(path, 'rb') as infile:
+                file_arguments.infile = infile
+                # a new provider type per file, the calibrator changes its
+                # collection name
+                provider_type = type(self.provider_type)()
+                provider_type.collection_name = self.provider_type.collection_name
+                reader = self.reader_class(provider_type, file_arguments, self.airport_cache)
+                reader.counts = self.counts
+                reader.exports = self.exports
+                if self.history:
+                    reader.history = GritsHistory(self.mongo_connection.db,
+                        deliverable_date(path), provider_type.collection_name)
+                reader.process(self.mongo_connection)
+            summary['rows'] = reader.rows_read
+            summary['valid'] = reader.valid_count
+            summary['invalid'] = reader.invalid_count
+            summary['duplicates'] = reader.duplicate_count
+            summary['error'] = None
+        except Exception as e:
+            logging.exception('failed to import %s', path)
+            summary['rows'] = summary['valid'] = summary['invalid'] = summary['duplicates'] = 0
+            summary['error'] = str(e)
+        summary['seconds'] = time.time() - start
+        logging.info('%s: %d rows, %d valid, %d invalid, %d duplicates in %.1fs%s', path,
+            summary['rows'], summary['valid'], summary['invalid'], summary['duplicates'],
+            summary['seconds'],
+            '' if summary['error'] is None else ' (failed: %s)' % summary['error'])
+        with self._lock:
+            self.summaries.append(summary)
+        return summary
+
+    def run(self, paths):
+        """ import the files
+
+            Parameters
+            ----------
+                paths : list
+                    The paths of the files in the order to import them
+
+            Returns
+            -------
+                list
+                    A summary per file, in the order of paths
+        """
+        if self.concurrency == 1 or len(paths) <= 1:
+            for path in paths:
+                self.import_file(path)
+        else:
+            # plain threads rather than a pathos pool, as the readers of the
+            # files already share the pathos pool of _NODES threads
+            queue = Queue.Queue()
+            for path in paths:
+                queue.put(path)
+
+            def worker():
+                while True:
+                    try:
+                        path = queue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    self.import_file(path)
+
+            workers = [threading.Thread(target=worker) for i in range(min(self.concurrency, len(paths)))]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+        order = dict((path, position) for position, path in enumerate(paths))
+        self.summaries.sort(key=lambda summary: order[summary['file']])
+        return self.summaries
+
+    def failed(self):
+        """ the summaries of the files that could not be imported """
+        return [summary for summary in self.summaries if summary['error'] is not None]
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import itertools
+
+from datetime import datetime
+
+from conf import settings
+from tools.grits_file_reader import GritsFileReader
+from tools.grits_metrics import metrics
+from tools.grits_mongo import AirportCache
+from tools.grits_profiler import profiler
+
+def profile_key(program_arguments):
+    """ the key of a calibration within the profile file, which identifies the
+    host running the import and the mongoDB target """
+    return '%s|%s/%s' % (socket.gethostname(), program_arguments.mongohost,
+        program_arguments.database)
+
+def load_profiles(path=None):
+    """ load all calibrations from the profile file
+
+        Parameters
+        ----------
+            path : str
+                The profile file, defaults to settings._CALIBRATION_PROFILE
+
+        Returns
+        -------
+            dict
+                Calibrations keyed by profile_key, empty if there is no file
+    """
+    path = path or settings._CALIBRATION_PROFILE
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError as e:
+        logging.error('ignoring unreadable calibration profile %s: %s', path, e)
+        return {}
+
+def save_profile(program_arguments, calibration, path=None):
+    """ store a calibration in the profile file under this host and mongoDB
+    target, keeping the calibrations of other targets
+
+        Parameters
+        ----------
+            program_arguments : dict
+                A dict containing the argparse program arguments
+            calibration : dict
+                The calibration to store
+            path : str
+                The profile file, defaults to settings._CALIBRATION_PROFILE
+    """
+    path = path or settings._CALIBRATION_PROFILE
+    profiles = load_profiles(path)
+    profiles[profile_key(program_arguments)] = calibration
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+def apply_profile(program_arguments, path=None):
+    """ replace _NODES, _CHUNK_SIZE and _BATCH_SIZE with the calibration for
+    this host and mongoDB target, if there is one
+
+        Parameters
+        ----------
+            program_arguments : dict
+                A dict containing the argparse program arguments
+            path : str
+                The profile file, defaults to settings._CALIBRATION_PROFILE
+
+        Returns
+        -------
+            dict
+                The calibration that was applied or None
+    """
+    calibration = load_profiles(path).get(profile_key(program_arguments))
+    if calibration is None:
+        return None
+    settings._NODES = calibration['nodes']
+    settings._CHUNK_SIZE = calibration['chunk_size']
+    settings._BATCH_SIZE = calibration['batch_size']
+    logging.info('using calibrated nodes=%d chunk_size=%d batch_size=%r (%.0f rows/sec on %s)',
+        settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE,
+        calibration['rows_per_second'], calibration['date'])
+    return calibration
+
+class SampleType(object):
+    """ a provider type that reads the rows sampled by the calibrator instead
+    of a file, and writes to the scratch collection """
+
+    def __init__(self, provider_type, rows):
+        """ SampleType constructor
+
+            Parameters
+            ----------
+                provider_type : object
+                    A provider type object from grits_provider_type.py
+                rows : list
+                    The rows of the sample, with those before the data
+        """
+        self.provider_type = provider_type
+        self.rows = rows
+        self.collection_name = settings._CALIBRATION_COLLECTION_NAME
+
+    def __getattr__(self, name):
+        return getattr(self.provider_type, name)
+
+    def reader(self, f):
+        """ iterate over the rows of the sample """
+        return iter(self.rows)
+
+class GritsCalibrator(object):
+    """ finds the fastest _NODES, _CHUNK_SIZE and _BATCH_SIZE for this host and
+    mongoDB target by running short trial imports
+
+        The first settings._CALIBRATION_ROWS rows of the infile are imported
+        into a scratch collection once for every combination of the
+        calibration grids.  The airport cache is warmed before the first trial
+        and shared, so every trial measures the steady state of an import.
+    """
+
+    def __init__(self, provider_type, program_arguments, mongo_connection):
+        """ GritsCalibrator constructor
+
+            Parameters
+            ----------
+                provider_type : object
+                    A provider type object from grits_provider_type.py
+                program_arguments: dict
+                    A dict containing the argparse program arguments
+                mongo_connection: object
+                    A GritsMongoConnection object from grits_mongo.py
+        """
+        self.provider_type = provider_type
+        self.program_arguments = program_arguments
+        self.mongo_connection = mongo_connection
+        self.airport_cache = AirportCache(mongo_connection.db)
+        self.results = []
+        self.sample_rows = 0
+
+    def read_sample(self):
+        """ read the first rows of the infile into memory, parsed by the
+        reader of the provider type so a quoted field is never cut """
+        last_row = self.provider_type.data_position + settings._CALIBRATION_ROWS
+        reader = self.provider_type.reader(self.program_arguments.infile)
+        rows = list(itertools.islice(reader, last_row))
+        self.sample_rows = max(len(rows) - self.provider_type.data_position, 1)
+        return rows
+
+    def trial(self, sample, nodes, chunk_size, batch_size):
+        """ import the sample into the scratch collection
+
+            Parameters
+            ----------
+                sample : list
+                    The rows of the sample, see read_sample
+                nodes : int
+                    The value of _NODES for the trial
+                chunk_size : int
+                    The value of _CHUNK_SIZE for the trial
+                batch_size : int
+                    The value of _BATCH_SIZE for the trial
+
+            Returns
+            -------
+                float
+                    The throughput of the trial in rows per second
+        """
+        db = self.mongo_connection.db
+        db[settings._CALIBRATION_COLLECTION_NAME].drop()
+        db[settings._CALIBRATION_COLLECTION_NAME + 'Invalid'].drop()
+
+        saved = (settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE)
+        settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE = nodes, chunk_size, batch_size
+        try:
+            trial_arguments = argparse.Namespace(**vars(self.program_arguments))
+            trial_arguments.infile = None
+            trial_arguments.verbose = False
+            reader = GritsFileReader(SampleType(self.provider_type, sample), trial_arguments,
+                self.airport_cache)
+            reader.invalid_collection_name = settings._CALIBRATION_COLLECTION_NAME + 'Invalid'
+            start = time.time()
+            reader.process(self.mongo_connection)
+            elapsed = time.time() - start
+        finally:
+            settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE = saved
+
+        return self.sample_rows / max(elapsed, 1e-9)
+
+    def run_trials(self, sample):
+        """ run the trial of every combination of the calibration grids """
+        # warm the airport cache and the mongoDB working set
+        self.trial(sample, settings._NODES, settings._CHUNK_SIZE, settings._BATCH_SIZE)
+
+        grid = itertools.product(settings._CALIBRATION_NODES,
+            settings._CALIBRATION_CHUNK_SIZES, settings._CALIBRATION_BATCH_SIZES)
+        for nodes, chunk_size, batch_size in grid:
+            if batch_size is not None and batch_size >= chunk_size:
+                # equivalent to writing the whole chunk at once
+                continue
+            rows_per_second = self.trial(sample, nodes, chunk_size, batch_size)
+            logging.info('calibration nodes=%d chunk_size=%d batch_size=%r: %.0f rows/sec',
+                nodes, chunk_size, batch_size, rows_per_second)
+            self.results.append((rows_per_second, nodes, chunk_size, batch_size))
+
+    def run(self):
+        """ run every trial and store the fastest in the calibration profile
+
+            Returns
+            -------
+                dict
+                    The chosen calibration
+        """
+        sample = self.read_sample()
+        # the trials are not part of the metrics or the --profile report of
+        # the run, the profiler is suspended and the metrics are discarded
+        profiling = profiler.enabled
+        profiler.enabled = False
+        try:
+            self.run_trials(sample)
+        finally:
+            profiler.enabled = profiling
+            metrics.reset()
+
+        db = self.mongo_connection.db
+        db[settings._CALIBRATION_COLLECTION_NAME].drop()
+        db[settings._CALIBRATION_COLLECTION_NAME + 'Invalid'].drop()
+
+        rows_per_second, nodes, chunk_size, batch_size = max(self.results)
+        calibration = {
+            'nodes': nodes,
+            'chunk_size': chunk_size,
+            'batch_size': batch_size,
+            'rows_per_second': rows_per_second,
+            'date': datetime.utcnow().isoformat()}
+        save_profile(self.program_arguments, calibration)
+        logging.info('calibrated nodes=%d chunk_size=%d batch_size=%r: %.0f rows/sec',
+            nodes, chunk_size, batch_size, rows_per_second)
+        return calibration
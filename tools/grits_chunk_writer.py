@@ -0,0 +1,434 @@
+import os
+import time
+import logging
+import threading
+import collections
+
+from datetime import datetime
+
+import pymongo
+from bson import json_util
+from bson.json_util import JSONOptions
+
+from conf import settings
+from tools.grits_metrics import metrics
+
+# server error codes of failures a retry can succeed after: network errors, a
+# primary stepping down or shutting down, and write conflicts
+_TRANSIENT_ERROR_CODES = frozenset([6, 7, 89, 91, 112, 189, 262, 9001, 10107,
+    11600, 11602, 13435, 13436])
+
+_DUPLICATE_KEY = 11000
+
+# dead letters are read back with the field order and naive UTC datetimes
+# they were written with
+_DEAD_LETTER_JSON_OPTIONS = JSONOptions(document_class=collections.OrderedDict, tz_aware=False)
+
+def is_transient(error):
+    """ whether a write that raised error may succeed when it is retried
+
+        Parameters
+        ----------
+            error : Exception
+                The exception raised by the write
+
+        Returns
+        -------
+            bool
+                True for connection failures, timeouts and the server errors
+                of _TRANSIENT_ERROR_CODES
+    """
+    if isinstance(error, pymongo.errors.BulkWriteError):
+        # the write errors of a bulk write are classified one by one
+        return False
+    if isinstance(error, (pymongo.errors.ConnectionFailure, pymongo.errors.ExecutionTimeout)):
+        return True
+    has_error_label = getattr(error, 'has_error_label', None)
+    if has_error_label is not None and has_error_label('RetryableWriteError'):
+        return True
+    if isinstance(error, pymongo.errors.OperationFailure):
+        return error.code in _TRANSIENT_ERROR_CODES
+    return False
+
+def requeue(pending, details, ordered):
+    """ the operations of a failed bulk write to retry and those that failed
+    for good
+
+        Parameters
+        ----------
+            pending : list
+                The positions, within the chunk, of the operations that were
+                sent
+            details : dict
+                The details of the BulkWriteError, whose writeErrors are
+                indexed by the operations sent
+            ordered : bool
+                Whether the write was ordered, which stops at the first error
+                so the operations after it were never applied
+
+        Returns
+        -------
+            tuple
+                The positions to retry, and (position, write error) of the
+                operations that failed permanently
+    """
+    errors = sorted(details.get('writeErrors', []), key=lambda error: error['index'])
+    retry = []
+    failed = []
+    for error in errors:
+        position = pending[error['index']]
+        if error.get('code') in _TRANSIENT_ERROR_CODES:
+            retry.append(position)
+        else:
+            failed.append((position, error))
+    if ordered and len(errors) > 0:
+        retry.extend(pending[errors[-1]['index'] + 1:])
+    return sorted(retry), failed
+
+def new_counts():
+    """ the counts of a write, as formatted by
+    GritsMongoConnection.format_bulk_write_results """
+    return collections.OrderedDict([('nInserted', 0), ('nMatched', 0),
+        ('nModified', 0), ('nRemoved', 0), ('nUpserted', 0)])
+
+def add_counts(counts, result):
+    """ add the counts of a bulk write result, or of the details of a
+    BulkWriteError, to counts """
+    for key in counts:
+        counts[key] += result.get(key, 0)
+
+class DeadLetterFile(object):
+    """ the operations that could not be written, one JSON line each
+
+        Each line holds the collection, the kind of operation ('upsert' or
+        'insert'), whether it was part of an ordered write, the error and the
+        document in MongoDB extended JSON.  grits_replay.py writes them again.
+    """
+
+    def __init__(self, path):
+        """ DeadLetterFile constructor
+
+            Parameters
+            ----------
+                path : str
+                    The path of the file, lines are appended to it
+        """
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, collection_name, op, ordered, document, error, code=None):
+        """ append a failed operation
+
+            Parameters
+            ----------
+                collection_name : str
+                    The collection the operation was written to
+                op : str
+                    'upsert' or 'insert'
+                ordered : bool
+                    Whether the operation was part of an ordered write
+                document : dict
+                    The document of the operation
+                error : str
+                    The error message
+                code : int
+                    The server error code, if there is one
+        """
+        entry = collections.OrderedDict()
+        entry['collection'] = collection_name
+        entry['op'] = op
+        entry['ordered'] = ordered
+        entry['code'] = code
+        entry['error'] = error
+        entry['document'] = document
+        line = json_util.dumps(entry) + '\n'
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.count += 1
+        metrics.inc('grits_dead_letters_total', op=op)
+
+    @staticmethod
+    def read(path):
+        """ the entries of a dead letter file
+
+            Parameters
+            ----------
+                path : str
+                    The path of the file
+
+            Returns
+            -------
+                generator
+                    The entries, as written by append
+        """
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line, json_options=_DEAD_LETTER_JSON_OPTIONS)
+
+_dead_letter_files = {}
+_dead_letter_lock = threading.Lock()
+
+def dead_letters(path=None):
+    """ the DeadLetterFile of a path shared by the writers of the process
+
+        Parameters
+        ----------
+            path : str
+                The path of the file, defaults to settings._DEAD_LETTER_FILE
+    """
+    path = path or settings._DEAD_LETTER_FILE
+    with _dead_letter_lock:
+        if path not in _dead_letter_files:
+            _dead_letter_files[path] = DeadLetterFile(path)
+        return _dead_letter_files[path]
+
+class GritsChunkWriter(object):
+    """ writes the records of a chunk, retrying what failed
+
+        The chunk is sent as a single bulk write.  When it fails, the
+        failure decides what is sent again:
+
+            a transient exception - the whole write is retried, upserts are
+                idempotent and inserts that had been applied fail as
+                duplicate keys, which are counted as inserted
+            a BulkWriteError - only the operations with a transient write
+                error, and those an ordered write never reached, are retried,
+                operations with any other write error are dead letters
+            any other exception - every operation is a dead letter
+
+        Retries wait with an exponential backoff.  Operations still failing
+        after the retries are appended to the dead letter file, so a later
+        replay writes only them instead of importing the file again.
+    """
+
+    def __init__(self, db, retries=None, backoff=None, dead_letter_file=None):
+        """ GritsChunkWriter constructor
+
+            Parameters
+            ----------
+                db : object
+                    The pymongo Database
+                retries : int
+                    The number of retries, defaults to settings._WRITE_RETRIES
+                backoff : float
+                    The seconds to wait before the first retry, doubled for
+                    each further retry, defaults to
+                    settings._WRITE_BACKOFF_SECONDS
+                dead_letter_file : object
+                    The DeadLetterFile of the failed operations, defaults to
+                    the shared one of settings._DEAD_LETTER_FILE
+        """
+        self.db = db
+        self.retries = settings._WRITE_RETRIES if retries is None else retries
+        self.backoff = settings._WRITE_BACKOFF_SECONDS if backoff is None else backoff
+        self.dead_letter_file = dead_letter_file
+        self.retried = 0
+        self.failed = 0
+
+    def backoff_seconds(self, attempt):
+        """ the seconds to wait before a retry, attempt counts from 1 """
+        return min(self.backoff * 2 ** (attempt - 1), settings._WRITE_BACKOFF_MAX_SECONDS)
+
+    @staticmethod
+    def request(op, document):
+        """ the bulk write operation of a document """
+        if op == 'upsert':
+            return pymongo.UpdateOne({'_id': document['_id']},
+                {'$set': document['fields']}, upsert=True)
+        return pymongo.InsertOne(document)
+
+    def dead_letter(self, collection_name, op, ordered, documents, error, code=None):
+        """ give up on the documents of failed operations """
+        if self.dead_letter_file is None:
+            self.dead_letter_file = dead_letters()
+        for document in documents:
+            self.dead_letter_file.append(collection_name, op, ordered, document, error, code)
+        self.failed += len(documents)
+        logging.error('%d %s operations on %s written to %s: %s', len(documents), op,
+            collection_name, self.dead_letter_file.path, error)
+
+    def steps(self, collection_name, op, documents, ordered, counts):
+        """ the steps of writing the documents
+
+            The generator yields ('write', requests), to be answered with the
+            result of the bulk write or thrown its exception, and ('sleep',
+            seconds).  It is driven by write, and by the event loop of the
+            async engine.
+
+            Parameters
+            ----------
+                collection_name : str
+                    The name of the mongoDB collection
+                op : str
+                    'upsert', with documents of '_id' and 'fields', or
+                    'insert'
+                documents : list
+                    The documents of the chunk
+                ordered : bool
+                    Apply the operations in order
+                counts : dict
+                    The counts of new_counts, updated as the writes succeed
+        """
+        pending = range(len(documents))
+        attempt = 0
+        while len(pending) > 0:
+            requests = [GritsChunkWriter.request(op, documents[position]) for position in pending]
+            try:
+                result = yield ('write', requests)
+                add_counts(counts, result.bulk_api_result)
+                return
+            except pymongo.errors.BulkWriteError as e:
+                add_counts(counts, e.details)
+                for error in e.details.get('writeConcernErrors', []):
+                    logging.warn('write concern error on %s: %s', collection_name, error.get('errmsg'))
+                retry, failed = requeue(pending, e.details, ordered)
+                for position, error in failed:
+                    if op == 'insert' and error.get('code') == _DUPLICATE_KEY:
+                        # the _ids of inserts are generated by the client, so
+                        # the document was applied by an earlier attempt
+                        counts['nInserted'] += 1
+                        continue
+                    self.dead_letter(collection_name, op, ordered, [documents[position]],
+                        error.get('errmsg'), error.get('code'))
+                metrics.inc('grits_mongo_write_errors_total', op=op)
+                transient = [error for error in e.details.get('writeErrors', [])
+                    if error.get('code') in _TRANSIENT_ERROR_CODES]
+                pending = retry
+                if len(transient) == 0:
+                    # the rest of an ordered write, which was never sent
+                    continue
+                message = transient[0].get('errmsg')
+            except Exception as e:
+                metrics.inc('grits_mongo_write_errors_total', op=op)
+                if not is_transient(e):
+                    self.dead_letter(collection_name, op, ordered,
+                        [documents[position] for position in pending], str(e))
+                    return
+                message = str(e)
+
+            attempt += 1
+            if attempt > self.retries:
+                self.dead_letter(collection_name, op, ordered,
+                    [documents[position] for position in pending],
+                    'gave up after %d retries: %s' % (self.retries, message))
+                return
+            self.retried += len(pending)
+            metrics.inc('grits_write_retries_total', op=op)
+            seconds = self.backoff_seconds(attempt)
+            logging.warn('%d %s operations on %s failed (%s), retry %d of %d in %.1fs',
+                len(pending), op, collection_name, message, attempt, self.retries, seconds)
+            yield ('sleep', seconds)
+
+    def write(self, collection_name, op, documents, ordered=True):
+        """ write the documents, see steps
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The counts of the operations applied
+        """
+        counts = new_counts()
+        if len(documents) == 0:
+            return counts
+        collection = self.db[collection_name]
+        steps = self.steps(collection_name, op, documents, ordered, counts)
+        try:
+            step = next(steps)
+            while True:
+                kind, value = step
+                if kind == 'sleep':
+                    time.sleep(value)
+                    step = steps.send(None)
+                    continue
+                try:
+                    result = collection.bulk_write(value, ordered=ordered)
+                except Exception as e:
+                    step = steps.throw(e)
+                else:
+                    step = steps.send(result)
+        except StopIteration:
+            pass
+        return counts
+
+    def upsert(self, collection_name, records, ordered=True):
+        """ upsert the fields of records by their id
+
+            Parameters
+            ----------
+                collection_name : str
+                    The name of the mongoDB collection
+                records : list
+                    The records
+                ordered : bool
+                    Apply the upserts in order
+        """
+        documents = [{'_id': record.id, 'fields': record.fields} for record in records]
+        return self.write(collection_name, 'upsert', documents, ordered)
+
+    def insert(self, collection_name, documents):
+        """ insert documents, in no particular order
+
+            Parameters
+            ----------
+                collection_name : str
+                    The name of the mongoDB collection
+                documents : list
+                    The documents
+        """
+        return self.write(collection_name, 'insert', documents, False)
+
+def replay(db, path=None, writer=None):
+    """ write the operations of a dead letter file again
+
+        The file is renamed with the time of the replay before its entries
+        are written, so operations that fail again are appended to a new
+        file at the same path.
+
+        Parameters
+        ----------
+            db : object
+                The pymongo Database
+            path : str
+                The dead letter file, defaults to settings._DEAD_LETTER_FILE
+            writer : object
+                Optional GritsChunkWriter of the replay
+
+        Returns
+        -------
+            dict
+                The number of entries replayed and of those that failed again
+    """
+    path = path or settings._DEAD_LETTER_FILE
+    summary = collections.OrderedDict([('entries', 0), ('failed', 0), ('replayed', None)])
+    if not os.path.exists(path):
+        logging.info('no dead letters in %s', path)
+        return summary
+    replayed = '%s.replayed-%s' % (path, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    os.rename(path, replayed)
+    summary['replayed'] = replayed
+
+    # consecutive entries of the same write are sent together
+    writes = []
+    for entry in DeadLetterFile.read(replayed):
+        write = (entry['collection'], entry['op'], entry['ordered'])
+        if len(writes) == 0 or writes[-1][0] != write:
+            writes.append((write, []))
+        writes[-1][1].append(entry['document'])
+        summary['entries'] += 1
+
+    if writer is None:
+        writer = GritsChunkWriter(db, dead_letter_file=DeadLetterFile(path))
+    failed = writer.failed
+    for (collection_name, op, ordered), documents in writes:
+        for start in range(0, len(documents), settings._CHUNK_SIZE):
+            writer.write(collection_name, op, documents[start:start + settings._CHUNK_SIZE], ordered)
+    summary['failed'] = writer.failed - failed
+    logging.info('replayed %d dead letters from %s, %d failed again',
+        summary['entries'], replayed, summary['failed'])
+    return summary
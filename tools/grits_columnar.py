@@ -0,0 +1,343 @@
+import os
+import logging
+import datetime
+import collections
+
+import numpy as np
+
+from bson.binary import Binary
+
+from tools.grits_arrays import load_arrays, write_arrays
+from tools.grits_od_matrix import airport_code
+from tools.grits_record import FlightRecord
+from tools.grits_stage import FlightRowStage
+
+""" a columnar snapshot of the flights, read through memory maps
+
+Scanning the flights through a mongoDB cursor decodes one BSON document at a
+time.  The ColumnarSnapshotBuilder is an import stage that keeps the fields of
+every imported flight by column and, once the import is done, writes a .npy
+file per field of the FlightRecord schema.  Strings are dictionary encoded:
+the column holds int32 codes into a dictionary shared by the columns of the
+same kind, the airport codes of departureAirport, arrivalAirport and
+stopCodes, the countries, and the carriers.  ColumnarSnapshot maps the columns
+into memory and filters them with numpy.
+
+The columns by schema type:
+
+    string - int32 codes, -1 for None
+    integer - int64, _NULL_INTEGER for None
+    boolean - int8, 1, 0 or -1 for None
+    datetime - datetime64[s], NaT for None
+    dict - the int32 code of the airport _id, with the country of the airport
+        in <field>CountryName
+    list - the codes of the stop airports, with the offset of the stops of
+        each flight in <field>Offsets
+    numbers - the values of a list of numbers such as legDistances, float64
+        with NaN for None, with the offsets of each flight in <field>Offsets
+
+The _id column holds the flight keys, as fixed width strings for hex keys,
+int64 for int64 keys and 16 byte np.void for binary keys, whose digest may
+end in NUL bytes that a string column drops.
+"""
+
+_NULL_CODE = -1
+_NULL_INTEGER = np.iinfo(np.int64).min
+_NULL_BOOLEAN = -1
+
+# the dtype of the columns of each kind
+_DTYPES = {
+    'string': np.int32,
+    'dict': np.int32,
+    'integer': np.int64,
+    'boolean': np.int8,
+    'datetime': 'datetime64[s]',
+    'list': np.int32,
+    'numbers': np.float64,
+}
+
+# the dictionary of the string columns that share one, the others have their own
+_SHARED_DICTIONARIES = {
+    'carrier': 'carriers',
+    'departureAirport': 'airports',
+    'arrivalAirport': 'airports',
+    'stopCodes': 'airports',
+    'departureCountry': 'countries',
+    'arrivalCountry': 'countries',
+    'departureAirportCountryName': 'countries',
+    'arrivalAirportCountryName': 'countries',
+}
+
+def encode_string(value):
+    """ the bytes of a dictionary entry """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def flight_columns():
+    """ the (name, kind) of the columns of a snapshot, from the schema of
+    FlightRecord """
+    columns = []
+    for name in sorted(FlightRecord.schema):
+        kind = FlightRecord.schema[name]['type']
+        if kind == 'list' and name not in _SHARED_DICTIONARIES:
+            kind = 'numbers'
+        columns.append((name, kind))
+        if kind == 'dict':
+            columns.append((name + 'CountryName', 'string'))
+    return columns
+
+class ColumnarSnapshotBuilder(FlightRowStage):
+    """ collects the flights written by the readers of a run by column """
+
+    def __init__(self, path):
+        """ ColumnarSnapshotBuilder constructor
+
+            Parameters
+            ----------
+                path : str
+                    The directory the snapshot is written to
+        """
+        super(ColumnarSnapshotBuilder, self).__init__()
+        self.path = path
+        self.kinds = flight_columns()
+        self.columns = [(name, _DTYPES[kind], kind in ('list', 'numbers')) for name, kind in self.kinds]
+        # the country columns of the embedded airports
+        self.airport_countries = dict((name + 'CountryName', name)
+            for name, kind in self.kinds if kind == 'dict')
+        self.dictionaries = collections.defaultdict(dict)
+
+    def encode(self, name, value):
+        """ the dictionary code of a string """
+        if value is None:
+            return _NULL_CODE
+        dictionary = self.dictionaries[_SHARED_DICTIONARIES.get(name, name)]
+        value = encode_string(value)
+        code = dictionary.get(value)
+        if code is None:
+            code = dictionary[value] = len(dictionary)
+        return code
+
+    def cell(self, name, kind, fields):
+        """ the value stored in a column for the fields of a flight """
+        if name in self.airport_countries:
+            airport = fields.get(self.airport_countries[name])
+            return self.encode(name, airport.get('countryName') if isinstance(airport, dict) else None)
+        value = fields.get(name)
+        if kind == 'string':
+            return self.encode(name, value)
+        if kind == 'dict':
+            return self.encode(name, airport_code(value))
+        if kind == 'list':
+            return [self.encode(name, airport_code(airport)) for airport in value or []]
+        if kind == 'numbers':
+            return [np.nan if number is None else number for number in value or []]
+        if value is not None:
+            return value
+        if kind == 'integer':
+            return _NULL_INTEGER
+        if kind == 'boolean':
+            return _NULL_BOOLEAN
+        return np.datetime64('NaT')
+
+    def row(self, record):
+        """ the cells of a flight """
+        fields = record.fields
+        return tuple(self.cell(name, kind, fields) for name, kind in self.kinds)
+
+    def dictionary_names(self):
+        """ the dictionary of each dictionary encoded column """
+        return dict((name, _SHARED_DICTIONARIES.get(name, name))
+            for name, kind in self.kinds if kind in ('string', 'dict', 'list'))
+
+    def iter_arrays(self):
+        """ the (name, array) of the snapshot, see ColumnarSnapshot, a column
+        at a time """
+        for name, dtype, ragged in self.columns:
+            if ragged:
+                values, offsets = self.column(name)
+                yield name, values
+                yield name + 'Offsets', offsets
+            else:
+                yield name, self.column(name)
+        for name in set(self.dictionary_names().values()):
+            dictionary = self.dictionaries.get(name, {})
+            values = sorted(dictionary, key=dictionary.get)
+            yield 'dictionary.' + name, np.array(values, dtype='S%d' % max([len(value) for value in values] + [1]))
+        yield '_id', self.keys()
+
+    def arrays(self):
+        """ the arrays of the snapshot """
+        return dict(self.iter_arrays())
+
+    def write(self):
+        """ write the snapshot to the path, a column at a time
+
+            Returns
+            -------
+                dict
+                    The meta of the snapshot
+        """
+        with self._lock:
+            try:
+                meta = {
+                    'created': datetime.datetime.utcnow().isoformat(),
+                    'rows': len(self),
+                    'columns': collections.OrderedDict(self.kinds),
+                    'dictionaries': self.dictionary_names(),
+                }
+                write_arrays(self.path, self.iter_arrays(), meta)
+            finally:
+                self.close()
+        logging.info('columnar snapshot: %d flights, %d columns written to %s',
+            meta['rows'], len(self.kinds), self.path)
+        return meta
+
+class ColumnarSnapshot(object):
+    """ the memory-mapped columns written by ColumnarSnapshotBuilder
+
+        Columns are mapped the first time they are used.  The filters return
+        boolean masks over the rows, which are combined with & and | and
+        passed to select.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        """ ColumnarSnapshot constructor
+
+            Parameters
+            ----------
+                path : str
+                    The directory of the snapshot
+                mmap_mode : str
+                    The mode of np.load, None reads the columns into memory
+        """
+        self.path = path
+        self.mmap_mode = mmap_mode
+        arrays, self.meta = load_arrays(path, [], mmap_mode)
+        self.kinds = self.meta['columns']
+        self._arrays = {}
+        self._codes = {}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def array(self, name):
+        """ a .npy file of the snapshot, mapped into memory """
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode=self.mmap_mode)
+        return self._arrays[name]
+
+    def dictionary(self, name):
+        """ the dictionary of a string column """
+        return self.array('dictionary.' + self.meta['dictionaries'][name])
+
+    def code(self, name, value):
+        """ the code of a value in the dictionary of a column, None when no
+        flight has the value """
+        dictionary = self.meta['dictionaries'][name]
+        if dictionary not in self._codes:
+            self._codes[dictionary] = dict((value, code)
+                for code, value in enumerate(self.dictionary(name).tolist()))
+        return self._codes[dictionary].get(encode_string(value))
+
+    def codes(self, name, values):
+        if isinstance(values, basestring):
+            values = [values]
+        return [code for code in (self.code(name, value) for value in values) if code is not None]
+
+    def keys(self, mask=None):
+        """ the _id of the flights, as their documents store it
+
+            Parameters
+            ----------
+                mask : np.ndarray
+                    Optional boolean mask of the rows
+        """
+        column = self.array('_id')
+        if mask is not None:
+            column = column[mask]
+        if column.dtype.kind == 'V':
+            return [Binary(key.tobytes()) for key in column]
+        return column.tolist()
+
+    def column(self, name):
+        """ the raw column, codes for strings """
+        return self.array(name)
+
+    def values(self, name, mask=None):
+        """ the decoded values of a column
+
+            Parameters
+            ----------
+                name : str
+                    The name of the column
+                mask : np.ndarray
+                    Optional boolean mask of the rows
+
+            Returns
+            -------
+                np.ndarray
+                    Strings for dictionary encoded columns, with '' for None,
+                    and a list of arrays for stopCodes and lists of numbers
+        """
+        kind = self.kinds.get(name)
+        if kind in ('list', 'numbers'):
+            offsets = self.array(name + 'Offsets')
+            stops = self.array(name)
+            if kind == 'list':
+                stops = self.dictionary(name)[stops]
+            rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+            return [stops[offsets[row]:offsets[row + 1]] for row in rows]
+        column = self.array(name)
+        if mask is not None:
+            column = column[mask]
+        if kind in ('string', 'dict'):
+            dictionary = np.append(self.dictionary(name), [''])
+            # the -1 of None indexes the '' appended
+            return dictionary[column]
+        return np.asarray(column)
+
+    def operating(self, start=None, end=None):
+        """ the flights operating on any day between start and end
+
+            Parameters
+            ----------
+                start : datetime
+                    Optional first day of the window
+                end : datetime
+                    Optional last day of the window
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.array('discontinuedDate') >= np.datetime64(start, 's')
+        if end is not None:
+            mask &= self.array('effectiveDate') <= np.datetime64(end, 's')
+        return mask
+
+    def equal(self, name, values):
+        """ the flights whose string column is one of the values """
+        return np.in1d(self.array(name), self.codes(name, values))
+
+    def carrier(self, carriers):
+        """ the flights of a carrier, or of any of a list of carriers """
+        return self.equal('carrier', carriers)
+
+    def airport(self, codes, departure=True, arrival=True):
+        """ the flights departing from or arriving at an airport, or any of a
+        list of airports """
+        mask = np.zeros(len(self), dtype=bool)
+        if departure:
+            mask |= self.equal('departureAirport', codes)
+        if arrival:
+            mask |= self.equal('arrivalAirport', codes)
+        return mask
+
+    def select(self, mask, names):
+        """ the decoded values of columns for the rows of a mask
+
+            Returns
+            -------
+                dict
+                    The values by column name
+        """
+        return dict((name, self.values(name, mask)) for name in names)
@@ -1,10 +1,30 @@
 import os
+import json
+import functools
 import argparse
 import logging
-import requests
 from tools.grits_file_reader import GritsFileReader
-from tools.grits_provider_type import DiioAirportType, FlightGlobalType
-from tools.grits_mongo import GritsMongoConnection
+from tools.grits_async import GritsAsyncEngine, GritsAsyncFileReader
+from tools.grits_chunk_writer import dead_letters
+from tools.grits_counts import ImportCounts
+from tools.grits_od_matrix import ODMatrixBuilder
+from tools.grits_graph import FlightGraphBuilder
+from tools.grits_columnar import ColumnarSnapshotBuilder
+from tools.grits_stage import FlightRowStage
+from tools.grits_geo import airport_location
+from tools.grits_geocoder import _GEOCODERS, create_geocoder
+from tools.grits_outliers import AirportOutlierStage
+from tools.grits_batch import GritsBatch, batch_files, deliverable_date
+from tools.grits_history import GritsHistory
+from tools.grits_calibrator import GritsCalibrator, apply_profile
+from tools.grits_provider_type import DiioAirportType, FlightGlobalType, SSIMType
+from tools.grits_record import FlightRecord
+from tools.grits_mongo import AirportCache, GritsMongoConnection, registry
+from tools.grits_dry_run import GritsDryRunConnection
+from tools.grits_keys import InvalidKeyFormat, key_format_of
+from tools.grits_memory import peak_rss
+from tools.grits_metrics import metrics
+from tools.grits_profiler import profiler
 import csv
 from conf import settings
 
@@ -28,6 +48,7 @@ class GritsConsumer(object):
         self.parser = argparse.ArgumentParser(description='script to parse ' \
             'the grits transportation network data file and populate ' \
             'a mongodb collection.')
+        self.batch_paths = []
 
     @staticmethod
     def file_extension(file_obj):
@@ -100,31 +121,179 @@ class GritsConsumer(object):
             default=settings._MONGO_HOST,
             help='the hostname for mongoDB (Default: localhost)')
 
+        self.parser.add_argument('--mongo-profile',
+            choices=sorted(settings._MONGO_PROFILES.keys()),
+            default=settings._MONGO_PROFILE,
+            help='the write concern, pool size and compression of the ' \
+                'mongoDB clients, bulk-load fsyncs once the import is done ' \
+                '(Default: %s)' % settings._MONGO_PROFILE)
+
+        self.parser.add_argument('--profile',
+            action='store_true',
+            help='print a per-stage timing breakdown when the run ends')
+
+        self.parser.add_argument('--profile-dump',
+            default=None,
+            help='write sampled stacks of the slowest chunk to this file ' \
+                '(flamegraph collapsed format, implies --profile)')
+
+        self.parser.add_argument('--metrics-file',
+            default=None,
+            help='rewrite this prometheus text-format file after every chunk')
+
+        self.parser.add_argument('--metrics-port',
+            type=int,
+            default=None,
+            help='serve prometheus metrics on this local port during the run')
+
+        self.parser.add_argument('--metrics-summary',
+            default=None,
+            help='write a JSON summary of the run metrics to this file')
+
+        self.parser.add_argument('--max-memory',
+            type=int,
+            default=settings._MAX_MEMORY_MB,
+            help='target peak memory in MB, chunk sizes are adapted to ' \
+                'stay below it (Default: unbounded)')
+
+        self.parser.add_argument('--calibrate',
+            action='store_true',
+            help='run trial imports of the infile to find the fastest ' \
+                'threads, chunk size and batch size for this host and ' \
+                'mongoDB, which later runs use automatically')
+
+        self.parser.add_argument('--dry-run',
+            action='store_true',
+            help='parse and validate the infile without writing to mongoDB ' \
+                'and report the valid, invalid and duplicate records')
+
+        self.parser.add_argument('--airport-snapshot',
+            type=argparse.FileType('rb'),
+            default=None,
+            help='a DiioAirport file used to resolve airports during a ' \
+                '--dry-run instead of reading them from mongoDB')
+
+        self.parser.add_argument('--dry-run-report',
+            default=None,
+            help='write the --dry-run report as JSON to this file')
+
+        self.parser.add_argument('--dedup',
+            choices=['last', 'first', 'none'],
+            default=settings._DEDUP_POLICY or 'none',
+            help='which row wins when rows share a flight key, they are ' \
+                'coalesced before writing unless none (Default: %s)' % (settings._DEDUP_POLICY or 'none'))
+
+        self.parser.add_argument('--write-order',
+            choices=['key', 'departure', 'none'],
+            default=settings._WRITE_ORDER or 'none',
+            help='sort the writes of each chunk by _id or by departure ' \
+                'airport and date, so they touch neighbouring index pages ' \
+                '(Default: %s)' % (settings._WRITE_ORDER or 'none'))
+
+        self.parser.add_argument('--presort',
+            action='store_true',
+            default=settings._PRESORT,
+            help='write the valid records of each file in _id order once ' \
+                'it has been read, sorted on disk, for full reloads of a ' \
+                'collection larger than the mongoDB cache')
+
+        self.parser.add_argument('--history',
+            action='store_true',
+            help='record the changes the flight deliverable makes to ' \
+                'the flights, so earlier deliverables can be rebuilt')
+
+        self.parser.add_argument('--dead-letter-file',
+            default=settings._DEAD_LETTER_FILE,
+            help='append the writes that fail after the retries to this ' \
+                'file, for grits_replay.py (Default: %s)' % settings._DEAD_LETTER_FILE)
+
+        self.parser.add_argument('--od-matrix',
+            default=settings._OD_MATRIX_PATH,
+            help='sum the weekly seats and flights of the imported flights ' \
+                'per month, origin and destination and write the matrix to ' \
+                'this directory (Default: None)')
+
+        self.parser.add_argument('--graph',
+            default=settings._GRAPH_PATH,
+            help='write the network of the imported flights, with the ' \
+                'seats, frequency and distance of each edge, as sparse CSR ' \
+                'arrays to this .npz file (Default: None)')
+
+        self.parser.add_argument('--columnar',
+            default=settings._COLUMNAR_PATH,
+            help='write the fields of the imported flights as a column ' \
+                'per field, memory-mapped by ColumnarSnapshot, to this ' \
+                'directory (Default: None)')
+
+        self.parser.add_argument('--airport-outliers',
+            default=settings._AIRPORT_OUTLIERS_PATH,
+            help='write the imported airports that are far from the center ' \
+                'of their country to this CSV, for a FixAirports run, and ' \
+                '%s them in mongoDB (Default: None)' % settings._AIRPORT_OUTLIER_ACTION)
+
+        self.parser.add_argument('--geocoder',
+            choices=_GEOCODERS,
+            default=settings._GEOCODER,
+            help='how FixAirports finds the city and country of the ' \
+                'airports, offline from the nearest known place or with ' \
+                'the OpenCage API (Default: %s)' % settings._GEOCODER)
+
+        self.parser.add_argument('--batch',
+            default=None,
+            help='import every file matching this glob pattern or in this ' \
+                'directory, oldest deliverable first, instead of the infile')
+
+        self.parser.add_argument('--concurrency',
+            type=int,
+            default=1,
+            help='the number of --batch files imported at the same time, ' \
+                'which no longer guarantees that newer deliverables are ' \
+                'written last (Default: 1)')
+
+        self.parser.add_argument('--async',
+            dest='async_engine',
+            action='store_true',
+            help='look up airports and write through the motor driver with ' \
+                'many operations in flight, for a remote high-latency mongoDB')
+
         self.parser.add_argument('infile',
+            nargs='?',
             type=argparse.FileType('rb'),
             help="the file to be parsed")
 
     def fix_airport_locations(self):
-        mongo_connection = GritsMongoConnection(self.program_args)
+        """ set the city, state and country of the airports listed in the
+        infile from their coordinates, with the geocoder of --geocoder """
+        # the codes are the first column of the rows left in the infile
+        codes = []
+        for row in csv.reader(self.program_args.infile):
+            if len(row) > 0:
+                codes.append(row[0])
+        codes = sorted(set(codes))
+        if len(codes) == 0:
+            return
+        # the client of the import is reused and its indexes already dropped
+        mongo_connection = GritsMongoConnection(self.program_args, read_only=True)
         db = mongo_connection.db
-        # with open(self.program_args.infile, 'r') as csvfile:
-        with self.program_args.infile as csvfile:
-            airports = csv.reader(csvfile)
-            for airport in airports:
-                airportCode = airport[0]
-                current = db.airports.find_one({'_id': airportCode})
-                url =  ("https://api.opencagedata.com/geocode/v1/json?q={0},{1}&pretty=1&key=84d572528e84d94f59e429867dbd1bed").format(current['loc']['coordinates'][1], current['loc']['coordinates'][0]);
-                response = requests.get(url)
-                locationData = response.json()['results'][0]['components']
-                db.airports.update({'_id':airportCode}, {
-                    '$set': {
-                      'city': locationData.get('local_administrative_area') or locationData.get('town') or locationData.get('village') or locationData.get('suburb'),
-                      'country': locationData.get('country_code'),
-                      'countryName': locationData.get('country'),
-                      'stateName': locationData.get('state'),
-                      'globalRegion': None
-                    }
-                })
+        airports = dict((airport['_id'], airport) for airport in
+            db[settings._AIRPORT_COLLECTION_NAME].find({'_id': {'$in': codes}}, {'loc': 1}))
+        located = []
+        for code in codes:
+            coordinates = airport_location(airports.get(code))
+            if coordinates is None:
+                logging.warn('airport %s is missing or has no location, it is not fixed', code)
+                continue
+            located.append((code, coordinates))
+        if len(located) == 0:
+            return
+
+        geocoder = create_geocoder(self.program_args.geocoder, db, exclude=codes)
+        locations = geocoder.reverse([coordinates for code, coordinates in located])
+        fixes = [{'_id': code, 'fields': dict(fields)}
+            for (code, coordinates), fields in zip(located, locations) if fields is not None]
+        if len(fixes) > 0:
+            mongo_connection.writer.write(settings._AIRPORT_COLLECTION_NAME, 'upsert', fixes, ordered=False)
+        logging.info('fixed the location of %d of %d airports', len(fixes), len(codes))
 
     def run(self, *args):
         """ kickoff the program """
@@ -135,33 +304,281 @@ class GritsConsumer(object):
         else:
             self.program_args = self.parser.parse_args()
                 
+        if (self.program_args.infile is None) == (self.program_args.batch is None):
+            self.parser.error('either an infile or --batch is required')
+        if self.program_args.batch is not None:
+            self.batch_paths = batch_files(self.program_args.batch)
+            if len(self.batch_paths) == 0:
+                self.parser.error('no %r files match --batch %s' % (
+                    settings._ALLOWED_FILE_EXTENSIONS, self.program_args.batch))
+            if self.program_args.calibrate:
+                self.parser.error('--calibrate requires a single infile')
+            if self.program_args.history and self.program_args.concurrency > 1:
+                self.parser.error('--history requires the files to be imported in order, without --concurrency')
         # validate the filename extension
-        if not self.is_valid_file_type(self.program_args.infile):
+        elif not self.is_valid_file_type(self.program_args.infile):
             msg = 'not a valid file extension %r' % settings._ALLOWED_FILE_EXTENSIONS
             self.parser.error(msg) #this calls sys.exit
+        if self.program_args.history and (self.program_args.type not in ['FlightGlobal', 'SSIM'] or
+                self.program_args.dry_run or self.program_args.calibrate):
+            self.parser.error('--history records flight imports, not dry runs or calibrations')
+        exports = [self.program_args.od_matrix, self.program_args.graph, self.program_args.columnar]
+        if any(path is not None for path in exports) and (
+                self.program_args.type not in ['FlightGlobal', 'SSIM'] or self.program_args.calibrate):
+            self.parser.error('--od-matrix, --graph and --columnar are built from flight imports, not airports or calibrations')
+        if self.program_args.airport_outliers is not None and (
+                self.program_args.type != 'DiioAirport' or self.program_args.calibrate):
+            self.parser.error('--airport-outliers is found from DiioAirport imports, not flights or calibrations')
+        if self.program_args.async_engine and (self.program_args.dry_run or self.program_args.calibrate):
+            self.parser.error('--async writes to mongoDB, it cannot be combined with --dry-run or --calibrate')
+        if self.program_args.profile or self.program_args.profile_dump:
+            profiler.enable(self.program_args.profile_dump)
+        if not self.program_args.calibrate:
+            apply_profile(self.program_args)
+        settings._MAX_MEMORY_MB = self.program_args.max_memory
+        settings._DEDUP_POLICY = None if self.program_args.dedup == 'none' else self.program_args.dedup
+        settings._WRITE_ORDER = None if self.program_args.write_order == 'none' else self.program_args.write_order
+        settings._PRESORT = self.program_args.presort
+        settings._DEAD_LETTER_FILE = self.program_args.dead_letter_file
+        metrics.reset()
+        metrics.textfile_path = self.program_args.metrics_file
+        if self.program_args.metrics_port is not None:
+            metrics.serve(self.program_args.metrics_port)
+        try:
+            self.process()
+        finally:
+            if profiler.enabled:
+                logging.info('import profile:\n%s', profiler.report())
+                profiler.dump()
+            logging.info('peak RSS: %.1f MB', peak_rss() / (1024.0 * 1024.0))
+            registry.close()
+            if dead_letters().count > 0:
+                logging.error('%d writes failed and were written to %s, run grits_replay.py to write them again',
+                    dead_letters().count, settings._DEAD_LETTER_FILE)
+            metrics.publish()
+            metrics.shutdown()
+            if self.program_args.metrics_summary is not None:
+                metrics.write_summary(self.program_args.metrics_summary)
+
+    def process(self):
+        """ import the infile according to the program arguments """
         # determine the record type from the program_args
         if self.program_args.type == 'DiioAirport':
             report_type = DiioAirportType()
         elif self.program_args.type == 'FixAirports':
             self.fix_airport_locations()
             return
+        elif self.program_args.type == 'SSIM':
+            report_type = SSIMType()
         else :
             report_type = FlightGlobalType()
+
+        if self.program_args.dry_run:
+            self.dry_run(report_type)
+            return
+
+        if self.program_args.calibrate:
+            # the trials only write the scratch collection, so the indexes
+            # and the legs of the target are left alone
+            mongo_connection = GritsMongoConnection(self.program_args, read_only=True)
+            GritsCalibrator(report_type, self.program_args, mongo_connection).run()
+            return
         
         # setup the mongoDB connection
         mongo_connection = GritsMongoConnection(self.program_args)
         
         # check if the airport import has been run first
-        if type(report_type) == FlightGlobalType:
+        if report_type.record == FlightRecord:
             db = mongo_connection.db;
             num_airports = db[settings._AIRPORT_COLLECTION_NAME].find().count();
             if num_airports == 0:
                 raise MissingRecords('Please import the type DiioAirport before FlightGlobal')
+            # upserts with keys in another format would duplicate every flight
+            flight = db[settings._FLIGHT_COLLECTION_NAME].find_one({}, {'_id': 1})
+            if flight is not None and key_format_of(flight['_id']) != settings._FLIGHT_KEY_FORMAT:
+                raise InvalidKeyFormat('the flights have %s keys but _FLIGHT_KEY_FORMAT is %r, ' \
+                    'run grits_migrate_keys.py first' % (key_format_of(flight['_id']), settings._FLIGHT_KEY_FORMAT))
             # clear the legs collection
             db['legs'].delete_many({})
-        
-        # create a new file reader object of the specified report type
-        reader = GritsFileReader(report_type, self.program_args)
-        reader.process(mongo_connection)
-        if self.program_args.type == 'DiioAirport':
+
+        # the counts of the run, stored in historicalData once it is done
+        counts = ImportCounts()
+        exports = self.create_exports(mongo_connection)
+        reader_class = GritsFileReader
+        engine = None
+        if self.program_args.async_engine:
+            # one event loop and motor client for every file
+            engine = GritsAsyncEngine(mongo_connection)
+            reader_class = functools.partial(GritsAsyncFileReader, engine=engine)
+        try:
+            if self.program_args.batch is not None:
+                self.import_batch(report_type, mongo_connection, reader_class=reader_class,
+                    counts=counts, exports=exports)
+            else:
+                # create a new file reader object of the specified report type
+                reader = reader_class(report_type, self.program_args)
+                reader.counts = counts
+                reader.exports = exports
+                if self.program_args.history:
+                    reader.history = GritsHistory(mongo_connection.db,
+                        deliverable_date(self.program_args.infile.name))
+                reader.process(mongo_connection)
+        except:
+            # the stages are not written, so their spilled rows are removed
+            self.close_exports(exports)
+            raise
+        finally:
+            if engine is not None:
+                engine.close()
+        self.store_counts(mongo_connection, counts)
+        self.write_exports(exports)
+        # geocoding of a --batch is left to a FixAirports run on the codes to
+        # be fixed
+        if self.program_args.type == 'DiioAirport' and self.program_args.batch is None:
             self.fix_airport_locations()
+
+    def create_exports(self, mongo_connection=None):
+        """ the stages the program arguments ask to be fed the written
+        records, mongo_connection is None for a dry run """
+        exports = []
+        if self.program_args.airport_outliers is not None:
+            exports.append(AirportOutlierStage(self.program_args.airport_outliers, mongo_connection))
+        if self.program_args.od_matrix is not None:
+            exports.append(ODMatrixBuilder(self.program_args.od_matrix))
+        if self.program_args.graph is not None:
+            exports.append(FlightGraphBuilder(self.program_args.graph))
+        if self.program_args.columnar is not None:
+            exports.append(ColumnarSnapshotBuilder(self.program_args.columnar))
+        return exports
+
+    def write_exports(self, exports):
+        """ write the artifacts of the stages once every file is imported """
+        try:
+            for export in exports:
+                export.write()
+        finally:
+            self.close_exports(exports)
+
+    def close_exports(self, exports):
+        """ remove the rows the stages spilled in bounded memory mode """
+        for export in exports:
+            if isinstance(export, FlightRowStage):
+                export.close()
+
+    def store_counts(self, mongo_connection, counts):
+        """ store the counts of the import in historicalData
+
+            Parameters
+            ----------
+                mongo_connection: object
+                    The connection the records were written to
+                counts: object
+                    The ImportCounts of the readers
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The historicalData document
+        """
+        document = counts.store(mongo_connection.db)
+        summary = document['import']
+        logging.info('import counts: %d inserted, %d updated, %d unchanged, %d invalid',
+            summary['inserted'], summary['updated'], summary['unchanged'], summary['invalid'])
+        return document
+
+    def import_batch(self, report_type, mongo_connection, airport_cache=None,
+            reader_class=GritsFileReader, counts=None, exports=None):
+        """ import every file of the --batch with a shared connection and
+        airport cache
+
+            Parameters
+            ----------
+                report_type : object
+                    A provider type object from grits_provider_type.py
+                mongo_connection: object
+                    The connection the records are written to
+                airport_cache: object
+                    Optional AirportCache from grits_mongo.py
+                reader_class: class
+                    The reader created for each file
+                counts: object
+                    Optional ImportCounts shared by the readers
+                exports: list
+                    Optional stages shared by the readers
+
+            Returns
+            -------
+                list
+                    A summary per file
+        """
+        batch = GritsBatch(report_type, self.program_args, mongo_connection,
+            airport_cache, self.program_args.concurrency, self.program_args.history,
+            reader_class, counts, exports)
+        summaries = batch.run(self.batch_paths)
+        logging.info('batch: %d files, %d rows, %d valid, %d invalid, %d failed',
+            len(summaries), sum(summary['rows'] for summary in summaries),
+            sum(summary['valid'] for summary in summaries),
+            sum(summary['invalid'] for summary in summaries),
+            len(batch.failed()))
+        return summaries
+
+    def load_airport_snapshot(self):
+        """ the airports to resolve flights against during a dry run, parsed
+        from the --airport-snapshot file or else read once from mongoDB """
+        airport_cache = AirportCache()
+        if self.program_args.airport_snapshot is not None:
+            snapshot_arguments = argparse.Namespace(**vars(self.program_args))
+            snapshot_arguments.infile = self.program_args.airport_snapshot
+            snapshot_arguments.verbose = False
+            reader = GritsFileReader(DiioAirportType(), snapshot_arguments, airport_cache)
+            reader.process(GritsDryRunConnection(airport_cache))
+            # the snapshot is not part of the dry run report
+            metrics.reset()
+        else:
+            mongo_connection = GritsMongoConnection(self.program_args, read_only=True)
+            airport_cache.load(mongo_connection.db[settings._AIRPORT_COLLECTION_NAME].find())
+        return airport_cache
+
+    def dry_run(self, report_type):
+        """ parse and validate the infile without writing anything
+
+            Parameters
+            ----------
+                report_type : object
+                    A provider type object from grits_provider_type.py
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The report of the GritsDryRunConnection
+        """
+        # the airports are held in memory, so there is nothing to wait on
+        settings._THREADING_ENABLED = False
+        if report_type.record == FlightRecord:
+            airport_cache = self.load_airport_snapshot()
+            if len(airport_cache) == 0:
+                raise MissingRecords('Please import the type DiioAirport or pass --airport-snapshot before FlightGlobal')
+        else:
+            airport_cache = AirportCache()
+        dry_connection = GritsDryRunConnection(airport_cache)
+        exports = self.create_exports()
+        try:
+            if self.program_args.batch is not None:
+                files = self.import_batch(report_type, dry_connection, airport_cache,
+                    exports=exports)
+            else:
+                files = None
+                reader = GritsFileReader(report_type, self.program_args, airport_cache)
+                reader.exports = exports
+                reader.process(dry_connection)
+        except:
+            self.close_exports(exports)
+            raise
+        self.write_exports(exports)
+        report = dry_connection.log_report()
+        if files is not None:
+            report['files'] = files
+        if self.program_args.dry_run_report is not None:
+            with open(self.program_args.dry_run_report, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
@@ -0,0 +1,171 @@
+import datetime
+import threading
+import collections
+
+from conf import settings
+
+""" the counts of an import, kept while the records are written
+
+grits_update_counts.py used to count the flights and legs collections after
+every import, which scans them.  The readers add the results of their bulk
+writes and the records of each write to an ImportCounts instead, and the
+consumer stores them in a single historicalData document when the run ends.
+"""
+
+def record_field(record, name):
+    """ a field of a record, or of a SortedRecord of a --presort import """
+    context = getattr(record, 'context', None)
+    if context is None:
+        return record.fields.get(name)
+    if name not in context.positions:
+        return None
+    return record.get(name)
+
+def departure_country(record):
+    """ the country of the departure airport of a flight, None for airports """
+    airport = record_field(record, 'departureAirport')
+    if not isinstance(airport, dict):
+        return None
+    return airport.get('countryName') or airport.get('country')
+
+def totals(db):
+    """ the number of flights and legs, from the collection metadata
+
+        Parameters
+        ----------
+            db : object
+                The pymongo Database
+
+        Returns
+        -------
+            dict
+                The estimated counts of historicalData
+    """
+    return {
+        'legs': db['legs'].estimated_document_count(),
+        'flights': db[settings._FLIGHT_COLLECTION_NAME].estimated_document_count()
+    }
+
+class ImportCounts(object):
+    """ the counts of the records written by the readers of a run
+
+        inserted, updated and unchanged are exact, they are taken from the
+        upserted, modified and matched counts of the bulk writes.  The
+        records of each write are counted per carrier, per departure country
+        and per provider type.  The readers of a --batch share an instance,
+        so it is thread-safe.
+    """
+
+    def __init__(self):
+        """ ImportCounts constructor """
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self.carriers = collections.Counter()
+        self.departure_countries = collections.Counter()
+        self.provider_types = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add_records(self, provider_type, records):
+        """ count the valid records of a write
+
+            Parameters
+            ----------
+                provider_type : object
+                    A provider type object from grits_provider_type.py
+                records : list
+                    The records, with unique keys unless the deduplicator is
+                    disabled
+        """
+        carriers = collections.Counter()
+        countries = collections.Counter()
+        for record in records:
+            carrier = record_field(record, 'carrier')
+            if carrier is not None:
+                carriers[carrier] += 1
+            country = departure_country(record)
+            if country is not None:
+                countries[country] += 1
+        with self._lock:
+            self.carriers.update(carriers)
+            self.departure_countries.update(countries)
+            self.provider_types[type(provider_type).__name__] += len(records)
+
+    def add_invalid(self, count):
+        """ count the invalid records of a write """
+        with self._lock:
+            self.invalid += count
+
+    def add_result(self, result):
+        """ add the formatted result of GritsMongoConnection.bulk_upsert
+
+            Parameters
+            ----------
+                result : dict
+                    The nUpserted, nMatched and nModified of the write
+        """
+        matched = result.get('nMatched', 0)
+        modified = result.get('nModified', 0)
+        with self._lock:
+            self.inserted += result.get('nUpserted', 0)
+            self.updated += modified
+            self.unchanged += matched - modified
+
+    @staticmethod
+    def ranked(counter, name):
+        """ the entries of a counter, largest first
+
+            The keys are stored as values, carrier codes and country names
+            may contain the '.' that is not allowed in a field name.
+        """
+        return [collections.OrderedDict([(name, key), ('count', count)])
+            for key, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))]
+
+    def document(self, db=None):
+        """ the historicalData document of the run
+
+            Parameters
+            ----------
+                db : object
+                    Optional pymongo Database, the estimated totals of its
+                    flights and legs are added as the counts of
+                    grits_update_counts.py
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The document
+        """
+        document = collections.OrderedDict()
+        document['date'] = datetime.datetime.utcnow()
+        if db is not None:
+            document['counts'] = totals(db)
+        with self._lock:
+            document['import'] = collections.OrderedDict([
+                ('inserted', self.inserted),
+                ('updated', self.updated),
+                ('unchanged', self.unchanged),
+                ('invalid', self.invalid),
+                ('carriers', ImportCounts.ranked(self.carriers, 'carrier')),
+                ('departureCountries', ImportCounts.ranked(self.departure_countries, 'country')),
+                ('providerTypes', ImportCounts.ranked(self.provider_types, 'providerType'))
+            ])
+        return document
+
+    def store(self, db):
+        """ insert the document of the run into the historicalData collection
+
+            Parameters
+            ----------
+                db : object
+                    The pymongo Database
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The document
+        """
+        document = self.document(db)
+        db[settings._HISTORICAL_DATA_COLLECTION_NAME].insert_one(document)
+        return document
@@ -0,0 +1,147 @@
+import binascii
+import logging
+import collections
+
+from tools.grits_metrics import metrics
+
+# the merge policies of a KeyDeduplicator
+_POLICIES = ['last', 'first']
+
+class InvalidDedupPolicy(Exception):
+    """ custom exception that is thrown when an unknown merge policy is
+    configured """
+    def __init__(self, message, *args, **kwargs):
+        """ InvalidDedupPolicy constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(InvalidDedupPolicy, self).__init__(message)
+
+def compact_key(key):
+    """ the key as it is held in memory, md5 hex keys are kept as their 16
+    byte digest to halve the size of a key set
+
+        Parameters
+        ----------
+            key : object
+                The _id of a record
+
+        Returns
+        -------
+            object
+                The digest of a hex key, any other key unchanged
+    """
+    if isinstance(key, basestring) and len(key) == 32:
+        try:
+            return binascii.unhexlify(key)
+        except TypeError:
+            pass
+    return key
+
+class KeyDeduplicator(object):
+    """ coalesces the valid records of a file that share a key
+
+        Repeated rows, and the legs of a multi-leg flight, produce the same
+        _id.  Written as they are, each becomes another upsert and the last
+        one silently wins.  Within a chunk the records are coalesced so that
+        a key is written once.  Across chunks the keys already written are
+        remembered as digests:
+
+            'last' - the latest row of a key wins, a later chunk overwrites
+                     the document written by an earlier one
+            'first' - the earliest row of a key wins, later rows are dropped
+                     before they reach mongoDB
+
+        Either way the number of duplicates is counted and reported.
+    """
+
+    def __init__(self, policy='last'):
+        """ KeyDeduplicator constructor
+
+            Parameters
+            ----------
+                policy : str
+                    The merge policy, 'last' or 'first'
+
+            Raises
+            ------
+                InvalidDedupPolicy
+                    If the policy is unknown
+        """
+        if policy not in _POLICIES:
+            raise InvalidDedupPolicy('unknown dedup policy %r, expected one of %r' % (policy, _POLICIES))
+        self.policy = policy
+        self.written = set()
+        self.coalesced = 0
+        self.overwritten = 0
+        self.dropped = 0
+
+    @property
+    def duplicates(self):
+        """ the number of records that repeated the key of another """
+        return self.coalesced + self.overwritten + self.dropped
+
+    def coalesce(self, records):
+        """ coalesce the valid records of a chunk
+
+            Parameters
+            ----------
+                records : list
+                    The valid records of the chunk in row order
+
+            Returns
+            -------
+                list
+                    The records to write, with a unique key each
+        """
+        unique = collections.OrderedDict()
+        for record in records:
+            key = compact_key(record.id)
+            if key in unique:
+                self.coalesced += 1
+                if self.policy == 'last':
+                    # move the key to the position of its latest row
+                    del unique[key]
+                    unique[key] = record
+            else:
+                unique[key] = record
+
+        coalesced = []
+        overwritten = 0
+        for key, record in unique.iteritems():
+            if key in self.written:
+                if self.policy == 'first':
+                    self.dropped += 1
+                    continue
+                overwritten += 1
+            else:
+                self.written.add(key)
+            coalesced.append(record)
+        self.overwritten += overwritten
+
+        removed = len(records) - len(coalesced)
+        if removed > 0 or overwritten > 0:
+            logging.debug('dedup: %d of %d records removed, %d overwrite earlier chunks',
+                removed, len(records), overwritten)
+        metrics.inc('grits_duplicate_records_total', removed, policy=self.policy)
+        metrics.inc('grits_overwritten_records_total', overwritten)
+        return coalesced
+
+    def report(self):
+        """ the duplicate counts of the file
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The number of unique keys and of each kind of duplicate
+        """
+        report = collections.OrderedDict()
+        report['policy'] = self.policy
+        report['keys'] = len(self.written)
+        report['coalesced'] = self.coalesced
+        report['overwritten'] = self.overwritten
+        report['dropped'] = self.dropped
+        return report
@@ -0,0 +1,103 @@
+import numpy as np
+
+from tools.grits_geo import airport_location, haversine
+
+""" the great-circle distances of the flights, computed chunk by chunk
+
+The flights embed their departure, arrival and stop airports, with the loc of
+each.  set_distances computes the legs of every flight of a chunk in a single
+numpy call and stores, in kilometers rounded to integers:
+
+    greatCircleDistance - from the departure to the arrival airport
+    legDistances - of each leg, from the departure through the stopCodes to
+        the arrival airport
+    routeDistance - the sum of the legs, the greatCircleDistance of a
+        nonstop flight
+
+A distance is None when an airport of it has no location.  The provider's own
+flightDistance column is not read.
+"""
+
+_DISTANCE_FIELDS = ['greatCircleDistance', 'legDistances', 'routeDistance']
+
+def flight_route(record):
+    """ the (longitude, latitude) of the departure, stop and arrival airports
+    of a flight, None for an airport without a location """
+    return ([airport_location(record.get('departureAirport'))] +
+        [airport_location(airport) for airport in record.get('stopCodes') or []] +
+        [airport_location(record.get('arrivalAirport'))])
+
+def kilometers(distances):
+    """ the distances as integers, None for NaN """
+    return [None if np.isnan(distance) else int(round(distance)) for distance in distances]
+
+def set_distances(records):
+    """ set the distance fields of the FlightRecords of a chunk
+
+        Parameters
+        ----------
+            records : list
+                The valid FlightRecords
+    """
+    if len(records) == 0:
+        return
+    routes = [flight_route(record) for record in records]
+    # every leg of the chunk, followed by the departure to arrival pair of
+    # each flight, as one array of origins and one of destinations
+    origins = []
+    destinations = []
+    for route in routes:
+        origins.extend(route[:-1])
+        destinations.extend(route[1:])
+    for route in routes:
+        origins.append(route[0])
+        destinations.append(route[-1])
+    nowhere = (np.nan, np.nan)
+    origins = np.array([point or nowhere for point in origins], dtype=np.float64)
+    destinations = np.array([point or nowhere for point in destinations], dtype=np.float64)
+    distances = haversine(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+
+    legs = np.array([len(route) - 1 for route in routes])
+    offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+    np.cumsum(legs, out=offsets[1:])
+    # a route with a leg of unknown length has no length, as NaN sums to NaN
+    routes_km = np.add.reduceat(distances[:offsets[-1]], offsets[:-1])
+    leg_km = kilometers(distances[:offsets[-1]])
+    direct_km = kilometers(distances[offsets[-1]:])
+    route_km = kilometers(routes_km)
+    for number, record in enumerate(records):
+        record.set('greatCircleDistance', direct_km[number])
+        record.set('legDistances', leg_km[offsets[number]:offsets[number + 1]])
+        record.set('routeDistance', route_km[number])
+
+def distance_query(minimum=None, maximum=None, field='greatCircleDistance'):
+    """ the filter of the flights within a range of distances
+
+        Parameters
+        ----------
+            minimum : int
+                Optional shortest distance in km, inclusive
+            maximum : int
+                Optional longest distance in km, inclusive
+            field : str
+                One of _DISTANCE_FIELDS, 'legDistances' matches the flights
+                with a leg in the range
+
+        Returns
+        -------
+            dict
+                The mongoDB filter, served by the index of the field
+    """
+    if field not in _DISTANCE_FIELDS:
+        raise ValueError('unknown distance field %r, expected one of %r' % (field, _DISTANCE_FIELDS))
+    bounds = {}
+    if minimum is not None:
+        bounds['$gte'] = minimum
+    if maximum is not None:
+        bounds['$lte'] = maximum
+    if len(bounds) == 0:
+        return {field: {'$ne': None}}
+    if field == 'legDistances':
+        # both bounds on the same leg, not one leg each
+        return {field: {'$elemMatch': bounds}}
+    return {field: bounds}
@@ -0,0 +1,133 @@
+import time
+import logging
+import collections
+
+from conf import settings
+from tools.grits_dedup import compact_key
+from tools.grits_keys import key_format_of, to_hex
+from tools.grits_metrics import metrics
+
+class GritsDryRunConnection(object):
+    """ stands in for GritsMongoConnection when nothing may be written
+
+        The file reader passes every chunk of valid and invalid records to
+        bulk_upsert and insert_many as usual.  Instead of writing them, the
+        records are counted, invalid records are tallied by the fields that
+        failed validation and repeated keys are detected.  Airport records are
+        added to the airport cache, so a dry run of a DiioAirport file can
+        serve as the airport snapshot of a FlightGlobal dry run.
+    """
+
+    # number of example duplicate keys kept for the report
+    MAX_DUPLICATE_EXAMPLES = 20
+
+    def __init__(self, airport_cache):
+        """ GritsDryRunConnection constructor
+
+            Parameters
+            ----------
+                airport_cache : object
+                    The AirportCache from grits_mongo.py used by the run
+        """
+        self.airport_cache = airport_cache
+        self.start_time = time.time()
+        self.valid = 0
+        self.invalid = 0
+        self.invalid_by_field = collections.Counter()
+        self.invalid_by_record_type = collections.Counter()
+        self.duplicate_keys = 0
+        self.duplicate_examples = []
+        self._keys = set()
+
+    @property
+    def db(self):
+        """ there is no database in a dry run """
+        return None
+
+    def bulk_upsert(self, collection_name, records, ordered=True):
+        """ count valid records and detect repeated keys
+
+            Parameters
+            ----------
+                collection_name: str
+                    The name of the mongoDB collection
+                records: list
+                    A list of records
+                ordered: bool
+                    Unused, as nothing is written
+        """
+        for record in records:
+            self.valid += 1
+            key = compact_key(record.id)
+            if key in self._keys:
+                self.duplicate_keys += 1
+                if len(self.duplicate_examples) < self.MAX_DUPLICATE_EXAMPLES:
+                    example = record.id
+                    if key_format_of(example) is not None:
+                        example = to_hex(example)
+                    self.duplicate_examples.append(example)
+            else:
+                self._keys.add(key)
+
+        if collection_name == settings._AIRPORT_COLLECTION_NAME:
+            airports = []
+            for record in records:
+                # the fields of a record are shared with the other stages
+                airport = collections.OrderedDict(record.fields)
+                airport['_id'] = record.id
+                airports.append(airport)
+            self.airport_cache.load(airports)
+        return {}
+
+    def insert_many(self, collection_name, records):
+        """ tally invalid records by record type and failing field
+
+            Parameters
+            ----------
+                collection_name: str
+                    The name of the mongoDB collection
+                records: list
+                    A list of InvalidRecords
+        """
+        for record in records:
+            self.invalid += 1
+            self.invalid_by_record_type[record.fields['RecordType']] += 1
+            for field in record.fields['Errors'].keys():
+                if field != 'fields':
+                    self.invalid_by_field[field] += 1
+        return {}
+
+    def report(self):
+        """ the results of the dry run
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The counts and throughput of the run
+        """
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        rows = metrics.counter_value('grits_rows_read_total')
+        report = collections.OrderedDict()
+        report['rows'] = rows
+        report['valid'] = self.valid
+        report['invalid'] = self.invalid
+        report['invalidByRecordType'] = dict(self.invalid_by_record_type)
+        report['invalidByField'] = dict(self.invalid_by_field)
+        report['duplicateKeys'] = self.duplicate_keys
+        report['duplicatesCoalesced'] = metrics.counter_value('grits_duplicate_records_total',
+            policy=settings._DEDUP_POLICY)
+        report['duplicateKeyExamples'] = self.duplicate_examples
+        report['airports'] = len(self.airport_cache)
+        report['seconds'] = elapsed
+        report['rowsPerSecond'] = rows / elapsed
+        return report
+
+    def log_report(self):
+        """ log the results of the dry run """
+        report = self.report()
+        logging.info('dry run: %d rows, %d valid, %d invalid, %d duplicate keys in %.1fs (%.0f rows/sec)',
+            report['rows'], report['valid'], report['invalid'],
+            report['duplicateKeys'], report['seconds'], report['rowsPerSecond'])
+        for field, count in self.invalid_by_field.most_common():
+            logging.info('dry run: %8d invalid %s', count, field)
+        return report
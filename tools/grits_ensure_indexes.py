@@ -6,7 +6,7 @@ import logging
 
 from pathos.threading import ThreadPool
 
-from tools.grits_mongo import GritsMongoConnection
+from tools.grits_mongo import GritsMongoConnection, registry
 from conf import settings
 
 class GritsEnsureIndexes(object):
@@ -34,6 +34,12 @@ class GritsEnsureIndexes(object):
             default='localhost',
             help='the hostname for mongoDB (Default: localhost)')
 
+        self.parser.add_argument('--mongo-profile',
+            choices=sorted(settings._MONGO_PROFILES.keys()),
+            default=settings._MONGO_PROFILE,
+            help='the write concern, pool size and compression of the ' \
+                'mongoDB client (Default: %s)' % settings._MONGO_PROFILE)
+
         self.parser.add_argument('-f', '--force', 
             action='store_true',
             help='do not require confirmation to create indexes (Default: False)')
@@ -105,4 +111,5 @@ class GritsEnsureIndexes(object):
             # async-poll is done, get the results
             result = results.get()
             logging.info(result)
+        registry.close()
         
\ No newline at end of file
@@ -9,8 +9,14 @@ from pathos.threading import ThreadPool
 from datetime import datetime
 
 from conf import settings
-from tools.grits_record import InvalidRecord
-from tools.csv_helpers import UnicodeReader
+from tools.grits_record import FlightRecord, InvalidRecord, RecordContext
+from tools.grits_distances import set_distances
+from tools.grits_mongo import AirportCache
+from tools.grits_dedup import KeyDeduplicator
+from tools.grits_memory import MemoryBudget
+from tools.grits_write_order import ExternalSorter, order_records
+from tools.grits_metrics import metrics
+from tools.grits_profiler import profiler
 
 class InvalidFileFormat(Exception):
     """ custom exception that is thrown when the file format is invalid """
@@ -27,7 +33,7 @@ class InvalidFileFormat(Exception):
 class GritsFileReader:
     """ the class responsible for reading the file """
 
-    def __init__(self, provider_type, program_arguments):
+    def __init__(self, provider_type, program_arguments, airport_cache=None):
         """ GritsFileReader constructor
 
             Parameters
@@ -36,27 +42,71 @@ class GritsFileReader:
                     A provider type object from grits_provider_type.py
                 program_arguments: dict
                     A dict containing the argparse program arguments
+                airport_cache: object
+                    Optional AirportCache from grits_mongo.py, one is created
+                    from the mongo_connection when not provided
 
         """
 
         self.provider_type = provider_type
         self.program_arguments = program_arguments
+        self.airport_cache = airport_cache
+        self.invalid_collection_name = settings._INVALID_RECORD_COLLECTION_NAME
+        self.memory_budget = None
+        self.history = None # optional GritsHistory of the flights
+        self.deduplicator = None
+        if settings._DEDUP_POLICY is not None:
+            self.deduplicator = KeyDeduplicator(settings._DEDUP_POLICY)
+        self.write_order = settings._WRITE_ORDER
+        self.sorter = None # ExternalSorter of a --presort import
+        self.counts = None # optional ImportCounts of the run
+        self.exports = [] # stages such as the ODMatrixBuilder fed the written records
 
         self.empty_row_count = 0 # number of empty rows encountered within record set
         self.end_of_data = False # flag that represents that the end of the data has been reached
         self.header_row = []
+        self.context = None
+
+        # totals of the file, for reports that span several files
+        self.rows_read = 0
+        self.valid_count = 0
+        self.invalid_count = 0
+        self.duplicate_count = 0
 
     @staticmethod
-    def gen_chunks(reader, mongo_connection):
-        """ yield chunks of the file for batch processing """
+    def gen_chunks(reader, chunk_size=None):
+        """ yield chunks of the file for batch processing
+
+            Parameters
+            ----------
+                reader : object
+                    The csv reader positioned after the header
+                chunk_size: function
+                    Optional function returning the number of rows of the
+                    next chunk, settings._CHUNK_SIZE is used when None
+        """
+        if chunk_size is None:
+            chunk_size = lambda: settings._CHUNK_SIZE
         chunk = [];
+        size = chunk_size()
         for row_number, row in enumerate(reader):
-            if (row_number % settings._CHUNK_SIZE == 0 and row_number > 0):
+            if len(chunk) >= size:
                 yield chunk
                 del chunk[:]
-            chunk.append([row_number, row, mongo_connection])
+                size = chunk_size()
+            chunk.append((row_number, row))
         yield chunk
 
+    @staticmethod
+    def gen_batches(records, batch_size):
+        """ yield slices of records of at most batch_size, or all of the
+        records when batch_size is None """
+        if not batch_size:
+            yield records
+            return
+        for start in range(0, len(records), batch_size):
+            yield records[start:start + batch_size]
+
     def find_header(self, reader):
         """ find the header based off the provider_type """
         for row_number, line in enumerate(reader):
@@ -72,46 +122,217 @@ class GritsFileReader:
 
     def process(self, mongo_connection):
         """ process a chunk of rows in the file """
-        reader = UnicodeReader(self.program_arguments.infile, dialect=self.provider_type.dialect)
+        reader = self.provider_type.reader(self.program_arguments.infile)
         self.find_header(reader)
 
-        for chunk in GritsFileReader.gen_chunks(reader, mongo_connection):
-            # collections of valid and invaid records to be batch upsert / insert many
-            valid_records = []
-            invalid_records = []
-            # is threading enabled?  this may increase performance when mongoDB
-            # is not running on localhost due to busy wait on finding an airport
-            # in the case of FlightGlobalType.
-            if settings._THREADING_ENABLED:
-                pool = ThreadPool(nodes=settings._NODES)
-                results = pool.amap(self.process_row, chunk)
-
-                while not results.ready():
-                    # command-line spinner
-                    for cursor in '|/-\\':
-                        sys.stdout.write('\b%s' % cursor)
-                        sys.stdout.flush()
-                        time.sleep(.25)
-
-                sys.stdout.write('\b')
-                sys.stdout.flush()
-                # async-poll is done, get the results
-                result = results.get()
-                valid_records = [ x[0] for x in result if x[0] is not None ]
-                invalid_records = [ x[1] for x in result if x[1] is not None ]
+        if self.airport_cache is None:
+            self.airport_cache = AirportCache(mongo_connection.db)
+        metrics.airport_cache = self.airport_cache
 
-            else:
-                # single-threaded synchronous processing
-                for data in chunk:
-                    valid, invalid = self.process_row(data)
-                    if valid != None: valid_records.append(valid)
-                    if invalid != None: invalid_records.append(invalid)
-
-            # bulk upsert / inset many of the records
-            valid_result = mongo_connection.bulk_upsert(self.provider_type.collection_name, valid_records)
-            invalid_result = mongo_connection.insert_many(settings._INVALID_RECORD_COLLECTION_NAME, invalid_records)
+        # the state shared by every record of the file
+        with profiler.timer('header'):
+            self.context = RecordContext(self.provider_type.record,
+                self.header_row, self.provider_type.map,
+                self.provider_type.collection_name, mongo_connection,
+                self.airport_cache)
+
+        chunk_size = None
+        if settings._MAX_MEMORY_MB is not None:
+            self.memory_budget = MemoryBudget(settings._MAX_MEMORY_MB * 1024 * 1024,
+                settings._CHUNK_SIZE, settings._MIN_CHUNK_SIZE, settings._MAX_CHUNK_SIZE)
+            chunk_size = self.memory_budget.next_chunk_size
+
+        if settings._PRESORT:
+            self.sorter = ExternalSorter()
+        try:
+            self.process_chunks(mongo_connection, reader, chunk_size)
+        finally:
+            if self.sorter is not None:
+                self.sorter.close()
+
+        if self.deduplicator is not None and self.deduplicator.duplicates > 0:
+            logging.info('duplicate keys (%s wins): %d coalesced within chunks, %d overwritten, %d dropped',
+                self.deduplicator.policy, self.deduplicator.coalesced,
+                self.deduplicator.overwritten, self.deduplicator.dropped)
+
+    def process_chunks(self, mongo_connection, reader, chunk_size=None):
+        """ process the rows of the file chunk by chunk
+
+            Parameters
+            ----------
+                mongo_connection: object
+                    The connection the records are written to
+                reader : object
+                    The reader positioned after the header
+                chunk_size: function
+                    Optional function returning the number of rows of the
+                    next chunk
+        """
+        chunks = GritsFileReader.gen_chunks(reader, chunk_size)
+        chunk_number = 0
+        while True:
+            if self.memory_budget is not None:
+                self.memory_budget.start_chunk()
+            with profiler.timer('read'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            profiler.start_chunk()
+            chunk_start = time.time()
+            valid_records, invalid_records = self.process_chunk(chunk)
+            if settings._FLIGHT_DISTANCES and self.provider_type.record is FlightRecord:
+                with profiler.timer('distance'):
+                    set_distances(valid_records)
+
+            if self.memory_budget is not None:
+                # every record of the chunk is alive at this point
+                self.memory_budget.sample()
+
+            valid_count = len(valid_records)
+            if self.deduplicator is not None:
+                with profiler.timer('dedup'):
+                    valid_records = self.deduplicator.coalesce(valid_records)
+            unique_count = len(valid_records)
+
+            if self.sorter is not None:
+                # the valid records are written once the file has been read
+                with profiler.timer('presort'):
+                    self.sorter.add(valid_records)
+                valid_records = []
+            elif self.write_order is not None:
+                with profiler.timer('order'):
+                    valid_records = order_records(valid_records, self.write_order)
+
+            self.write_chunk(mongo_connection, valid_records, invalid_records)
+            profiler.end_chunk(chunk_number)
+
+            self.rows_read += len(chunk)
+            self.valid_count += valid_count
+            self.invalid_count += len(invalid_records)
+            self.duplicate_count += valid_count - unique_count
+            record_type = self.provider_type.record.__name__
+            metrics.inc('grits_rows_read_total', len(chunk))
+            metrics.inc('grits_valid_records_total', valid_count, record_type=record_type)
+            metrics.inc('grits_invalid_records_total', len(invalid_records), record_type=record_type)
+            metrics.inc('grits_chunks_total')
+            metrics.observe('grits_chunk_seconds', time.time() - chunk_start)
+            if self.memory_budget is not None:
+                metrics.set('grits_chunk_size', self.memory_budget.end_chunk(len(chunk)))
+            metrics.progress()
+            metrics.publish()
+            chunk_number += 1
+
+        if self.sorter is not None:
+            self.write_sorted(mongo_connection)
+        self.flush()
+        if self.history is not None:
+            self.history.finish()
+
+    def write_sorted(self, mongo_connection):
+        """ write the valid records held by the sorter in _id order
+
+            Parameters
+            ----------
+                mongo_connection: object
+                    The connection the records are written to
+        """
+        start = time.time()
+        written = 0
+        for batch in self.sorter.batches(settings._BATCH_SIZE or settings._CHUNK_SIZE):
+            self.write_chunk(mongo_connection, batch, [])
+            written += len(batch)
+        logging.info('presort: wrote %d records from %d runs in %.1fs', written,
+            max(len(self.sorter.runs), 1), time.time() - start)
+
+    def process_chunk(self, chunk):
+        """ create and validate the records of a chunk
+
+            Parameters
+            ----------
+                chunk : list
+                    (row number, row) tuples from gen_chunks
+
+            Returns
+            -------
+                tuple
+                    The list of valid records and the list of invalid records
+        """
+        # collections of valid and invaid records to be batch upsert / insert many
+        valid_records = []
+        invalid_records = []
+        # is threading enabled?  this may increase performance when mongoDB
+        # is not running on localhost due to busy wait on finding an airport
+        # in the case of FlightGlobalType.
+        if settings._THREADING_ENABLED:
+            pool = ThreadPool(nodes=settings._NODES)
+            results = pool.amap(self.process_row, chunk)
+
+            while not results.ready():
+                # command-line spinner
+                for cursor in '|/-\\':
+                    sys.stdout.write('\b%s' % cursor)
+                    sys.stdout.flush()
+                    # wait rather than sleep so a finished chunk is not
+                    # held back until the spinner completes a turn
+                    results.wait(.25)
+                    if results.ready():
+                        break
+
+            sys.stdout.write('\b')
+            sys.stdout.flush()
+            # async-poll is done, get the results
+            result = results.get()
+            valid_records = [ x[0] for x in result if x[0] is not None ]
+            invalid_records = [ x[1] for x in result if x[1] is not None ]
+
+        else:
+            # single-threaded synchronous processing
+            for data in chunk:
+                valid, invalid = self.process_row(data)
+                if valid != None: valid_records.append(valid)
+                if invalid != None: invalid_records.append(invalid)
+
+        return valid_records, invalid_records
+
+    def write_chunk(self, mongo_connection, valid_records, invalid_records):
+        """ bulk upsert the valid records and insert the invalid records of a
+        chunk
+
+            Parameters
+            ----------
+                mongo_connection: object
+                    The connection the records are written to
+                valid_records : list
+                    The valid records, with unique keys unless the
+                    deduplicator is disabled
+                invalid_records : list
+                    The InvalidRecords
+        """
+        # bulk upsert / inset many of the records, once the keys are
+        # unique the order of the upserts no longer matters
+        ordered = self.deduplicator is None
+        for batch in GritsFileReader.gen_batches(valid_records, settings._BATCH_SIZE):
+            if self.history is not None:
+                self.history.record(batch)
+            valid_result = mongo_connection.bulk_upsert(self.provider_type.collection_name, batch, ordered)
             logging.debug('valid_result: %r', valid_result)
-            logging.debug('invalid_result: %r', invalid_result)
+            if self.counts is not None:
+                self.counts.add_records(self.provider_type, batch)
+                self.counts.add_result(valid_result)
+            for export in self.exports:
+                export.add(batch)
+        invalid_result = mongo_connection.insert_many(self.invalid_collection_name, invalid_records)
+        logging.debug('invalid_result: %r', invalid_result)
+        if self.counts is not None:
+            self.counts.add_invalid(len(invalid_records))
+
+    def flush(self):
+        """ wait for the writes of every chunk, once the file has been read
+
+            The writes of GritsFileReader are synchronous, so there is nothing
+            to wait for.
+        """
+        pass
 
     def process_row(self, args):
         """ process each row according to the record type contract
@@ -122,12 +343,9 @@ class GritsFileReader:
                     the current row number
                 args[1] - row: object
                     A python csv module row object
-                args[2] - mongo_connection: object
-                    A GritsMongoConnection object from grits_mongo.py
         """
         row_count = args[0]
         row = args[1]
-        mongo_connection = args[2]
 
         if self.program_arguments.verbose:
             # echo the contents of the row in verbose mode
@@ -135,22 +353,22 @@ class GritsFileReader:
 
         if row_count >= self.provider_type.data_position and not self.end_of_data:
             if any(row):
-                header_row = self.header_row
-                provider_map = self.provider_type.map
-                collection_name = self.provider_type.collection_name
-
                 # init the record object based on the type
-                record = self.provider_type.record(header_row, provider_map, collection_name, row_count, mongo_connection)
+                record = self.context.create_record(row_count)
 
                 # create the record
                 record.create(row)
 
                 # validate
-                if record.validate():
+                with profiler.timer('validate'):
+                    is_valid = record.validate()
+                if is_valid:
                     return [record,None]
                 else:
-                    invalid_record = InvalidRecord(record.validation_errors(), type(record).__name__, record.row_count)
-                    if invalid_record.validate():
+                    with profiler.timer('validate'):
+                        invalid_record = InvalidRecord(record.validation_errors(), type(record).__name__, record.row_count)
+                        is_valid = invalid_record.validate()
+                    if is_valid:
                         return [None,invalid_record]
             else:
                 # check for special case where empty line signal end_of_data
@@ -0,0 +1,104 @@
+import collections
+
+import numpy as np
+
+from conf import settings
+
+""" vectorized geometry of airport coordinates
+
+The airports store their location as a GeoJSON Point, [longitude, latitude]
+in degrees.  The functions take numpy arrays, or scalars, so the distances of
+every edge of the network are computed in a single call.
+"""
+
+# the mean radius of the earth
+_EARTH_RADIUS_KM = 6371.0088
+
+def load_countries(path=None):
+    """ the name and center of each country
+
+        Parameters
+        ----------
+            path : str
+                The countries file, lines of the ISO code, latitude,
+                longitude and name separated by spaces, the center may be
+                missing, defaults to
+                settings._COUNTRIES_FILE
+
+        Returns
+        -------
+            collections.OrderedDict
+                The (name, longitude, latitude) by ISO code, NaN when the
+                center is missing
+    """
+    countries = collections.OrderedDict()
+    with open(path or settings._COUNTRIES_FILE) as f:
+        for line in f:
+            parts = line.split(None, 3)
+            if len(parts) < 2:
+                continue
+            try:
+                code, latitude, longitude, name = parts
+                countries[code] = (name.strip(), float(longitude), float(latitude))
+            except ValueError:
+                # a few countries have no center
+                code, name = line.split(None, 1)
+                countries[code] = (name.strip(), np.nan, np.nan)
+    return countries
+
+def airport_location(airport):
+    """ the (longitude, latitude) of an airport document, None when it has no
+    valid location """
+    if not isinstance(airport, dict):
+        return None
+    loc = airport.get('loc')
+    if not isinstance(loc, dict):
+        return None
+    coordinates = loc.get('coordinates')
+    if not coordinates or len(coordinates) != 2 or None in coordinates:
+        return None
+    return (float(coordinates[0]), float(coordinates[1]))
+
+def haversine(longitude1, latitude1, longitude2, latitude2):
+    """ the great-circle distance between points
+
+        Parameters
+        ----------
+            longitude1, latitude1 : np.ndarray
+                The first points, in degrees
+            longitude2, latitude2 : np.ndarray
+                The second points, in degrees, of the shape of the first or
+                broadcast against them
+
+        Returns
+        -------
+            np.ndarray
+                The distances in kilometers, NaN where a coordinate is NaN
+    """
+    longitude1, latitude1, longitude2, latitude2 = [np.radians(np.asarray(value, dtype=np.float64))
+        for value in (longitude1, latitude1, longitude2, latitude2)]
+    a = (np.sin((latitude2 - latitude1) / 2.0) ** 2 +
+        np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2.0) ** 2)
+    return 2.0 * _EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def unit_vectors(longitudes, latitudes):
+    """ the points as unit vectors from the center of the earth, the
+    Euclidean distance between them is the chord of their great circle
+
+        Returns
+        -------
+            np.ndarray
+                An (n, 3) array
+    """
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    return np.column_stack((np.cos(latitudes) * np.cos(longitudes),
+        np.cos(latitudes) * np.sin(longitudes), np.sin(latitudes)))
+
+def chord_to_km(chord):
+    """ the great-circle distance of a chord of the unit sphere """
+    return 2.0 * _EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2.0, 0.0, 1.0))
+
+def km_to_chord(km):
+    """ the chord of the unit sphere of a great-circle distance """
+    return 2.0 * np.sin(np.asarray(km, dtype=np.float64) / (2.0 * _EARTH_RADIUS_KM))
@@ -0,0 +1,427 @@
+import os
+import csv
+import json
+import time
+import Queue
+import logging
+import threading
+import collections
+
+import numpy as np
+import requests
+
+from conf import settings
+from tools.grits_geo import airport_location, chord_to_km, km_to_chord, load_countries, unit_vectors
+
+""" reverse geocoding of airport locations for FixAirports
+
+A geocoder answers the city, state and country of a batch of coordinates.
+The OpenCageGeocoder asks the OpenCage API for those it has not cached.  The
+OfflineGeocoder answers from the nearest of a set of known places instead,
+indexed once in a GridIndex, so every airport is fixed in seconds without
+network access.  The places are a CSV such as the rg_cities1000.csv of GeoNames
+or, by default, the airports of the database other than those being fixed.
+"""
+
+_GEOCODERS = ['offline', 'opencage']
+
+class InvalidGeocoder(Exception):
+    """ custom exception that is thrown when an unknown geocoder is
+    configured """
+    def __init__(self, message, *args, **kwargs):
+        """ InvalidGeocoder constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(InvalidGeocoder, self).__init__(message)
+
+def location(city=None, state=None, country=None, country_name=None, region=None):
+    """ the fields FixAirports sets on an airport """
+    return collections.OrderedDict([('city', city), ('country', country),
+        ('countryName', country_name), ('stateName', state), ('globalRegion', region)])
+
+class GridIndex(object):
+    """ nearest neighbour search over points of the sphere
+
+        The points are indexed as unit vectors in a grid of cubes of the
+        chord of cell_km.  A query searches the shells of cells around its own
+        cell until the nearest point found is closer than any point of the
+        cells not searched yet, so the answer is exact and only the cells
+        near the query are read.
+    """
+
+    def __init__(self, longitudes, latitudes, cell_km=None):
+        """ GridIndex constructor
+
+            Parameters
+            ----------
+                longitudes : np.ndarray
+                    The longitudes of the points, in degrees
+                latitudes : np.ndarray
+                    The latitudes of the points, in degrees
+                cell_km : float
+                    The size of the cells, defaults to
+                    settings._GEOCODER_CELL_KM
+        """
+        self.size = float(km_to_chord(cell_km or settings._GEOCODER_CELL_KM))
+        self.points = unit_vectors(longitudes, latitudes)
+        # the cells span [-1, 1] on each axis
+        self.width = int(np.ceil(2.0 / self.size)) + 1
+        cells = self.cell_ids(self.cells(self.points))
+        self.order = np.argsort(cells, kind='mergesort')
+        self.sorted_cells = cells[self.order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def cells(self, vectors):
+        return np.floor((vectors + 1.0) / self.size).astype(np.int64)
+
+    def cell_ids(self, cells):
+        return (cells[..., 0] * self.width + cells[..., 1]) * self.width + cells[..., 2]
+
+    def shell(self, cell, radius):
+        """ the ids of the cells at Chebyshev distance radius from a cell """
+        steps = np.arange(-radius, radius + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+        offsets = offsets[np.abs(offsets).max(axis=1) == radius]
+        cells = cell + offsets
+        cells = cells[((cells >= 0) & (cells < self.width)).all(axis=1)]
+        return self.cell_ids(cells)
+
+    def nearest(self, longitude, latitude):
+        """ the nearest point
+
+            Parameters
+            ----------
+                longitude : float
+                    The longitude of the query, in degrees
+                latitude : float
+                    The latitude of the query, in degrees
+
+            Returns
+            -------
+                tuple
+                    The position of the point and its distance in km, None
+                    when there is no point
+        """
+        if len(self) == 0:
+            return None
+        vector = unit_vectors([longitude], [latitude])[0]
+        cell = self.cells(vector)
+        best, best_chord = None, np.inf
+        radius = 0
+        while radius <= self.width:
+            ids = self.shell(cell, radius)
+            starts = np.searchsorted(self.sorted_cells, ids, side='left')
+            ends = np.searchsorted(self.sorted_cells, ids, side='right')
+            candidates = np.concatenate([self.order[start:end]
+                for start, end in zip(starts, ends)] + [np.zeros(0, dtype=np.int64)])
+            if len(candidates) > 0:
+                chords = np.sqrt(((self.points[candidates] - vector) ** 2).sum(axis=1))
+                position = chords.argmin()
+                if chords[position] < best_chord:
+                    best, best_chord = candidates[position], chords[position]
+            # the points outside the shells searched are further than radius
+            # cells on some axis
+            if best is not None and best_chord <= radius * self.size:
+                break
+            radius += 1
+        if best is None:
+            return None
+        return int(best), float(chord_to_km(best_chord))
+
+class OfflineGeocoder(object):
+    """ answers the location of the nearest known place """
+
+    def __init__(self, places, cell_km=None):
+        """ OfflineGeocoder constructor
+
+            Parameters
+            ----------
+                places : list
+                    (longitude, latitude, location) tuples, with the fields of
+                    location()
+                cell_km : float
+                    The size of the cells of the GridIndex
+        """
+        self.places = [place[2] for place in places]
+        self.index = GridIndex([place[0] for place in places], [place[1] for place in places], cell_km)
+
+    def __len__(self):
+        return len(self.places)
+
+    @staticmethod
+    def from_file(path, countries=None):
+        """ the places of a CSV of lat, lon, name, admin1 and cc columns, the
+        format of the GeoNames cities of the reverse_geocoder package
+
+            Parameters
+            ----------
+                path : str
+                    The path of the CSV, with a header row
+                countries : dict
+                    Optional country names by code, see
+                    grits_geo.load_countries
+        """
+        countries = countries if countries is not None else load_countries()
+        places = []
+        with open(path, 'rb') as f:
+            for row in csv.DictReader(f):
+                code = row.get('cc') or None
+                name = countries[code][0] if code in countries else None
+                places.append((float(row['lon']), float(row['lat']), location(
+                    row.get('name') or None, row.get('admin1') or None, code, name)))
+        return OfflineGeocoder(places)
+
+    @staticmethod
+    def from_airports(airports):
+        """ the places of airport documents
+
+            Parameters
+            ----------
+                airports : iterable
+                    The airport documents, those without a location are
+                    skipped
+        """
+        places = []
+        for airport in airports:
+            coordinates = airport_location(airport)
+            if coordinates is None:
+                continue
+            places.append(coordinates + (location(airport.get('city'), airport.get('stateName'),
+                airport.get('country'), airport.get('countryName'), airport.get('globalRegion')),))
+        return OfflineGeocoder(places)
+
+    def reverse(self, coordinates):
+        """ the locations of a batch of coordinates
+
+            Parameters
+            ----------
+                coordinates : list
+                    (longitude, latitude) tuples
+
+            Returns
+            -------
+                list
+                    The location() of each coordinate, None when there is no
+                    place
+        """
+        locations = []
+        for longitude, latitude in coordinates:
+            found = self.index.nearest(longitude, latitude)
+            locations.append(None if found is None else self.places[found[0]])
+        return locations
+
+class GeocodeCache(object):
+    """ the answers of the geocoding API, one JSON line each
+
+        The answers are keyed by the coordinates rounded to
+        settings._GEOCODER_CACHE_DIGITS decimals, so an airport is only asked
+        for again once it moves.  A coordinate the API has no answer for is
+        cached as null, a failed request is not cached.
+    """
+
+    def __init__(self, path, digits=None):
+        """ GeocodeCache constructor
+
+            Parameters
+            ----------
+                path : str
+                    The path of the file, None keeps the answers in memory
+                    only
+                digits : int
+                    The decimals of the key, defaults to
+                    settings._GEOCODER_CACHE_DIGITS
+        """
+        self.path = path
+        self.digits = settings._GEOCODER_CACHE_DIGITS if digits is None else digits
+        self.entries = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line, object_pairs_hook=collections.OrderedDict)
+                        self.entries[entry['key']] = entry['location']
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def key(self, longitude, latitude):
+        return '%.*f,%.*f' % (self.digits, latitude, self.digits, longitude)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, location):
+        """ cache the answer of a key and append it to the file """
+        entry = collections.OrderedDict([('key', key), ('location', location)])
+        with self._lock:
+            self.entries[key] = location
+            if self.path is None:
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+class RateLimiter(object):
+    """ spaces the requests of every thread 1 / rate seconds apart """
+
+    def __init__(self, rate):
+        """ RateLimiter constructor
+
+            Parameters
+            ----------
+                rate : float
+                    The requests per second, None or 0 does not wait
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """ block until the next request may be sent """
+        with self._lock:
+            now = time.time()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class OpenCageGeocoder(object):
+    """ asks the OpenCage API for the coordinates that are not cached
+
+        The requests are sent by settings._OPENCAGE_THREADS threads sharing
+        the pooled connections of a requests.Session, at most
+        settings._OPENCAGE_RATE per second.
+    """
+
+    def __init__(self, cache=None, url=None, key=None, threads=None, rate=None):
+        """ OpenCageGeocoder constructor
+
+            Parameters
+            ----------
+                cache : GeocodeCache
+                    The answers of earlier runs, defaults to
+                    settings._GEOCODER_CACHE
+                url : str
+                    The API endpoint, defaults to settings._OPENCAGE_URL
+                key : str
+                    The API key, defaults to settings._OPENCAGE_KEY
+                threads : int
+                    The concurrent requests, defaults to
+                    settings._OPENCAGE_THREADS
+                rate : float
+                    The requests per second, defaults to
+                    settings._OPENCAGE_RATE
+        """
+        self.cache = cache if cache is not None else GeocodeCache(settings._GEOCODER_CACHE)
+        self.url = url or settings._OPENCAGE_URL
+        self.key = key or settings._OPENCAGE_KEY
+        self.threads = threads or settings._OPENCAGE_THREADS
+        self.limiter = RateLimiter(settings._OPENCAGE_RATE if rate is None else rate)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.threads)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def request(self, longitude, latitude):
+        """ the location of a coordinate, None when the API has no answer
+
+            Raises
+            ------
+                requests.RequestException
+                    If the request fails
+        """
+        self.limiter.wait()
+        response = self.session.get(self.url, params={'q': '%s,%s' % (latitude, longitude),
+            'key': self.key, 'no_annotations': 1}, timeout=settings._OPENCAGE_TIMEOUT)
+        response.raise_for_status()
+        results = response.json().get('results') or []
+        if len(results) == 0:
+            return None
+        components = results[0]['components']
+        return location(
+            components.get('local_administrative_area') or components.get('town') or
+                components.get('village') or components.get('suburb'),
+            components.get('state'), components.get('country_code'), components.get('country'))
+
+    def reverse(self, coordinates):
+        """ the locations of a batch of coordinates, see
+        OfflineGeocoder.reverse, None as well when the request failed """
+        keys = [self.cache.key(longitude, latitude) for longitude, latitude in coordinates]
+        queue = Queue.Queue()
+        for key, (longitude, latitude) in sorted(dict(zip(keys, coordinates)).items()):
+            if key not in self.cache:
+                queue.put((key, longitude, latitude))
+        misses = queue.qsize()
+
+        def worker():
+            while True:
+                try:
+                    key, longitude, latitude = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    answer = self.request(longitude, latitude)
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    logging.warn('geocoding %s failed: %s', key, e)
+                    with self._lock:
+                        self.failures += 1
+                    continue
+                self.cache.put(key, answer)
+                with self._lock:
+                    self.requests += 1
+
+        workers = [threading.Thread(target=worker) for i in range(min(self.threads, misses))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        logging.info('opencage geocoder: %d coordinates, %d cached, %d requested, %d failed',
+            len(set(keys)), len(set(keys)) - misses, misses - self.failures, self.failures)
+        return [self.cache.get(key) for key in keys]
+
+def create_geocoder(name, db=None, exclude=()):
+    """ the geocoder of a --geocoder choice
+
+        Parameters
+        ----------
+            name : str
+                One of _GEOCODERS
+            db : object
+                The pymongo Database, whose airports are the places of the
+                offline geocoder when settings._GEOCODER_PLACES is None
+            exclude : list
+                The codes of the airports that are not places, those being
+                fixed
+
+        Raises
+        ------
+            InvalidGeocoder
+                If the geocoder is unknown
+    """
+    if name == 'opencage':
+        return OpenCageGeocoder()
+    if name != 'offline':
+        raise InvalidGeocoder('unknown geocoder %r, expected one of %r' % (name, _GEOCODERS))
+    if settings._GEOCODER_PLACES is not None:
+        geocoder = OfflineGeocoder.from_file(settings._GEOCODER_PLACES)
+    else:
+        geocoder = OfflineGeocoder.from_airports(db[settings._AIRPORT_COLLECTION_NAME].find(
+            {'_id': {'$nin': list(exclude)}},
+            {'city': 1, 'stateName': 1, 'country': 1, 'countryName': 1, 'globalRegion': 1, 'loc': 1}))
+    logging.info('offline geocoder: %d places', len(geocoder))
+    return geocoder
@@ -0,0 +1,223 @@
+import os
+import logging
+
+import numpy as np
+
+from tools.grits_geo import airport_location, haversine
+from tools.grits_od_matrix import airport_code
+from tools.grits_stage import FlightRowStage
+
+""" the flight network as a sparse graph, for spread simulations
+
+The FlightGraphBuilder is an import stage that keeps the edges of every
+imported flight: a leg between each pair of consecutive airports of its
+departure, stopCodes and arrival, and for a flight with stops the through
+edge from its departure to its arrival airport, which a passenger can travel
+without changing planes.  Once the import is done the edges are summed per
+pair of airports into compressed sparse row (CSR) arrays and saved to a .npz
+file, which FlightGraph loads without reading a flight from mongoDB.
+"""
+
+_GRAPH_ARRAYS = ['airports', 'longitude', 'latitude', 'indptr', 'indices',
+    'seats', 'frequency', 'distance']
+
+def flight_edges(fields):
+    """ the (origin, destination) codes of the edges of a flight
+
+        Parameters
+        ----------
+            fields : dict
+                The fields of a FlightRecord
+
+        Returns
+        -------
+            list
+                The legs in flight order, followed by the through edge when
+                the flight has stops
+    """
+    departure = airport_code(fields.get('departureAirport'))
+    arrival = airport_code(fields.get('arrivalAirport'))
+    if departure is None or arrival is None:
+        return []
+    stops = [airport_code(stop) for stop in fields.get('stopCodes') or []]
+    route = [departure] + [code for code in stops if code is not None] + [arrival]
+    edges = [(origin, destination) for origin, destination in zip(route, route[1:])
+        if origin != destination]
+    if len(route) > 2 and departure != arrival:
+        edges.append((departure, arrival))
+    return edges
+
+class FlightGraphBuilder(FlightRowStage):
+    """ collects the edges of the flights written by the readers of a run
+
+        The seats of an edge are the weekly seats (totalSeats times
+        weeklyFrequency) of the flights using it and its frequency their
+        weekly flights.
+    """
+
+    columns = [('origins', np.int32, True), ('destinations', np.int32, True),
+        ('seats', np.int64, False), ('frequency', np.int64, False)]
+
+    def __init__(self, path):
+        """ FlightGraphBuilder constructor
+
+            Parameters
+            ----------
+                path : str
+                    The .npz file the graph is written to
+        """
+        super(FlightGraphBuilder, self).__init__()
+        self.path = path
+        self.airports = {}
+        self.locations = {}
+
+    def airport_number(self, airport):
+        """ the number of an embedded airport, in the order they are seen """
+        code = airport_code(airport)
+        number = self.airports.get(code)
+        if number is None:
+            number = self.airports[code] = len(self.airports)
+            self.locations[code] = airport_location(airport)
+        return number
+
+    def row(self, record):
+        """ the edges and weekly seats and flights of a flight """
+        fields = record.fields
+        edges = flight_edges(fields)
+        if len(edges) == 0:
+            return None
+        airports = dict((airport_code(airport), airport) for airport in
+            [fields.get('departureAirport'), fields.get('arrivalAirport')] + list(fields.get('stopCodes') or []))
+        origins = [self.airport_number(airports[origin]) for origin, destination in edges]
+        destinations = [self.airport_number(airports[destination]) for origin, destination in edges]
+        frequency = fields.get('weeklyFrequency') or 0
+        return (origins, destinations, (fields.get('totalSeats') or 0) * frequency, frequency)
+
+    def arrays(self):
+        """ the arrays of the graph, see FlightGraph """
+        codes = sorted(self.airports)
+        count = len(codes)
+        # renumber the airports in code order
+        order = np.zeros(count, dtype=np.int64)
+        for number, code in enumerate(codes):
+            order[self.airports[code]] = number
+        origins, offsets = self.column('origins')
+        destinations, offsets = self.column('destinations')
+        origin = order[origins]
+        destination = order[destinations]
+        # the weights of a flight on each of its edges
+        edges = np.diff(offsets)
+        seats = np.repeat(self.column('seats'), edges)
+        frequency = np.repeat(self.column('frequency'), edges)
+
+        locations = np.array([self.locations[code] or (np.nan, np.nan) for code in codes],
+            dtype=np.float64).reshape(count, 2)
+        # the edges sorted by origin then destination, with the flights of an
+        # edge summed
+        cells, inverse = np.unique(origin * max(count, 1) + destination, return_inverse=True)
+        total = lambda values: np.bincount(inverse, weights=values.astype(np.float64),
+            minlength=len(cells)).astype(np.int64)
+        rows = cells // max(count, 1)
+        indices = (cells % max(count, 1)).astype(np.int32)
+        return {
+            'airports': np.array(codes, dtype='S%d' % max([len(code) for code in codes] + [1])),
+            'longitude': locations[:, 0],
+            'latitude': locations[:, 1],
+            'indptr': np.searchsorted(rows, np.arange(count + 1)).astype(np.int64),
+            'indices': indices,
+            'seats': total(seats),
+            'frequency': total(frequency),
+            'distance': haversine(locations[rows, 0], locations[rows, 1],
+                locations[indices, 0], locations[indices, 1]),
+        }
+
+    def write(self):
+        """ write the graph to the path
+
+            Returns
+            -------
+                dict
+                    The arrays that were written
+        """
+        with self._lock:
+            try:
+                arrays = self.arrays()
+                flights = len(self)
+            finally:
+                self.close()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # np.savez adds .npz to names without it, write beside and rename so
+        # readers never see a partial file
+        temporary = self.path + '.tmp.npz'
+        np.savez(temporary, **arrays)
+        os.rename(temporary, self.path)
+        logging.info('graph: %d flights, %d airports, %d edges written to %s',
+            flights, len(arrays['airports']), len(arrays['indices']), self.path)
+        return arrays
+
+class FlightGraph(object):
+    """ the CSR flight network written by FlightGraphBuilder
+
+        The out-edges of the airport numbered i are indices[indptr[i]:
+        indptr[i + 1]], with the weights 'seats', 'frequency' and 'distance'
+        (great-circle kilometers, NaN when an airport has no location) at the
+        same positions.
+    """
+
+    def __init__(self, path):
+        """ FlightGraph constructor
+
+            Parameters
+            ----------
+                path : str
+                    The .npz file of the graph
+        """
+        with np.load(path) as npz:
+            for name in _GRAPH_ARRAYS:
+                setattr(self, name, npz[name])
+        self.numbers = dict((code, number) for number, code in enumerate(self.airports.tolist()))
+
+    def __len__(self):
+        return len(self.airports)
+
+    def number(self, code):
+        """ the airport number of a code
+
+            Raises
+            ------
+                KeyError
+                    If the airport has no flights in the graph
+        """
+        return self.numbers[code]
+
+    def weights(self, weight):
+        return {'seats': self.seats, 'frequency': self.frequency, 'distance': self.distance}[weight]
+
+    def neighbours(self, code, weight='seats'):
+        """ the destinations of the edges leaving an airport
+
+            Returns
+            -------
+                dict
+                    The weight of the edge by destination code
+        """
+        number = self.number(code)
+        start, end = self.indptr[number], self.indptr[number + 1]
+        return dict(zip(self.airports[self.indices[start:end]].tolist(),
+            self.weights(weight)[start:end].tolist()))
+
+    def edge(self, origin, destination, weight='seats'):
+        """ the weight of an edge, None when there is no such edge """
+        number = self.number(origin)
+        start, end = self.indptr[number], self.indptr[number + 1]
+        # the destinations of a row are sorted
+        position = start + np.searchsorted(self.indices[start:end], self.number(destination))
+        if position == end or self.indices[position] != self.number(destination):
+            return None
+        return self.weights(weight)[position].item()
+
+    def origins(self):
+        """ the origin number of every edge, to build a COO view """
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.indptr))
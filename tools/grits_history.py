@@ -0,0 +1,304 @@
+import logging
+import collections
+
+import pymongo
+
+from conf import settings
+from tools.grits_dedup import compact_key
+from tools.grits_profiler import profiler
+
+class InvalidDeliverable(Exception):
+    """ custom exception that is thrown when a deliverable is imported with
+    history out of date order """
+    def __init__(self, message, *args, **kwargs):
+        """ InvalidDeliverable constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(InvalidDeliverable, self).__init__(message)
+
+def ensure_history_indexes(db):
+    """ create the indexes the history is read through """
+    db[settings._HISTORY_COLLECTION_NAME].create_index([
+            ('deliverable', pymongo.ASCENDING),
+            ('_id', pymongo.ASCENDING)
+        ], name='idxFlightHistory_Deliverable')
+    db[settings._HISTORY_BASE_COLLECTION_NAME].create_index([
+            ('deliverable', pymongo.ASCENDING)
+        ], name='idxFlightHistoryBases_Deliverable')
+
+def deliverables(db):
+    """ the deliverables recorded in the history, oldest first
+
+        Parameters
+        ----------
+            db : object
+                The pymongo Database
+
+        Returns
+        -------
+            list
+                The deliverable documents
+    """
+    return list(db[settings._HISTORY_DELIVERABLE_COLLECTION_NAME].find().sort('_id', pymongo.ASCENDING))
+
+def latest_base(db, as_of):
+    """ the date of the newest base at or before as_of, None if there is none """
+    base = db[settings._HISTORY_DELIVERABLE_COLLECTION_NAME].find_one(
+        {'_id': {'$lte': as_of}, 'base': True}, sort=[('_id', pymongo.DESCENDING)])
+    if base is None:
+        return None
+    return base['_id']
+
+def changes(db, after, as_of):
+    """ the change log entries of the deliverables after 'after' up to and
+    including as_of, in the order they were recorded """
+    return db[settings._HISTORY_COLLECTION_NAME].find(
+        {'deliverable': {'$gt': after, '$lte': as_of}}).sort([
+            ('deliverable', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+
+def snapshot(db, as_of):
+    """ rebuild the flights as they stood at a deliverable
+
+        The newest base at or before as_of is read once and the changes
+        recorded since are applied to it.  Only the changes are held in
+        memory, the base is streamed.
+
+        Parameters
+        ----------
+            db : object
+                The pymongo Database
+            as_of : datetime
+                The deliverable date
+
+        Returns
+        -------
+            generator
+                The flight documents, each with its _id
+    """
+    base_date = latest_base(db, as_of)
+    if base_date is None:
+        return
+
+    # the net change of every flight since the base: a whole document, a set
+    # of fields to apply to the base document or None for a removal
+    net = {}
+    for change in changes(db, base_date, as_of):
+        key = change['flightId']
+        if change['op'] == 'insert':
+            net[key] = ('doc', change['doc'])
+        elif change['op'] == 'remove':
+            net[key] = None
+        else:
+            current = net.get(key)
+            if current is None and key in net:
+                continue
+            if current is None:
+                net[key] = ('set', dict(change['set']))
+            else:
+                current[1].update(change['set'])
+
+    bases = db[settings._HISTORY_BASE_COLLECTION_NAME]
+    for base in bases.find({'deliverable': base_date}):
+        key = base['flightId']
+        doc = base['doc']
+        if key in net:
+            change = net.pop(key)
+            if change is None:
+                continue
+            if change[0] == 'doc':
+                doc = change[1]
+            else:
+                doc.update(change[1])
+        doc['_id'] = key
+        yield doc
+
+    # flights inserted since the base
+    for key, change in net.iteritems():
+        if change is not None and change[0] == 'doc':
+            doc = change[1]
+            doc['_id'] = key
+            yield doc
+
+class GritsHistory(object):
+    """ records the changes a deliverable makes to the flights
+
+        Before each batch of flights is upserted it is compared with the
+        stored documents.  New flights are logged as inserts with the whole
+        document, changed flights as updates with only the changed fields and
+        flights of the previous deliverable that the new one does not contain
+        as removals.  Every settings._HISTORY_BASE_INTERVAL deliverables, and
+        for the first, a full copy of the flights is stored as a base instead,
+        so that snapshot never has to apply more than an interval of changes.
+    """
+
+    def __init__(self, db, deliverable, collection_name=None):
+        """ GritsHistory constructor
+
+            Parameters
+            ----------
+                db : object
+                    The pymongo Database
+                deliverable : datetime
+                    The date of the deliverable being imported
+                collection_name : str
+                    The flights collection, defaults to
+                    settings._FLIGHT_COLLECTION_NAME
+
+            Raises
+            ------
+                InvalidDeliverable
+                    If the deliverable, or a newer one, has already been
+                    recorded
+        """
+        self.db = db
+        self.deliverable = deliverable
+        self.collection_name = collection_name or settings._FLIGHT_COLLECTION_NAME
+        self.history = db[settings._HISTORY_COLLECTION_NAME]
+        self.bases = db[settings._HISTORY_BASE_COLLECTION_NAME]
+        self.deliverables = db[settings._HISTORY_DELIVERABLE_COLLECTION_NAME]
+        self.counts = collections.OrderedDict([('insert', 0), ('update', 0),
+            ('remove', 0), ('unchanged', 0)])
+        self.seen = set()
+
+        # the flights already hold the records of a deliverable that was
+        # imported, so its changes could not be recorded again
+        recorded = self.deliverables.find_one({'_id': {'$gte': deliverable}})
+        if recorded is not None:
+            raise InvalidDeliverable('the history already contains the deliverable %s' % recorded['_id'])
+        ensure_history_indexes(db)
+
+        recorded = [d['_id'] for d in self.deliverables.find({}, {'_id': 1})]
+        base_date = latest_base(db, deliverable)
+        since_base = len([date for date in recorded if base_date is None or date >= base_date])
+        self.is_base = base_date is None or since_base >= settings._HISTORY_BASE_INTERVAL
+        self.live = None
+        if not self.is_base:
+            self.live = self.load_live(base_date)
+
+    def load_live(self, base_date):
+        """ the keys of the flights of the previous deliverable
+
+            Parameters
+            ----------
+                base_date : datetime
+                    The date of the newest base
+
+            Returns
+            -------
+                set
+                    The compact keys of the flights
+        """
+        with profiler.timer('history'):
+            live = set(compact_key(base['flightId']) for base in
+                self.bases.find({'deliverable': base_date}, {'flightId': 1}))
+            for change in changes(self.db, base_date, self.deliverable):
+                if change['op'] == 'insert':
+                    live.add(compact_key(change['flightId']))
+                elif change['op'] == 'remove':
+                    live.discard(compact_key(change['flightId']))
+        return live
+
+    def record(self, records):
+        """ log the changes a batch of valid records is about to make
+
+            Parameters
+            ----------
+                records : list
+                    The records about to be upserted, with unique keys
+        """
+        if len(records) == 0:
+            return
+        with profiler.timer('history'):
+            keys = [record.id for record in records]
+            for key in keys:
+                self.seen.add(compact_key(key))
+            if self.is_base:
+                return
+
+            stored = dict((doc['_id'], doc) for doc in
+                self.db[self.collection_name].find({'_id': {'$in': keys}}))
+            entries = []
+            for record in records:
+                fields = record.fields
+                doc = stored.get(record.id)
+                if doc is None or compact_key(record.id) not in self.live:
+                    # the upsert keeps fields of a document that is reused
+                    if doc is not None:
+                        del doc['_id']
+                        doc.update(fields)
+                        fields = doc
+                    entries.append({'deliverable': self.deliverable,
+                        'flightId': record.id, 'op': 'insert', 'doc': dict(fields)})
+                    self.counts['insert'] += 1
+                    # a repeat of the key in a later chunk is an update
+                    self.live.add(compact_key(record.id))
+                    continue
+                changed = dict((name, value) for name, value in fields.iteritems()
+                    if doc.get(name) != value)
+                if len(changed) == 0:
+                    self.counts['unchanged'] += 1
+                    continue
+                entries.append({'deliverable': self.deliverable,
+                    'flightId': record.id, 'op': 'update', 'set': changed})
+                self.counts['update'] += 1
+            if len(entries) > 0:
+                self.history.insert_many(entries)
+
+    def finish(self):
+        """ log the removals, or store the base, once every record of the
+        deliverable has been written
+
+            Returns
+            -------
+                collections.OrderedDict
+                    The number of inserts, updates, removals and unchanged
+                    flights, and whether a base was stored
+        """
+        with profiler.timer('history'):
+            if self.is_base:
+                self.store_base()
+            else:
+                self.log_removals()
+
+            summary = collections.OrderedDict()
+            summary['_id'] = self.deliverable
+            summary['base'] = self.is_base
+            summary['flights'] = len(self.seen)
+            summary.update(self.counts)
+            self.deliverables.insert_one(summary)
+        logging.info('history of %s: %s', self.deliverable,
+            ', '.join('%s %r' % (name, value) for name, value in summary.items()[1:]))
+        return summary
+
+    def store_base(self):
+        """ copy the flights of the deliverable into the bases """
+        entries = []
+        for doc in self.db[self.collection_name].find():
+            if compact_key(doc['_id']) not in self.seen:
+                continue
+            key = doc.pop('_id')
+            entries.append({'deliverable': self.deliverable, 'flightId': key, 'doc': doc})
+            if len(entries) >= settings._CHUNK_SIZE:
+                self.bases.insert_many(entries)
+                entries = []
+        if len(entries) > 0:
+            self.bases.insert_many(entries)
+
+    def log_removals(self):
+        """ log the flights of the previous deliverable that are not in this
+        one """
+        removed = self.live - self.seen
+        if len(removed) == 0:
+            return
+        entries = []
+        for doc in self.db[self.collection_name].find({}, {'_id': 1}):
+            if compact_key(doc['_id']) in removed:
+                entries.append({'deliverable': self.deliverable,
+                    'flightId': doc['_id'], 'op': 'remove'})
+        self.counts['remove'] = len(entries)
+        if len(entries) > 0:
+            self.history.insert_many(entries)
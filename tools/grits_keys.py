@@ -0,0 +1,140 @@
+import struct
+import binascii
+
+from bson.binary import Binary
+from bson.int64 import Int64
+
+from conf import settings
+
+# the formats a flight _id may be stored in
+_KEY_FORMATS = ['hex', 'binary', 'int64']
+
+class InvalidKeyFormat(Exception):
+    """ custom exception that is thrown when a key cannot be stored in or
+    converted to a key format """
+    def __init__(self, message, *args, **kwargs):
+        """ InvalidKeyFormat constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(InvalidKeyFormat, self).__init__(message)
+
+def encode_digest(digest, key_format=None):
+    """ the md5 digest of a flight in the format it is stored as _id
+
+        'hex' is the 32 character hexdigest, 'binary' the 16 byte digest as
+        BSON BinData and 'int64' the first 8 bytes of the digest as a signed
+        big-endian 64-bit integer.  An int64 key cannot be converted back to
+        the full digest, and two flights collide with a probability of about
+        n^2 / 2^65 for n flights.
+
+        Parameters
+        ----------
+            digest : str
+                The 16 byte md5 digest
+            key_format : str
+                One of _KEY_FORMATS, defaults to settings._FLIGHT_KEY_FORMAT
+
+        Returns
+        -------
+            object
+                A str, bson.binary.Binary or bson.int64.Int64
+    """
+    key_format = key_format or settings._FLIGHT_KEY_FORMAT
+    if key_format == 'hex':
+        return binascii.hexlify(digest)
+    if key_format == 'binary':
+        return Binary(digest)
+    if key_format == 'int64':
+        return Int64(struct.unpack('>q', digest[:8])[0])
+    raise InvalidKeyFormat('unknown key format %r, expected one of %r' % (key_format, _KEY_FORMATS))
+
+def key_format_of(key):
+    """ the format a key is stored in
+
+        Parameters
+        ----------
+            key : object
+                A flight _id
+
+        Returns
+        -------
+            str
+                One of _KEY_FORMATS, or None when the key is none of them
+    """
+    if isinstance(key, Binary):
+        return 'binary'
+    if isinstance(key, (int, long)):
+        return 'int64'
+    if isinstance(key, basestring) and len(key) == 32:
+        return 'hex'
+    return None
+
+def key_digest(key):
+    """ the 16 byte md5 digest of a hex or binary key
+
+        Parameters
+        ----------
+            key : object
+                A flight _id in the 'hex' or 'binary' format
+
+        Returns
+        -------
+            str
+                The digest
+
+        Raises
+        ------
+            InvalidKeyFormat
+                If the key is an int64, which does not hold the full digest
+    """
+    key_format = key_format_of(key)
+    if key_format == 'binary':
+        return str(key)
+    if key_format == 'hex':
+        return binascii.unhexlify(key)
+    raise InvalidKeyFormat('%r does not hold a full md5 digest' % (key,))
+
+def convert_key(key, key_format=None):
+    """ convert a flight _id to another format
+
+        Parameters
+        ----------
+            key : object
+                A flight _id in any of _KEY_FORMATS
+            key_format : str
+                The format to convert to, defaults to
+                settings._FLIGHT_KEY_FORMAT
+
+        Returns
+        -------
+            object
+                The key in key_format
+    """
+    key_format = key_format or settings._FLIGHT_KEY_FORMAT
+    if key_format_of(key) == key_format:
+        return key
+    return encode_digest(key_digest(key), key_format)
+
+def to_hex(key):
+    """ the hex form of a flight _id, for consumers of the original format
+
+        The hex form of an int64 key has only 16 characters, the prefix of
+        the original hexdigest.
+
+        Parameters
+        ----------
+            key : object
+                A flight _id in any of _KEY_FORMATS
+
+        Returns
+        -------
+            str
+                The lower case hex form of the key
+    """
+    if key_format_of(key) == 'int64':
+        return binascii.hexlify(struct.pack('>q', key))
+    return binascii.hexlify(key_digest(key))
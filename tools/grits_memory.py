@@ -0,0 +1,116 @@
+import os
+import sys
+import logging
+import resource
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def peak_rss():
+    """ the peak resident set size of the process in bytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+def current_rss():
+    """ the current resident set size of the process in bytes
+
+        Read from /proc on linux.  Elsewhere the peak is the best value
+        available, which makes the budget more conservative.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return peak_rss()
+
+class MemoryBudget(object):
+    """ sizes chunks so that the resident set size stays below a limit
+
+        The RSS is sampled when a chunk starts and again while all of its
+        records are alive, just before they are written.  The difference is
+        the memory held per row, which is used to pick the largest chunk that
+        fits under the limit with some headroom.  Because freed memory is kept
+        by the python allocator the per-row estimate only ever decays slowly,
+        and the chunk size is halved whenever a sample exceeds the limit.
+    """
+
+    # fraction of the limit that chunks are sized to use
+    HEADROOM = 0.85
+    # maximum factor the chunk size may grow by between chunks
+    MAX_GROWTH = 2.0
+
+    def __init__(self, limit_bytes, chunk_size, min_chunk_size, max_chunk_size):
+        """ MemoryBudget constructor
+
+            Parameters
+            ----------
+                limit_bytes : int
+                    The target peak RSS in bytes
+                chunk_size : int
+                    The size of the first chunk
+                min_chunk_size : int
+                    The smallest chunk size that will be used
+                max_chunk_size : int
+                    The largest chunk size that will be used
+        """
+        self.limit_bytes = limit_bytes
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.chunk_size = max(min(chunk_size, max_chunk_size), min_chunk_size)
+        self.bytes_per_row = None
+        self.peak_sample = current_rss()
+        self._chunk_start_rss = None
+        self._chunk_peak_rss = None
+
+    def next_chunk_size(self):
+        """ the number of rows of the next chunk """
+        return self.chunk_size
+
+    def start_chunk(self):
+        """ sample the RSS at the start of a chunk """
+        self._chunk_start_rss = current_rss()
+        self._chunk_peak_rss = self._chunk_start_rss
+
+    def sample(self):
+        """ sample the RSS while the records of the chunk are alive """
+        rss = current_rss()
+        if rss > self._chunk_peak_rss:
+            self._chunk_peak_rss = rss
+        if rss > self.peak_sample:
+            self.peak_sample = rss
+        return rss
+
+    def end_chunk(self, rows):
+        """ update the per-row estimate and choose the next chunk size
+
+            Parameters
+            ----------
+                rows : int
+                    The number of rows in the chunk that ended
+        """
+        self.sample()
+        if rows > 0:
+            per_row = float(self._chunk_peak_rss - self._chunk_start_rss) / rows
+            if self.bytes_per_row is None:
+                self.bytes_per_row = max(per_row, 1.0)
+            else:
+                # decay slowly as reused memory under-reports the cost
+                self.bytes_per_row = max(per_row, 0.9 * self.bytes_per_row, 1.0)
+
+        if self._chunk_peak_rss > self.limit_bytes:
+            size = self.chunk_size / 2
+        elif self.bytes_per_row is None:
+            size = self.chunk_size
+        else:
+            available = self.HEADROOM * self.limit_bytes - self._chunk_start_rss
+            size = int(available / self.bytes_per_row)
+            size = min(size, int(self.chunk_size * self.MAX_GROWTH))
+
+        size = max(min(size, self.max_chunk_size), self.min_chunk_size)
+        if size != self.chunk_size:
+            logging.debug('memory budget: chunk size %d -> %d (rss %d, %.0f bytes/row)',
+                self.chunk_size, size, self._chunk_peak_rss, self.bytes_per_row or 0)
+        self.chunk_size = size
+        return size
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import collections
+import BaseHTTPServer
+
+from tools.grits_memory import current_rss, peak_rss
+
+# upper bounds (seconds) of the latency histograms, cumulative as required by
+# the prometheus text format
+_HISTOGRAM_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0, 30.0, 60.0]
+
+class Histogram(object):
+    """ prometheus style histogram with cumulative buckets """
+
+    def __init__(self):
+        """ Histogram constructor """
+        self.counts = [0] * len(_HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """ add a single observation
+
+            Parameters
+            ----------
+                value : float
+                    The observed value, in seconds
+        """
+        self.count += 1
+        self.sum += value
+        for position, bound in enumerate(_HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.counts[position] += 1
+
+class GritsMetrics(object):
+    """ metrics of an import run
+
+        A single instance, 'metrics', is updated by the file reader and the
+        mongo connection.  The metrics can be published while the run is in
+        progress as a prometheus text-format file (for the node_exporter
+        textfile collector) or over HTTP, and summarized as JSON at the end.
+    """
+
+    def __init__(self):
+        """ GritsMetrics constructor """
+        self.textfile_path = None
+        self.airport_cache = None
+        self.start_time = time.time()
+        self.last_progress_time = self.start_time
+        self.counters = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+        self.values = collections.OrderedDict()
+        self._server = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """ discard all metrics and restart the clock """
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.values.clear()
+        self.start_time = time.time()
+        self.last_progress_time = self.start_time
+
+    def inc(self, name, value=1, **labels):
+        """ increment a counter
+
+            Parameters
+            ----------
+                name : str
+                    The metric name
+                value : int
+                    The amount to add
+                labels : dict
+                    Optional labels of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ add an observation to a histogram
+
+            Parameters
+            ----------
+                name : str
+                    The metric name
+                value : float
+                    The observed value, in seconds
+                labels : dict
+                    Optional labels of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def set(self, name, value):
+        """ set a gauge
+
+            Parameters
+            ----------
+                name : str
+                    The metric name
+                value : float
+                    The current value
+        """
+        self.values[name] = value
+
+    def progress(self):
+        """ mark that the import has made progress, used to detect stalls """
+        self.last_progress_time = time.time()
+
+    def counter_value(self, name, **labels):
+        """ current value of a counter, 0 when it has not been incremented """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def gauges(self):
+        """ derived point-in-time values
+
+            Returns
+            -------
+                collections.OrderedDict
+                    Gauge name to value
+        """
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        rows = self.counter_value('grits_rows_read_total')
+        gauges = collections.OrderedDict()
+        gauges['grits_elapsed_seconds'] = elapsed
+        gauges['grits_rows_per_second'] = rows / elapsed
+        gauges['grits_last_progress_timestamp_seconds'] = self.last_progress_time
+        gauges['grits_rss_bytes'] = current_rss()
+        gauges['grits_peak_rss_bytes'] = peak_rss()
+        gauges.update(self.values)
+        if self.airport_cache is not None:
+            gauges['grits_airport_cache_hits'] = self.airport_cache.hits
+            gauges['grits_airport_cache_misses'] = self.airport_cache.misses
+            gauges['grits_airport_cache_hit_ratio'] = self.airport_cache.hit_ratio()
+        return gauges
+
+    @staticmethod
+    def format_labels(labels, extra=None):
+        pairs = list(labels)
+        if extra is not None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, v) for k, v in pairs)
+
+    def render(self):
+        """ format the metrics in the prometheus text exposition format
+
+            Returns
+            -------
+                str
+                    The metrics, one sample per line
+        """
+        lines = []
+        with self._lock:
+            counters = list(self.counters.items())
+            histograms = [(key, (list(h.counts), h.count, h.sum)) for key, h in self.histograms.items()]
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append('# TYPE %s counter' % name)
+                seen.add(name)
+            lines.append('%s%s %d' % (name, GritsMetrics.format_labels(labels), value))
+        for (name, labels), (counts, count, total) in histograms:
+            if name not in seen:
+                lines.append('# TYPE %s histogram' % name)
+                seen.add(name)
+            for bound, num in zip(_HISTOGRAM_BUCKETS, counts):
+                lines.append('%s_bucket%s %d' % (name,
+                    GritsMetrics.format_labels(labels, ('le', repr(bound))), num))
+            lines.append('%s_bucket%s %d' % (name, GritsMetrics.format_labels(labels, ('le', '+Inf')), count))
+            lines.append('%s_sum%s %f' % (name, GritsMetrics.format_labels(labels), total))
+            lines.append('%s_count%s %d' % (name, GritsMetrics.format_labels(labels), count))
+        for name, value in self.gauges().items():
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %f' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    def publish(self):
+        """ write the textfile, if one was configured
+
+            The file is written to a temporary name and renamed so that a
+            collector never reads a partial file.
+        """
+        if self.textfile_path is None:
+            return
+        tmp_path = '%s.%d.tmp' % (self.textfile_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp_path, self.textfile_path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """ serve the metrics over HTTP from a daemon thread
+
+            Parameters
+            ----------
+                port : int
+                    The port to listen on, 0 for any free port
+                host : str
+                    The interface to bind
+
+            Returns
+            -------
+                int
+                    The port that is being listened on
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        """ stop the HTTP server, if running """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def summary(self):
+        """ the metrics as a JSON serializable dict """
+        summary = collections.OrderedDict()
+        summary['host'] = socket.gethostname()
+        summary['startTime'] = self.start_time
+        summary['counters'] = collections.OrderedDict()
+        for (name, labels), value in self.counters.items():
+            summary['counters'][name + GritsMetrics.format_labels(labels)] = value
+        summary['histograms'] = collections.OrderedDict()
+        for (name, labels), histogram in self.histograms.items():
+            summary['histograms'][name + GritsMetrics.format_labels(labels)] = {
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': dict(zip(map(repr, _HISTOGRAM_BUCKETS), histogram.counts))}
+        summary.update(self.gauges())
+        return summary
+
+    def write_summary(self, path):
+        """ write the JSON summary to path """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+# the process-wide metrics
+metrics = GritsMetrics()
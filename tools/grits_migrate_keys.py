@@ -0,0 +1,142 @@
+import time
+import logging
+import argparse
+
+import pymongo
+
+from conf import settings
+from tools.grits_keys import _KEY_FORMATS, convert_key
+from tools.grits_mongo import GritsMongoConnection, registry
+
+def migrate_keys(db, key_format, batch_size=1000, collection_name=None):
+    """ rewrite the _id of every flight in key_format
+
+        The collection is streamed into a new collection in bulk inserts of
+        batch_size, which then replaces the original.  A document's _id
+        cannot be changed in place, and copying keeps the original intact
+        until every flight has been converted.  The secondary indexes are not
+        copied, run grits_ensure_index.py afterwards.
+
+        Parameters
+        ----------
+            db : object
+                The pymongo Database
+            key_format : str
+                One of grits_keys._KEY_FORMATS
+            batch_size : int
+                The number of documents per bulk insert
+            collection_name : str
+                The collection to migrate, defaults to
+                settings._FLIGHT_COLLECTION_NAME
+
+        Returns
+        -------
+            dict
+                The number of flights copied and of keys that collided
+    """
+    collection_name = collection_name or settings._FLIGHT_COLLECTION_NAME
+    source = db[collection_name]
+    target_name = '%s_%s' % (collection_name, key_format)
+    db[target_name].drop()
+    target = db[target_name]
+
+    copied = 0
+    collisions = 0
+    start = time.time()
+
+    def flush(documents):
+        inserted = len(documents)
+        try:
+            target.insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # int64 keys of two flights can collide, the first is kept
+            errors = [error for error in e.details['writeErrors'] if error['code'] == 11000]
+            if len(errors) != len(e.details['writeErrors']):
+                raise
+            inserted -= len(errors)
+            for error in errors:
+                logging.error('key collision: %r', error['op']['_id'])
+        return inserted
+
+    documents = []
+    for document in source.find(batch_size=batch_size):
+        document['_id'] = convert_key(document['_id'], key_format)
+        documents.append(document)
+        if len(documents) >= batch_size:
+            inserted = flush(documents)
+            copied += inserted
+            collisions += len(documents) - inserted
+            documents = []
+            logging.debug('migrated %d flights (%.0f/sec)', copied, copied / max(time.time() - start, 1e-9))
+    if len(documents) > 0:
+        inserted = flush(documents)
+        copied += inserted
+        collisions += len(documents) - inserted
+
+    target.rename(collection_name, dropTarget=True)
+    logging.info('migrated %d flights to %s keys in %.1fs, %d collisions',
+        copied, key_format, time.time() - start, collisions)
+    return {'copied': copied, 'collisions': collisions}
+
+class GritsMigrateKeys(object):
+    """ Command line tool to convert the flight _ids to another key format """
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(description='script to convert ' \
+            'the _id of every flight to another key format.')
+
+    def add_args(self):
+        """ add arguments to the argparse command-line program """
+        self.parser.add_argument('-u', '--username',
+            default=settings._MONGO_USERNAME,
+            help='the username for mongoDB (Default: None)')
+
+        self.parser.add_argument('-p', '--password',
+            default=settings._MONGO_PASSWORD,
+            help='the password for mongoDB (Default: None)')
+
+        self.parser.add_argument('-d', '--database',
+            default=settings._MONGO_DATABASE,
+            help='the database for mongoDB (Default: grits)')
+
+        self.parser.add_argument('-m', '--mongohost',
+            default=settings._MONGO_HOST,
+            help='the hostname for mongoDB (Default: localhost)')
+
+        self.parser.add_argument('--mongo-profile',
+            choices=sorted(settings._MONGO_PROFILES.keys()),
+            default=settings._MONGO_PROFILE,
+            help='the write concern, pool size and compression of the ' \
+                'mongoDB client (Default: %s)' % settings._MONGO_PROFILE)
+
+        self.parser.add_argument('-k', '--key-format',
+            choices=_KEY_FORMATS,
+            default=settings._FLIGHT_KEY_FORMAT,
+            help='the key format to convert to, set _FLIGHT_KEY_FORMAT to ' \
+                'the same value for later imports (Default: %s)' % settings._FLIGHT_KEY_FORMAT)
+
+        self.parser.add_argument('-b', '--batch-size',
+            type=int,
+            default=1000,
+            help='the number of flights per bulk insert (Default: 1000)')
+
+    def run(self, *args):
+        """ kickoff the program """
+        self.add_args()
+
+        if len(args) > 0:
+            program_args = self.parser.parse_args(args)
+        else:
+            program_args = self.parser.parse_args()
+
+        mongo_connection = GritsMongoConnection(program_args, read_only=True)
+        try:
+            result = migrate_keys(mongo_connection.db, program_args.key_format,
+                program_args.batch_size)
+        finally:
+            registry.close()
+        if settings._FLIGHT_KEY_FORMAT != program_args.key_format:
+            logging.warn('set _FLIGHT_KEY_FORMAT = %r in conf/settings.py before the next import',
+                program_args.key_format)
+        logging.info('run grits_ensure_index.py to rebuild the indexes')
+        return result
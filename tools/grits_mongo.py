@@ -1,7 +1,220 @@
+import time
 import pymongo
 import logging
+import threading
 
 from conf import settings
+from tools.grits_chunk_writer import GritsChunkWriter
+from tools.grits_metrics import metrics
+from tools.grits_profiler import profiler
+
+class AirportCache(object):
+    """ in-memory cache of airport documents keyed by airport code
+
+        A flight file references a few thousand distinct airports from
+        millions of rows, so each airport is read from mongoDB only once.
+        Codes that do not exist are cached as None.
+    """
+
+    def __init__(self, db=None):
+        """ AirportCache constructor
+
+            Parameters
+            ----------
+                db : object
+                    The pymongo Database containing the airports collection,
+                    or None for a cache that is filled through load
+        """
+        self._collection = None
+        if db is not None:
+            self._collection = db[settings._AIRPORT_COLLECTION_NAME]
+        self._airports = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, code):
+        """ get the airport document for code
+
+            Parameters
+            ----------
+                code : str
+                    The airport code, which is the _id of the document
+
+            Returns
+            -------
+                dict
+                    The airport document or None
+        """
+        if code in self._airports:
+            with self._lock:
+                self.hits += 1
+            return self._airports[code]
+        airport = None
+        if self._collection is not None:
+            airport = self._collection.find_one({'_id': code})
+        with self._lock:
+            self.misses += 1
+            self._airports[code] = airport
+        return airport
+
+    def load(self, airports):
+        """ fill the cache with a snapshot of airport documents
+
+            After loading, codes that are not in the snapshot are known not to
+            exist and are no longer looked up in mongoDB.
+
+            Parameters
+            ----------
+                airports : iterable
+                    Airport documents, each with its code as '_id'
+        """
+        with self._lock:
+            for airport in airports:
+                self._airports[airport['_id']] = airport
+        self._collection = None
+
+    def missing(self, codes):
+        """ the codes that have not been looked up yet
+
+            Parameters
+            ----------
+                codes : iterable
+                    Airport codes
+
+            Returns
+            -------
+                set
+                    The codes that are not in the cache
+        """
+        return set(code for code in codes if code not in self._airports)
+
+    def prefetched(self, codes, airports):
+        """ fill the cache with the result of looking up several codes at once
+
+            Unlike load, codes outside of the lookup are still read from
+            mongoDB.
+
+            Parameters
+            ----------
+                codes : iterable
+                    The codes that were looked up, those without a document
+                    are cached as None
+                airports : iterable
+                    The airport documents found, each with its code as '_id'
+        """
+        with self._lock:
+            for code in codes:
+                if code not in self._airports:
+                    self.misses += 1
+                    self._airports[code] = None
+            for airport in airports:
+                self._airports[airport['_id']] = airport
+
+    def __len__(self):
+        return len(self._airports)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+class InvalidMongoProfile(Exception):
+    """ custom exception that is thrown when a connection profile is not in
+    settings._MONGO_PROFILES """
+    def __init__(self, message, *args, **kwargs):
+        """ InvalidMongoProfile constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(InvalidMongoProfile, self).__init__(message)
+
+class ConnectionRegistry(object):
+    """ the mongoDB clients of the process
+
+        A MongoClient holds a pool of connections and is meant to be shared,
+        so every tool, reader and worker of a run gets its client from the
+        registry.  Clients are keyed by the uri of the target and the
+        connection profile, the options of which are fixed when the client
+        is created.
+    """
+
+    def __init__(self):
+        """ ConnectionRegistry constructor """
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def options(profile):
+        """ the MongoClient options of a profile
+
+            Parameters
+            ----------
+                profile : str
+                    A key of settings._MONGO_PROFILES
+
+            Returns
+            -------
+                dict
+                    The keyword arguments of the MongoClient
+
+            Raises
+            ------
+                InvalidMongoProfile
+                    If the profile does not exist
+        """
+        if profile not in settings._MONGO_PROFILES:
+            raise InvalidMongoProfile('unknown mongoDB profile %r, expected one of %r' % (
+                profile, sorted(settings._MONGO_PROFILES.keys())))
+        options = dict(settings._MONGO_PROFILES[profile])
+        options.pop('fsync', None)
+        return options
+
+    def client(self, uri, profile=None):
+        """ the shared client of a target and profile
+
+            Parameters
+            ----------
+                uri : str
+                    The mongoDB uri
+                profile : str
+                    A key of settings._MONGO_PROFILES, defaults to
+                    settings._MONGO_PROFILE
+
+            Returns
+            -------
+                pymongo.MongoClient
+                    The client, created on first use
+        """
+        profile = profile or settings._MONGO_PROFILE
+        with self._lock:
+            client = self._clients.get((uri, profile))
+            if client is None:
+                client = pymongo.MongoClient(uri, **self.options(profile))
+                self._clients[(uri, profile)] = client
+        return client
+
+    def close(self):
+        """ close every client, after an fsync of those whose profile asks
+        for one """
+        with self._lock:
+            clients = self._clients
+            self._clients = {}
+        for (uri, profile), client in clients.items():
+            if settings._MONGO_PROFILES.get(profile, {}).get('fsync'):
+                start = time.time()
+                try:
+                    client.admin.command('fsync')
+                    logging.info('fsync of the %s writes took %.1fs', profile, time.time() - start)
+                except pymongo.errors.PyMongoError as e:
+                    logging.warn('fsync of the %s writes failed: %s', profile, e)
+            client.close()
+
+registry = ConnectionRegistry()
 
 class GritsMongoConnection(object):
     """ class that contains the connection details to mongo
@@ -14,37 +227,49 @@ class GritsMongoConnection(object):
         """ pymongo Database object """
         return self._db
 
-    def __init__(self, program_arguments, *args, **kwargs):
+    @property
+    def profile(self):
+        """ the connection profile of the client """
+        return self._profile
+
+    def __init__(self, program_arguments, read_only=False, *args, **kwargs):
         """ GritsMongoConnection constructor
             Parameters
             ----------
                 program_arguments : dict
                     A dictionary of arguments collected by the argparse
                     command-line program
+                read_only : bool
+                    Do not drop the indexes, for connections that only read
         """
         #self._program_arguments = program_arguments
         self._hostname = program_arguments.mongohost
         self._username = program_arguments.username
         self._password = program_arguments.password
         self._database = program_arguments.database
+        self._profile = getattr(program_arguments, 'mongo_profile', None) or settings._MONGO_PROFILE
         self._client = None
         self._db = self.connect()
-        if settings._DROP_INDEXES:
+        self.writer = GritsChunkWriter(self._db)
+        if settings._DROP_INDEXES and not read_only:
             self.drop_indexes()
 
+    def uri(self):
+        """ the uri of the mongoDB, from the supplied command-line arguments
+        or default values """
+        if self._username != None or self._password != None:
+            return 'mongodb://%s:%s@%s/%s?authMechanism=MONGODB-CR' % \
+                (self._username, self._password, self._hostname, self._database)
+        return 'mongodb://%s/%s' % \
+            (self._hostname, self._database)
+
     def connect(self):
         """ connect to mongoDB
 
             The method creates the uri to connect to the mongoDB using
             the supplied command-line arguments or default values.
         """
-        if self._username != None or self._password != None:
-            uri = 'mongodb://%s:%s@%s/%s?authMechanism=MONGODB-CR' % \
-                (self._username, self._password, self._hostname, self._database)
-        else:
-            uri = 'mongodb://%s/%s' % \
-                (self._hostname, self._database)
-        self._client = pymongo.MongoClient(uri)
+        self._client = registry.client(self.uri(), self._profile)
         return pymongo.database.Database(self._client, self._database)
 
     def drop_indexes(self):
@@ -99,6 +324,37 @@ class GritsMongoConnection(object):
                 ("totalSeats", pymongo.ASCENDING),
                 ("weeklyFrequency", pymongo.ASCENDING)
             ], name="idxFlights_DepartureAirportDatesStopsTotalSeatsWeeklyFrequency")
+        # Great-circle distance ranges, see grits_distances.distance_query
+        flights.create_index([
+                ("greatCircleDistance", pymongo.ASCENDING)
+            ], name="idxFlights_GreatCircleDistance")
+        flights.create_index([
+                ("routeDistance", pymongo.ASCENDING)
+            ], name="idxFlights_RouteDistance")
+        flights.create_index([
+                ("legDistances", pymongo.ASCENDING)
+            ], name="idxFlights_LegDistances")
+        # Operating days and UTC times of day, see grits_schedule.days_query
+        # and day_window_query.  The fields are integers, so an _id projection
+        # is covered by the index; its days prefix serves days_query alone
+        flights.create_index([
+                ("days", pymongo.ASCENDING),
+                ("departureMinuteOfDayUTC", pymongo.ASCENDING),
+                ("_id", pymongo.ASCENDING)
+            ], name="idxFlights_DaysDepartureMinuteOfDayUTC")
+        flights.create_index([
+                ("days", pymongo.ASCENDING),
+                ("arrivalMinuteOfDayUTC", pymongo.ASCENDING),
+                ("_id", pymongo.ASCENDING)
+            ], name="idxFlights_DaysArrivalMinuteOfDayUTC")
+        # UTC time windows, see grits_schedule.time_window_query.  The fields
+        # are arrays, so the indexes are multikey and cannot cover a query
+        flights.create_index([
+                ("departureMinutesUTC", pymongo.ASCENDING)
+            ], name="idxFlights_DepartureMinutesUTC")
+        flights.create_index([
+                ("arrivalMinutesUTC", pymongo.ASCENDING)
+            ], name="idxFlights_ArrivalMinutesUTC")
         return "Indexes have been applied."
 
     @staticmethod
@@ -136,7 +392,7 @@ class GritsMongoConnection(object):
         return formatted_result
 
 
-    def bulk_upsert(self, collection_name, records):
+    def bulk_upsert(self, collection_name, records, ordered=True):
         """ bulk upsert of documents into mongodb collection
 
             Parameters
@@ -145,21 +401,22 @@ class GritsMongoConnection(object):
                     The name of the mongoDB collection
                 records: list
                     A list of record.fields.
+                ordered: bool
+                    Apply the upserts in order.  Records with unique keys
+                    can be written unordered, which mongoDB applies in
+                    parallel and does not stop at the first error.
         """
         if len(records) == 0:
             return
 
-        collection = pymongo.collection.Collection(self._db, collection_name)
-        bulk = collection.initialize_ordered_bulk_op()
-        for record in records:
-            bulk.find({'_id': record.id}).upsert().update({
-                '$set': record.fields})
-
-        result = None
-        try:
-            result = bulk.execute()
-        except pymongo.errors.BulkWriteError as e:
-            logging.error(e.details)
+        # transient failures are retried and operations that keep failing
+        # are written to the dead letter file
+        start = time.time()
+        result = self.writer.upsert(collection_name, records, ordered)
+        elapsed = time.time() - start
+        profiler.add('bulk_upsert', elapsed)
+        metrics.observe('grits_mongo_write_seconds', elapsed, op='bulk_upsert')
+        metrics.inc('grits_mongo_documents_written_total', len(records), op='bulk_upsert')
 
         return GritsMongoConnection.format_bulk_write_results(result)
 
@@ -177,12 +434,11 @@ class GritsMongoConnection(object):
 
         record_fields = map(lambda x: x.fields, records)
 
-        collection = pymongo.collection.Collection(self._db, collection_name)
+        start = time.time()
+        result = self.writer.insert(collection_name, record_fields)
+        elapsed = time.time() - start
+        profiler.add('insert_many', elapsed)
+        metrics.observe('grits_mongo_write_seconds', elapsed, op='insert_many')
+        metrics.inc('grits_mongo_documents_written_total', len(records), op='insert_many')
 
-        result = None
-        try:
-            result = collection.insert_many(record_fields)
-        except Exception as e:
-            logging.error(e)
-
-        return GritsMongoConnection.format_insert_many_results(result)
+        return GritsMongoConnection.format_bulk_write_results(result)
@@ -0,0 +1,280 @@
+import logging
+import datetime
+
+import numpy as np
+
+from conf import settings
+from tools.grits_arrays import load_arrays, write_arrays
+from tools.grits_stage import FlightRowStage
+
+""" the origin-destination seat capacity of the flights, by month
+
+Analyses that aggregate the flights by departure and arrival airport weight
+the totalSeats of each flight by its weeklyFrequency over a date window.  The
+ODMatrixBuilder is an import stage that keeps the weekly seats and flights of
+every imported flight and, once the import is done, sums them per month,
+origin and destination.  The matrix is stored as a directory of .npy arrays
+which ODMatrix maps into memory, so capacity questions are answered with numpy
+instead of a mongoDB aggregation.
+
+The airports are numbered in code order.  The non-zero cells of each month are
+stored as coordinates sorted by month, origin and destination, with the offset
+of each month, as a dense matrix of every month would hold mostly zeros.
+"""
+
+_OD_MATRIX_ARRAYS = ['airports', 'months', 'offsets', 'origin', 'destination', 'seats', 'flights']
+
+_EPOCH_YEAR = 1970
+
+def month_number(date):
+    """ the months since January 1970, the value of a numpy datetime64[M] """
+    return (date.year - _EPOCH_YEAR) * 12 + date.month - 1
+
+def as_month(value):
+    """ a date, or a 'YYYY-MM' string, as a numpy datetime64[M] """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = '%04d-%02d' % (value.year, value.month)
+    return np.datetime64(value, 'M')
+
+def airport_code(airport):
+    """ the code of an embedded airport document, or None """
+    if not isinstance(airport, dict):
+        return None
+    return airport.get('_id')
+
+class ODMatrixBuilder(FlightRowStage):
+    """ collects the flights written by the readers of a run
+
+        A flight counts its weekly seats (totalSeats times weeklyFrequency)
+        and weekly flights in every month between its effective and
+        discontinued dates, at most settings._OD_MATRIX_MAX_MONTHS of them.
+    """
+
+    columns = [(name, np.int64, False) for name in
+        ('origin', 'destination', 'first', 'last', 'seats', 'flights')]
+
+    def __init__(self, path):
+        """ ODMatrixBuilder constructor
+
+            Parameters
+            ----------
+                path : str
+                    The directory the matrix is written to
+        """
+        super(ODMatrixBuilder, self).__init__()
+        self.path = path
+        self.airports = {}
+        self.skipped = 0
+
+    def airport_number(self, code):
+        number = self.airports.get(code)
+        if number is None:
+            number = self.airports[code] = len(self.airports)
+        return number
+
+    def row(self, record):
+        """ the airports, months and weekly seats and flights of a flight """
+        fields = record.fields
+        origin = airport_code(fields.get('departureAirport'))
+        destination = airport_code(fields.get('arrivalAirport'))
+        effective = fields.get('effectiveDate')
+        discontinued = fields.get('discontinuedDate')
+        if None in (origin, destination, effective, discontinued):
+            self.skipped += 1
+            return None
+        frequency = fields.get('weeklyFrequency') or 0
+        first = month_number(effective)
+        last = min(max(month_number(discontinued), first),
+            first + settings._OD_MATRIX_MAX_MONTHS - 1)
+        return (self.airport_number(origin), self.airport_number(destination),
+            first, last, (fields.get('totalSeats') or 0) * frequency, frequency)
+
+    def arrays(self):
+        """ the arrays of the matrix, see ODMatrix """
+        codes = sorted(self.airports)
+        count = len(codes)
+        # renumber the airports in code order
+        order = np.zeros(count, dtype=np.int64)
+        for number, code in enumerate(codes):
+            order[self.airports[code]] = number
+        origin = order[self.column('origin')]
+        destination = order[self.column('destination')]
+        first = self.column('first')
+        last = self.column('last')
+        start = first.min() if count else 0
+        end = last.max() if count else -1
+
+        # a row per flight and month, the month of the n-th row of a flight
+        # is its first month plus n
+        months = last - first + 1
+        repeat = lambda values: np.repeat(values, months)
+        step = np.arange(months.sum(), dtype=np.int64) - repeat(np.cumsum(months) - months)
+        month = repeat(first - start) + step
+
+        cells, inverse = np.unique((month * count + repeat(origin)) * count + repeat(destination),
+            return_inverse=True)
+        total = lambda name: np.bincount(inverse, weights=repeat(self.column(name)),
+            minlength=len(cells)).astype(np.int64)
+        size = max(count, 1)
+        return {
+            'airports': np.array(codes, dtype='S%d' % max([len(code) for code in codes] + [1])),
+            'months': np.arange(start, end + 1).astype('datetime64[M]'),
+            'offsets': np.searchsorted(cells // (size * size), np.arange(end - start + 2)).astype(np.int64),
+            'origin': (cells // size % size).astype(np.int32),
+            'destination': (cells % size).astype(np.int32),
+            'seats': total('seats'),
+            'flights': total('flights'),
+        }
+
+    def write(self):
+        """ write the matrix to the path
+
+            Returns
+            -------
+                dict
+                    The arrays that were written
+        """
+        with self._lock:
+            try:
+                arrays = self.arrays()
+                flights = len(self)
+            finally:
+                self.close()
+        write_arrays(self.path, arrays, {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'flights': flights
+        })
+        logging.info('od matrix: %d flights, %d airports, %d months, %d cells written to %s (%d skipped)',
+            flights, len(arrays['airports']), len(arrays['months']),
+            len(arrays['seats']), self.path, self.skipped)
+        return arrays
+
+class ODMatrix(object):
+    """ the memory-mapped origin-destination matrix written by
+    ODMatrixBuilder
+
+        The weights are 'seats', the sum of the weekly seats, and 'flights',
+        the sum of the weekly flights of the flights operating during a
+        month.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        """ ODMatrix constructor
+
+            Parameters
+            ----------
+                path : str
+                    The directory of the matrix
+                mmap_mode : str
+                    The mode of np.load, None reads the arrays into memory
+        """
+        arrays, self.meta = load_arrays(path, _OD_MATRIX_ARRAYS, mmap_mode)
+        self.airports = arrays['airports']
+        self.months = arrays['months']
+        self.offsets = arrays['offsets']
+        self.origin = arrays['origin']
+        self.destination = arrays['destination']
+        self.weights = {'seats': arrays['seats'], 'flights': arrays['flights']}
+        self._numbers = None
+
+    def __len__(self):
+        return len(self.airports)
+
+    def number(self, code):
+        """ the row and column of an airport
+
+            Raises
+            ------
+                KeyError
+                    If the airport has no flights in the matrix
+        """
+        if self._numbers is None:
+            self._numbers = dict((code, number) for number, code in enumerate(self.airports.tolist()))
+        return self._numbers[code]
+
+    def bucket(self, month):
+        """ the position of a month, given as a date or a 'YYYY-MM' string,
+        None if the matrix does not cover it """
+        if len(self.months) == 0:
+            return None
+        position = int((as_month(month) - self.months[0]).astype(np.int64))
+        if position < 0 or position >= len(self.months):
+            return None
+        return position
+
+    def cells(self, month):
+        """ the non-zero cells of a month
+
+            Returns
+            -------
+                tuple
+                    The origin, destination, seats and flights arrays, empty
+                    when the matrix does not cover the month
+        """
+        position = self.bucket(month)
+        if position is None:
+            start = end = 0
+        else:
+            start, end = self.offsets[position], self.offsets[position + 1]
+        return (self.origin[start:end], self.destination[start:end],
+            self.weights['seats'][start:end], self.weights['flights'][start:end])
+
+    def dense(self, month, weight='seats'):
+        """ the airports by airports matrix of a month
+
+            Parameters
+            ----------
+                month : object
+                    A date or a 'YYYY-MM' string
+                weight : str
+                    'seats' or 'flights'
+
+            Returns
+            -------
+                np.ndarray
+                    Rows are origins and columns destinations, in the order
+                    of the airports
+        """
+        origin, destination, seats, flights = self.cells(month)
+        matrix = np.zeros((len(self), len(self)), dtype=np.int64)
+        matrix[origin, destination] = {'seats': seats, 'flights': flights}[weight]
+        return matrix
+
+    def series(self, origin=None, destination=None, start=None, end=None, weight='seats'):
+        """ the monthly capacity between airports
+
+            Parameters
+            ----------
+                origin : str
+                    Optional departure airport code, every origin when None
+                destination : str
+                    Optional arrival airport code, every destination when
+                    None
+                start : object
+                    Optional first month, a date or a 'YYYY-MM' string
+                end : object
+                    Optional last month
+                weight : str
+                    'seats' or 'flights'
+
+            Returns
+            -------
+                tuple
+                    The datetime64[M] months and the capacity of each
+        """
+        values = self.weights[weight]
+        mask = np.ones(len(values), dtype=bool)
+        if origin is not None:
+            mask &= self.origin == self.number(origin)
+        if destination is not None:
+            mask &= self.destination == self.number(destination)
+        # the month of each cell
+        cell_month = np.repeat(np.arange(len(self.months)), np.diff(self.offsets))
+        totals = np.bincount(cell_month[mask], weights=values[mask],
+            minlength=len(self.months)).astype(np.int64)
+        window = np.ones(len(self.months), dtype=bool)
+        if start is not None:
+            window &= self.months >= as_month(start)
+        if end is not None:
+            window &= self.months <= as_month(end)
+        return np.asarray(self.months)[window], totals[window]
@@ -0,0 +1,248 @@
+import os
+import csv
+import logging
+import threading
+
+import numpy as np
+
+from conf import settings
+from tools.grits_geo import airport_location, haversine, load_countries, unit_vectors
+
+""" airports whose coordinates are far from the rest of their country
+
+The port of tools/AirportOutlier to the import pipeline.  The distance of each
+airport to the center of its country is scored against the distances of the
+other airports of the country, grouped by countryName as Run.java: an airport
+is an outlier when the normal distribution of the distances of its country
+puts it above settings._AIRPORT_OUTLIER_P_VALUE, in a country with a spread
+and more than settings._AIRPORT_OUTLIER_MIN_AIRPORTS airports.  Every distance
+and statistic is computed for every country at once with numpy.
+"""
+
+_ACTIONS = ['flag', 'quarantine']
+
+def country_index(countries=None):
+    """ the (name, longitude, latitude) of the countries by code and by name,
+    as the airports of Diio have a countryName but no country code
+
+        Parameters
+        ----------
+            countries : dict
+                The countries by code, defaults to grits_geo.load_countries()
+    """
+    countries = countries if countries is not None else load_countries()
+    index = dict((country[0], country) for country in countries.itervalues())
+    index.update(countries)
+    return index
+
+def normal_cdf(z):
+    """ the cumulative probability of the standard normal distribution
+
+        The erf approximation 7.1.26 of Abramowitz and Stegun, accurate to
+        1.5e-7, vectorized as math.erf is not and scipy is not a dependency.
+    """
+    z = np.asarray(z, dtype=np.float64)
+    x = np.abs(z) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    polynomial = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - polynomial * np.exp(-x * x)
+    return 0.5 * (1.0 + np.sign(z) * erf)
+
+def country_centers(codes, inverse, longitudes, latitudes, countries):
+    """ the center of each country
+
+        Parameters
+        ----------
+            codes : np.ndarray
+                The unique country names or codes
+            inverse : np.ndarray
+                The position of the country of each airport in codes
+            longitudes, latitudes : np.ndarray
+                The coordinates of each airport
+            countries : dict
+                The (name, longitude, latitude) by name or code, see
+                country_index
+
+        Returns
+        -------
+            tuple
+                The longitude and latitude of the center of each code, the
+                median of its airports when countries has none
+    """
+    center_longitudes = np.empty(len(codes))
+    center_latitudes = np.empty(len(codes))
+    vectors = None
+    for number, code in enumerate(codes):
+        longitude, latitude = countries.get(code, (None, np.nan, np.nan))[1:]
+        if np.isnan(longitude) or np.isnan(latitude):
+            # the median direction of the airports, which wraps around the
+            # antimeridian unlike the median longitude
+            if vectors is None:
+                vectors = unit_vectors(longitudes, latitudes)
+            x, y, z = np.median(vectors[inverse == number], axis=0)
+            longitude = np.degrees(np.arctan2(y, x))
+            latitude = np.degrees(np.arctan2(z, np.hypot(x, y)))
+        center_longitudes[number] = longitude
+        center_latitudes[number] = latitude
+    return center_longitudes, center_latitudes
+
+def location_outliers(countries, longitudes, latitudes, centers=None, p_value=None, min_airports=None):
+    """ score the distance of airports to the center of their country
+
+        Parameters
+        ----------
+            countries : list
+                The country name, or code, of each airport
+            longitudes, latitudes : np.ndarray
+                The coordinates of each airport, in degrees
+            centers : dict
+                The (name, longitude, latitude) by country name or code,
+                defaults to country_index()
+            p_value : float
+                Defaults to settings._AIRPORT_OUTLIER_P_VALUE
+            min_airports : int
+                Defaults to settings._AIRPORT_OUTLIER_MIN_AIRPORTS
+
+        Returns
+        -------
+            dict
+                Arrays of the airports: 'distance' to the center of their
+                country in km, the 'mean' and 'std' of the distances of their
+                country, the 'p' value of their distance and whether they are
+                an 'outlier'
+    """
+    centers = centers if centers is not None else country_index()
+    p_value = settings._AIRPORT_OUTLIER_P_VALUE if p_value is None else p_value
+    min_airports = settings._AIRPORT_OUTLIER_MIN_AIRPORTS if min_airports is None else min_airports
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    codes, inverse = np.unique(np.asarray(countries, dtype=object), return_inverse=True)
+    center_longitudes, center_latitudes = country_centers(codes, inverse, longitudes, latitudes, centers)
+
+    distance = haversine(longitudes, latitudes, center_longitudes[inverse], center_latitudes[inverse])
+    count = np.bincount(inverse, minlength=len(codes))
+    mean = np.bincount(inverse, weights=distance, minlength=len(codes)) / np.maximum(count, 1)
+    # the sample standard deviation, as DescriptiveStatistics of Run.java
+    squares = np.bincount(inverse, weights=(distance - mean[inverse]) ** 2, minlength=len(codes))
+    std = np.sqrt(squares / np.maximum(count - 1, 1))
+
+    mean, std, count = mean[inverse], std[inverse], count[inverse]
+    scored = (std > 0) & (count > min_airports)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.where(scored, normal_cdf((distance - mean) / std), np.nan)
+        outlier = scored & (p > p_value) & (distance > mean)
+    return {
+        'distance': distance,
+        'mean': mean,
+        'std': std,
+        'p': p,
+        'outlier': outlier,
+    }
+
+class AirportOutlierStage(object):
+    """ finds the outliers of the airports written by the readers of a run
+
+        Once the import is done the outliers are written to a CSV of code,
+        name, country and countryName rows, the format of
+        tests/data/errorports.csv that FixAirports reads.  With a mongoDB
+        connection every imported airport is also given a locationOutlier
+        flag, and with the 'quarantine' action the loc of an outlier is moved
+        to quarantinedLoc, so no distance is computed from it.
+    """
+
+    def __init__(self, path, mongo_connection=None, action=None):
+        """ AirportOutlierStage constructor
+
+            Parameters
+            ----------
+                path : str
+                    The CSV the outliers are written to
+                mongo_connection : object
+                    Optional GritsMongoConnection of the import
+                action : str
+                    One of _ACTIONS, defaults to
+                    settings._AIRPORT_OUTLIER_ACTION
+        """
+        self.path = path
+        self.mongo_connection = mongo_connection
+        self.action = action or settings._AIRPORT_OUTLIER_ACTION
+        self.airports = {}
+        self._lock = threading.Lock()
+
+    def add(self, records):
+        """ add the airports of a write
+
+            Parameters
+            ----------
+                records : list
+                    The AirportRecords
+        """
+        with self._lock:
+            for record in records:
+                fields = record.fields
+                coordinates = airport_location(fields)
+                country = fields.get('countryName') or fields.get('country')
+                if coordinates is None or country is None:
+                    continue
+                self.airports[record.id] = (fields.get('name'), fields.get('country'),
+                    fields.get('countryName'), coordinates, fields.get('loc'), country)
+
+    def outliers(self):
+        """ the outliers, sorted by code
+
+            Returns
+            -------
+                list
+                    (code, name, country, countryName, distance, p) tuples
+        """
+        with self._lock:
+            codes = sorted(self.airports)
+            airports = [self.airports[code] for code in codes]
+        if len(codes) == 0:
+            return []
+        coordinates = np.array([airport[3] for airport in airports], dtype=np.float64)
+        scores = location_outliers([airport[5] for airport in airports],
+            coordinates[:, 0], coordinates[:, 1])
+        return [(codes[position],) + airports[position][:3] +
+            (scores['distance'][position], scores['p'][position])
+            for position in np.flatnonzero(scores['outlier'])]
+
+    def write(self):
+        """ write the outliers to the path and flag them
+
+            Returns
+            -------
+                list
+                    The outliers, see outliers
+        """
+        outliers = self.outliers()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path, 'wb') as f:
+            writer = csv.writer(f)
+            for code, name, country, country_name, distance, p in outliers:
+                writer.writerow([value.encode('utf-8') if isinstance(value, unicode) else value
+                    for value in (code, name, country, country_name)])
+        for code, name, country, country_name, distance, p in outliers:
+            logging.debug('airport %s is %.0f km from the center of %s (p %.4f)',
+                code, distance, country_name or country, p)
+        logging.info('airport outliers: %d of %d airports written to %s',
+            len(outliers), len(self.airports), self.path)
+        if self.mongo_connection is not None:
+            self.flag(set(outlier[0] for outlier in outliers))
+        return outliers
+
+    def flag(self, outliers):
+        """ set locationOutlier on every airport of the run in one bulk
+        write, and quarantine the loc of the outliers """
+        fixes = []
+        for code in sorted(self.airports):
+            fields = {'locationOutlier': code in outliers}
+            if code in outliers and self.action == 'quarantine':
+                fields['quarantinedLoc'] = self.airports[code][4]
+                fields['loc'] = None
+            fixes.append({'_id': code, 'fields': fields})
+        if len(fixes) > 0:
+            self.mongo_connection.writer.write(settings._AIRPORT_COLLECTION_NAME, 'upsert',
+                fixes, ordered=False)
@@ -0,0 +1,283 @@
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+import collections
+
+# upper bounds (seconds) of the latency histogram buckets, spaced
+# geometrically from 1 microsecond to ~100 seconds
+_BUCKET_BOUNDS = [1e-6 * (1.25 ** i) for i in range(84)]
+
+class StageStats(object):
+    """ running statistics for a single stage of the import
+
+        Samples are not stored individually, instead they are counted into a
+        fixed set of geometric buckets so that memory is constant regardless
+        of the number of rows processed.  Percentiles are estimated from the
+        upper bound of the bucket they fall into.
+    """
+
+    def __init__(self):
+        """ StageStats constructor """
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds):
+        """ add a single sample
+
+            Parameters
+            ----------
+                seconds : float
+                    The elapsed time of the sample
+        """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+
+    def percentile(self, pct):
+        """ estimate the given percentile of the samples
+
+            Parameters
+            ----------
+                pct : float
+                    The percentile between 0 and 100
+
+            Returns
+            -------
+                float
+                    The estimated value in seconds
+        """
+        if self.count == 0:
+            return 0.0
+        threshold = self.count * pct / 100.0
+        cumulative = 0
+        for position, num in enumerate(self.buckets):
+            cumulative += num
+            if cumulative >= threshold and num > 0:
+                if position >= len(_BUCKET_BOUNDS):
+                    return self.max
+                return min(_BUCKET_BOUNDS[position], self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+class _NullTimer(object):
+    """ timer returned when profiling is disabled """
+    elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _StageTimer(object):
+    """ context manager that adds the elapsed time of its block to a stage """
+    __slots__ = ('profiler', 'stage', 'start', 'elapsed')
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self.start
+        self.profiler.add(self.stage, self.elapsed)
+        return False
+
+class StackSampler(threading.Thread):
+    """ sampling profiler that periodically records the stack of every thread
+
+        Unlike cProfile this sees the worker threads of the ThreadPool.  The
+        samples are kept as 'collapsed' stacks, one line per unique stack with
+        a count, which is the input format of flamegraph.pl.
+    """
+
+    def __init__(self, interval=0.005):
+        """ StackSampler constructor
+
+            Parameters
+            ----------
+                interval : float
+                    Seconds between samples
+        """
+        super(StackSampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_ident = threading.current_thread().ident
+        while not self._stop_event.is_set():
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        """ stop sampling and wait for the thread to exit """
+        self._stop_event.set()
+        self.join()
+
+class GritsProfiler(object):
+    """ collects per-stage timings of an import
+
+        A single instance, 'profiler', is shared by the file reader, the
+        records and the mongo connection.  When disabled, 'timer' returns a
+        shared no-op context manager and 'add' returns immediately, so the
+        instrumentation can stay in place permanently.
+    """
+
+    def __init__(self):
+        """ GritsProfiler constructor """
+        self.enabled = False
+        self.dump_path = None
+        self.stages = collections.OrderedDict()
+        self.slowest_chunk = None
+        self.slowest_chunk_time = 0.0
+        self.slowest_chunk_stacks = None
+        # the start and sampler of the chunk of each thread, as the readers
+        # of a --batch --concurrency import run their chunks at once
+        self._chunk = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self, dump_path=None):
+        """ enable the collection of timings
+
+            Parameters
+            ----------
+                dump_path : str
+                    Optional path to write the sampled stacks of the slowest
+                    chunk to
+        """
+        self.enabled = True
+        self.dump_path = dump_path
+
+    def reset(self):
+        """ discard all collected timings """
+        with self._lock:
+            self.stages.clear()
+        self.slowest_chunk = None
+        self.slowest_chunk_time = 0.0
+        self.slowest_chunk_stacks = None
+
+    @staticmethod
+    def clock():
+        return time.time()
+
+    def timer(self, stage):
+        """ context manager that times the enclosed block as 'stage' """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def add(self, stage, seconds):
+        """ add a sample to a stage
+
+            Parameters
+            ----------
+                stage : str
+                    The name of the stage
+                seconds : float
+                    The elapsed time of the sample
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(seconds)
+
+    def start_chunk(self):
+        """ mark the start of a chunk """
+        if not self.enabled:
+            return
+        self._chunk.sampler = None
+        if self.dump_path is not None:
+            self._chunk.sampler = StackSampler()
+            self._chunk.sampler.start()
+        self._chunk.start = time.time()
+
+    def end_chunk(self, chunk_number):
+        """ mark the end of a chunk, keeping the samples if it is the slowest
+
+            Parameters
+            ----------
+                chunk_number : int
+                    The zero-based position of the chunk within the file
+        """
+        start = getattr(self._chunk, 'start', None)
+        if not self.enabled or start is None:
+            return
+        elapsed = time.time() - start
+        self.add('chunk', elapsed)
+        sampler = self._chunk.sampler
+        if sampler is not None:
+            sampler.stop()
+        with self._lock:
+            if elapsed > self.slowest_chunk_time:
+                self.slowest_chunk = chunk_number
+                self.slowest_chunk_time = elapsed
+                if sampler is not None:
+                    self.slowest_chunk_stacks = sampler.stacks
+        self._chunk.sampler = None
+        self._chunk.start = None
+
+    def report(self):
+        """ format the per-stage breakdown as a table
+
+            Returns
+            -------
+                str
+                    The report
+        """
+        grand_total = sum(s.total for name, s in self.stages.items() if name != 'chunk')
+        lines = ['%-14s %10s %10s %6s %10s %10s %10s %10s' % ('stage', 'count',
+            'total(s)', '%', 'mean(ms)', 'p50(ms)', 'p95(ms)', 'p99(ms)')]
+        for name, stats in self.stages.items():
+            share = ''
+            if name != 'chunk' and grand_total > 0:
+                share = '%.1f' % (100.0 * stats.total / grand_total)
+            lines.append('%-14s %10d %10.3f %6s %10.3f %10.3f %10.3f %10.3f' % (
+                name, stats.count, stats.total, share, stats.mean * 1000,
+                stats.percentile(50) * 1000, stats.percentile(95) * 1000,
+                stats.percentile(99) * 1000))
+        if self.slowest_chunk is not None:
+            lines.append('slowest chunk: %d (%.3fs)' % (self.slowest_chunk, self.slowest_chunk_time))
+        return '\n'.join(lines)
+
+    def dump(self):
+        """ write the sampled stacks of the slowest chunk to dump_path """
+        if self.dump_path is None or self.slowest_chunk_stacks is None:
+            return
+        with open(self.dump_path, 'w') as f:
+            for stack, count in self.slowest_chunk_stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+        logging.info('wrote stack samples of chunk %d to %s', self.slowest_chunk, self.dump_path)
+
+# the process-wide profiler
+profiler = GritsProfiler()
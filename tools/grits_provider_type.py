@@ -1,5 +1,6 @@
 from tools.grits_record import FlightRecord, AirportRecord
-from tools.csv_helpers import TabDialect, CommaDialect
+from tools.csv_helpers import TabDialect, CommaDialect, UnicodeReader
+from tools.ssim_helpers import SSIMReader, SSIM_COLUMNS
 
 from conf import settings
 
@@ -107,6 +108,10 @@ class FlightGlobalType(object):
         self.num_empty_rows_eod = 0 # data runs until end of file
         self.dialect=CommaDialect()
 
+    def reader(self, f):
+        """ iterate over the rows of the file f """
+        return UnicodeReader(f, dialect=self.dialect)
+
 class DiioAirportType(object):
     """ class that represents the .tsv format of Diio Mi Express 'Airport'
     report """
@@ -140,3 +145,41 @@ class DiioAirportType(object):
         self.data_position = 4 # zero-based position of the record set
         self.num_empty_rows_eod = 0 # data runs until end of file
         self.dialect=TabDialect()
+
+    def reader(self, f):
+        """ iterate over the rows of the file f """
+        return UnicodeReader(f, dialect=self.dialect)
+
+class SSIMType(object):
+    """ class that represents the IATA SSIM Chapter 7 fixed-width schedule
+    format
+
+    The flight leg (type 3) records are parsed by ssim_helpers.SSIMReader into
+    a row per flight, whose columns already carry the FlightRecord schema
+    names.
+    """
+
+    @property
+    def map(self):
+        return dict((column.lower(), { 'maps_to': column}) for column in SSIM_COLUMNS)
+
+    def __init__(self):
+        """ SSIMType constructor
+
+        Describes the 'contract' for the report, such as the positional
+        processing rules.
+        """
+        self.collection_name = settings._FLIGHT_COLLECTION_NAME # name of the MongoDB collection
+        self.record = FlightRecord
+        # positional processing rules, of the rows produced by SSIMReader.
+        # find_header consumes the header row SSIMReader makes up, so the
+        # first flight is data row 0
+        self.title_position = None # zero-based position of the record set title
+        self.header_position = 0 # zero-based position of the record set header
+        self.data_position = 0 # zero-based position of the record set
+        self.num_empty_rows_eod = 0 # data runs until end of file
+        self.dialect = None
+
+    def reader(self, f):
+        """ iterate over the flights of the file f """
+        return SSIMReader(f)
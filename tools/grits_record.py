@@ -2,12 +2,16 @@ import json
 import collections
 import hashlib
 import logging
+import threading
 
 from datetime import datetime
 from cerberus import Validator
 from bson import json_util
 
 from conf import settings
+from tools.grits_keys import encode_digest
+from tools.grits_profiler import profiler
+from tools.grits_schedule import _DAY_BITS, day_count, schedule_day_minutes, schedule_minutes
 
 class InvalidRecordProperty(Exception):
     """ custom exception that is thrown when the record is missing required
@@ -39,15 +43,16 @@ class InvalidRecord(object):
     """ class that represents the mondoDB format of an invalid record.  This
     is created when the file reader parses an invalid row."""
 
-    @property
-    def schema(self):
-        """ the cerberus schema defination used for validation of a record """
-        return {
-            'Date': { 'type': 'datetime', 'required': True},
-            'Errors': { 'type': 'dict', 'required': True},
-            'RecordType': {'type': 'string', 'required': True},
-            'RowNum': { 'type': 'integer', 'nullable': True}
-        }
+    # the cerberus schema defination used for validation of a record
+    schema = {
+        'Date': { 'type': 'datetime', 'required': True},
+        'Errors': { 'type': 'dict', 'required': True},
+        'RecordType': {'type': 'string', 'required': True},
+        'RowNum': { 'type': 'integer', 'nullable': True}
+    }
+
+    # one validator per thread, shared by every invalid record
+    _local = threading.local()
 
     def __init__(self, errors, record_type, row_num):
         """ InvalidRecord constructor
@@ -67,7 +72,13 @@ class InvalidRecord(object):
         self.fields['Errors'] = errors
         self.fields['RecordType'] = record_type
         self.fields['RowNum'] = row_num
-        self.validator = Validator(self.schema)
+
+    @property
+    def validator(self):
+        validator = getattr(InvalidRecord._local, 'validator', None)
+        if validator is None:
+            validator = InvalidRecord._local.validator = Validator(self.schema)
+        return validator
 
     def validate(self):
         """ validates the record against the schema """
@@ -77,12 +88,115 @@ class InvalidRecord(object):
         """ dumps the records fields into JSON format """
         return json.dumps(self.fields)
 
+# marks a field that has not been set, which is left out of the document
+# rather than stored as null
+_UNSET = object()
+
+class RecordContext(object):
+    """ the state shared by every record of a file
+
+        The header row, the provider map, the collection and the mongoDB
+        connection are the same for every row of a file, so they are kept once
+        in the context rather than in each record.  The context also maps the
+        headers to schema fields once per file and fixes the position of each
+        field within a record's list of values.
+    """
+
+    def __init__(self, record_class, header_row, provider_map, collection_name, mongo_connection, airport_cache=None):
+        """ RecordContext constructor
+
+            Parameters
+            ----------
+                record_class : class
+                    The Record subclass created for each row
+                header_row : list
+                    The parsed header row
+                provider_map : dict
+                    The map of the provider type from grits_provider_type.py
+                collection_name: str
+                    The name of the mongoDB collection corresponding to the
+                    records
+                mongo_connection: object
+                    The mongoDB connection
+                airport_cache: object
+                    Optional AirportCache from grits_mongo.py
+        """
+        self.record_class = record_class
+        self.header_row = header_row
+        self.provider_map = provider_map
+        self.provider_map_keys_lower = frozenset()
+        if provider_map is not None:
+            self.provider_map_keys_lower = frozenset(k.lower() for k in provider_map.keys())
+        self.collection_name = collection_name
+        self.mongo_connection = mongo_connection
+        self.airport_cache = airport_cache
+        self.schema = record_class.schema
+
+        # the schema field of each column, or None for unmapped columns
+        self.headers = None
+        if header_row is not None:
+            self.headers = [self.map_header(header) for header in header_row]
+
+        # fields are positioned in column order, followed by the fields
+        # that are not read from a column such as 'loc' or 'weeklyFrequency'
+        field_names = []
+        for header in (self.headers or []):
+            if header in self.schema and header not in field_names:
+                field_names.append(header)
+        for name in sorted(self.schema.keys()):
+            if name not in field_names:
+                field_names.append(name)
+        self.field_names = tuple(field_names)
+        self.positions = dict((name, position) for position, name in enumerate(field_names))
+
+        self._local = threading.local()
+
+    def map_header(self, header):
+        if header.lower() in self.provider_map_keys_lower:
+            return self.provider_map[header.lower()]['maps_to']
+        return None
+
+    @property
+    def validator(self):
+        """ the Validator of the calling thread
+
+            Validators keep the state of the last validation, so one is
+            created per thread instead of per record.
+        """
+        validator = getattr(self._local, 'validator', None)
+        if validator is None:
+            validator = Validator(self.schema, **self.record_class.validator_options)
+            self._local.validator = validator
+        return validator
+
+    def create_record(self, row_count):
+        """ create an empty record of the context's record_class
+
+            Parameters
+            ----------
+                row_count : int
+                    The row number of the record within the file
+        """
+        record = self.record_class.__new__(self.record_class)
+        Record.__init__(record, self, row_count)
+        return record
+
 class Record(object):
     """ base record class
 
-        A record is an object that contains fields (ordered dictionary) that
-        are used to construct a mongoDB document.
+        A record holds only the values of its row, positioned by the fields of
+        its RecordContext.  The fields (ordered dictionary) that are used to
+        construct a mongoDB document are built from the values the first time
+        they are needed, such as when the record is validated, and kept until
+        a field is set again.
     """
+    __slots__ = ('context', 'values', 'row_count', '_id', '_fields')
+
+    # the cerberus schema definition used for validation of a record
+    schema = {}
+
+    # keyword arguments of the cerberus Validator
+    validator_options = {}
 
     @property
     def id(self):
@@ -92,11 +206,55 @@ class Record(object):
     def id(self, val):
         self._id = val
 
-    def __init__(self):
-        """ Record constructor """
-        self.fields = collections.OrderedDict()
-        self.row_count = None
+    def __init__(self, context=None, row_count=None):
+        """ Record constructor
+
+            Parameters
+            ----------
+                context : object
+                    The RecordContext shared by the records of the file
+                row_count : int
+                    The row number of the record within the file
+        """
+        self.context = context
+        self.row_count = row_count
         self._id = None
+        self._fields = None
+        if context is None:
+            self.values = []
+        else:
+            self.values = [_UNSET] * len(context.field_names)
+
+    @property
+    def fields(self):
+        """ the ordered dictionary of the set fields, shared by the callers
+        until a field is set, so it must not be modified """
+        if self._fields is not None:
+            return self._fields
+        fields = collections.OrderedDict()
+        if self.context is None:
+            return fields
+        for name, value in zip(self.context.field_names, self.values):
+            if value is not _UNSET:
+                fields[name] = value
+        self._fields = fields
+        return fields
+
+    @property
+    def validator(self):
+        return self.context.validator
+
+    def get(self, name, default=None):
+        """ get the value of a field, or default when it is not set """
+        value = self.values[self.context.positions[name]]
+        if value is _UNSET:
+            return default
+        return value
+
+    def set(self, name, value):
+        """ set the value of a field of the schema """
+        self.values[self.context.positions[name]] = value
+        self._fields = None
 
     @staticmethod
     def is_empty_str(val):
@@ -266,7 +424,7 @@ class Record(object):
             InvalidRecordProperty
                 If the header value is not located within the schema
         """
-        if header not in self.schema.keys():
+        if header not in self.schema:
             if settings._DISABLE_SCHEMA_MATCH:
                 return
             else:
@@ -276,16 +434,16 @@ class Record(object):
 
         if data_type == 'string':
             if Record.is_empty_str(field):
-                self.fields[header] = None
+                self.set(header, None)
             else:
-                self.fields[header] = field
+                self.set(header, field)
             return
 
         if data_type == 'integer':
             if Record.could_be_int(field):
-                self.fields[header] = int(field)
+                self.set(header, int(field))
             else:
-                self.fields[header] = None
+                self.set(header, None)
             return
 
         if data_type == 'datetime':
@@ -293,27 +451,27 @@ class Record(object):
             if datetime_format == None:
                 datetime_format = settings._STRFTIME_FORMAT
             if Record.could_be_datetime(field, datetime_format):
-                self.fields[header] = datetime.strptime(field, datetime_format)
+                self.set(header, datetime.strptime(field, datetime_format))
             else:
-                self.fields[header] = None
+                self.set(header, None)
             return
 
         if data_type == 'number':
             if Record.could_be_number(field):
-                self.fields[header] = float(field)
+                self.set(header, float(field))
             else:
-                self.fields[header] = None
+                self.set(header, None)
             return
 
         if data_type == 'float':
             if Record.could_be_float(field):
-                self.fields[header] = float(field)
+                self.set(header, float(field))
             else:
-                self.fields[header] = None
+                self.set(header, None)
             return
 
         if data_type == 'boolean':
-            self.fields[header] = Record.parse_boolean(field)
+            self.set(header, Record.parse_boolean(field))
             return
 
     def validation_errors(self):
@@ -333,100 +491,111 @@ class Record(object):
         return self.validator.validate(self.fields)
 
     def map_header(self, header):
-        if header.lower() in self.provider_map_keys_lower:
-            return self.provider_map[header.lower()]['maps_to']
-        return None
+        return self.context.map_header(header)
 
     def to_json(self):
         return json.dumps(self.fields, default=json_util.default)
 
 class FlightRecord(Record):
     """ class that represents the mondoDB Flight document """
-
-    @property
-    def schema(self):
-        """ the cerberus schema definition used for validation of a record """
-        return {
-            # _id is md5 hash of (effectiveDate, carrier, flightNumber)
-            'carrier' : { 'type': 'string', 'nullable': False, 'required': True},
-            'flightNumber' : { 'type': 'integer', 'nullable': False, 'required': True},
-            'serviceType' : {'type': 'string', 'nullable': True},
-            'effectiveDate' : { 'type': 'datetime', 'required': True, 'datetime_format': '%d/%m/%Y'},
-            'discontinuedDate' : { 'type': 'datetime', 'required': True, 'datetime_format': '%d/%m/%Y'},
-            'day1' : { 'type': 'boolean', 'nullable': True},
-            'day2' : { 'type': 'boolean', 'nullable': True},
-            'day3' : { 'type': 'boolean', 'nullable': True},
-            'day4' : { 'type': 'boolean', 'nullable': True},
-            'day5' : { 'type': 'boolean', 'nullable': True},
-            'day6' : { 'type': 'boolean', 'nullable': True},
-            'day7' : { 'type': 'boolean', 'nullable': True},
-            'departureAirport' : { 'type': 'dict', 'nullable': False, 'required': True},
-            'departureCity' : { 'type': 'string', 'nullable': True},
-            'departureState' : { 'type': 'string', 'nullable': True},
-            'departureCountry' : { 'type': 'string', 'nullable': True},
-            'departureTimePub' : { 'type': 'string', 'nullable': True},
-            #'departureTimeActual' : { 'type': 'datetime', 'nullable': True, 'datetime_format': '%H:%M:%S'},
-            'departureUTCVariance' : { 'type': 'integer', 'nullable': True},
-            #'departureTerminal' : { 'type': 'string', 'nullable': True},
-            'arrivalAirport' : { 'type': 'dict', 'nullable': False, 'required': True},
-            'arrivalCity' : { 'type': 'string', 'nullable': True},
-            'arrivalState' : { 'type': 'string', 'nullable': True},
-            'arrivalCountry' : { 'type': 'string', 'nullable': True},
-            'arrivalTimePub' : { 'type': 'string', 'nullable': True},
-            #'arrivalTimeActual' : { 'type': 'datetime', 'nullable': True, 'datetime_format': '%H:%M:%S'},
-            'arrivalUTCVariance' : { 'type': 'integer', 'nullable': True},
-            #'arrivalTerminal' : { 'type': 'string', 'nullable': True},
-            #'subAircraftCode' : { 'type': 'string', 'nullable': True},
-            #'groupAircraftCode' : { 'type': 'string', 'nullable': True},
-            #'classes' : { 'type': 'string', 'nullable': True},
-            #'classesFull' : { 'type': 'string', 'nullable': True},
-            #'trafficRestriction' : { 'type': 'string', 'nullable': True},
-            'flightArrivalDayIndicator' : { 'type': 'string', 'nullable': True},
-            'stops' : { 'type': 'integer', 'nullable': True},
-            'stopCodes' : { 'type': 'list', 'nullable': True},
-            #'stopRestrictions' : { 'type': 'string', 'nullable': True},
-            #'stopsubAircraftCodes' : { 'type': 'integer', 'nullable': True},
-            #'aircraftChangeIndicator' : { 'type': 'string', 'nullable': True},
-            #'meals' : { 'type': 'string', 'nullable': True},
-            #'flightDistance' : { 'type': 'integer', 'nullable': True},
-            #'elapsedTime' : { 'type': 'integer', 'nullable': True},
-            #'layoverTime' : { 'type': 'integer', 'nullable': True},
-            #'inFlightService' : { 'type': 'string', 'nullable': True},
-            #'SSIMcodeShareStatus' : { 'type': 'string', 'nullable': True},
-            #'SSIMcodeShareCarrier' : { 'type': 'string', 'nullable': True},
-            #'codeshareIndicator' :  { 'type': 'boolean', 'nullable': True},
-            #'wetleaseIndicator' : { 'type': 'boolean', 'nullable': True},
-            #'codeshareInfo' : { 'type': 'list', 'nullable': True},
-            #'wetleaseInfo' : { 'type': 'string', 'nullable': True},
-            #'operationalSuffix' : { 'type': 'string', 'nullable': True},
-            #'ivi' : { 'type': 'integer', 'nullable': True},
-            #'leg' : { 'type': 'integer', 'nullable': True},
-            #'recordId' : { 'type': 'integer', 'nullable': True},
-            #'daysOfOperation' : { 'type': 'string', 'nullable': True},
-            #'totalFrequency' : { 'type': 'integer', 'nullable': True},
-            'weeklyFrequency' : { 'type': 'integer', 'nullable': True, 'required': False},
-            #'availSeatMi' : { 'type': 'integer', 'nullable': True},
-            #'availSeatKm' : { 'type': 'integer', 'nullable': True},
-            #'intStopArrivaltime' : { 'type': 'list', 'nullable': True},
-            #'intStopDepartureTime' : { 'type': 'list', 'nullable': True},
-            #'intStopNextDay' : { 'type': 'list', 'nullable': True},
-            #'physicalLegKey' : { 'type': 'list', 'nullable': True},
-            #'departureAirportName' : { 'type': 'string', 'nullable': True},
-            #'departureCityName' : { 'type': 'string', 'nullable': True},
-            #'departureCountryName' : { 'type': 'string', 'nullable': True},
-            #'arrivalAirportName' : { 'type': 'string', 'nullable': True},
-            #'arrivalCityName' : { 'type': 'string', 'nullable': True},
-            #'arrivalCountryName' : { 'type': 'string', 'nullable': True},
-            #'aircraftType' : { 'type': 'string', 'nullable': True},
-            #'carrierName' : { 'type': 'string', 'nullable': True},
-            'totalSeats' : { 'type': 'integer', 'nullable': True}}
-            #'firstClassSeats' : { 'type': 'integer', 'nullable': True},
-            #'businessClassSeats' : { 'type': 'integer', 'nullable': True},
-            #'premiumEconomyClassSeats' : { 'type': 'integer', 'nullable': True},
-            #'economyClassSeats' : { 'type': 'integer', 'nullable': True},
-            #'aircraftTonnage' : { 'type': 'integer', 'nullable': True}}
-
-    def __init__(self, header_row, provider_map, collection_name, row_count, mongo_connection):
+    __slots__ = ()
+
+    validator_options = {'transparent_schema_rules': True}
+
+    # the cerberus schema definition used for validation of a record
+    schema = {
+        # _id is md5 hash of (effectiveDate, carrier, flightNumber)
+        'carrier' : { 'type': 'string', 'nullable': False, 'required': True},
+        'flightNumber' : { 'type': 'integer', 'nullable': False, 'required': True},
+        'serviceType' : {'type': 'string', 'nullable': True},
+        'effectiveDate' : { 'type': 'datetime', 'required': True, 'datetime_format': '%d/%m/%Y'},
+        'discontinuedDate' : { 'type': 'datetime', 'required': True, 'datetime_format': '%d/%m/%Y'},
+        'day1' : { 'type': 'boolean', 'nullable': True},
+        'day2' : { 'type': 'boolean', 'nullable': True},
+        'day3' : { 'type': 'boolean', 'nullable': True},
+        'day4' : { 'type': 'boolean', 'nullable': True},
+        'day5' : { 'type': 'boolean', 'nullable': True},
+        'day6' : { 'type': 'boolean', 'nullable': True},
+        'day7' : { 'type': 'boolean', 'nullable': True},
+        # day1 to day7 packed into bits 0 to 6, see grits_schedule.py
+        'days' : { 'type': 'integer', 'nullable': True},
+        'departureAirport' : { 'type': 'dict', 'nullable': False, 'required': True},
+        'departureCity' : { 'type': 'string', 'nullable': True},
+        'departureState' : { 'type': 'string', 'nullable': True},
+        'departureCountry' : { 'type': 'string', 'nullable': True},
+        'departureTimePub' : { 'type': 'string', 'nullable': True},
+        #'departureTimeActual' : { 'type': 'datetime', 'nullable': True, 'datetime_format': '%H:%M:%S'},
+        'departureUTCVariance' : { 'type': 'integer', 'nullable': True},
+        #'departureTerminal' : { 'type': 'string', 'nullable': True},
+        'arrivalAirport' : { 'type': 'dict', 'nullable': False, 'required': True},
+        'arrivalCity' : { 'type': 'string', 'nullable': True},
+        'arrivalState' : { 'type': 'string', 'nullable': True},
+        'arrivalCountry' : { 'type': 'string', 'nullable': True},
+        'arrivalTimePub' : { 'type': 'string', 'nullable': True},
+        #'arrivalTimeActual' : { 'type': 'datetime', 'nullable': True, 'datetime_format': '%H:%M:%S'},
+        'arrivalUTCVariance' : { 'type': 'integer', 'nullable': True},
+        #'arrivalTerminal' : { 'type': 'string', 'nullable': True},
+        #'subAircraftCode' : { 'type': 'string', 'nullable': True},
+        #'groupAircraftCode' : { 'type': 'string', 'nullable': True},
+        #'classes' : { 'type': 'string', 'nullable': True},
+        #'classesFull' : { 'type': 'string', 'nullable': True},
+        #'trafficRestriction' : { 'type': 'string', 'nullable': True},
+        'flightArrivalDayIndicator' : { 'type': 'string', 'nullable': True},
+        # UTC minutes of the week of each operating day, see grits_schedule.py
+        'departureMinutesUTC' : { 'type': 'list', 'nullable': True},
+        'arrivalMinutesUTC' : { 'type': 'list', 'nullable': True},
+        # UTC minute of the day, the same on each operating day
+        'departureMinuteOfDayUTC' : { 'type': 'integer', 'nullable': True},
+        'arrivalMinuteOfDayUTC' : { 'type': 'integer', 'nullable': True},
+        'stops' : { 'type': 'integer', 'nullable': True},
+        'stopCodes' : { 'type': 'list', 'nullable': True},
+        #'stopRestrictions' : { 'type': 'string', 'nullable': True},
+        #'stopsubAircraftCodes' : { 'type': 'integer', 'nullable': True},
+        #'aircraftChangeIndicator' : { 'type': 'string', 'nullable': True},
+        #'meals' : { 'type': 'string', 'nullable': True},
+        #'flightDistance' : { 'type': 'integer', 'nullable': True},
+        # great-circle kilometers computed by grits_distances.set_distances
+        'greatCircleDistance' : { 'type': 'integer', 'nullable': True},
+        'legDistances' : { 'type': 'list', 'nullable': True},
+        'routeDistance' : { 'type': 'integer', 'nullable': True},
+        #'elapsedTime' : { 'type': 'integer', 'nullable': True},
+        #'layoverTime' : { 'type': 'integer', 'nullable': True},
+        #'inFlightService' : { 'type': 'string', 'nullable': True},
+        #'SSIMcodeShareStatus' : { 'type': 'string', 'nullable': True},
+        #'SSIMcodeShareCarrier' : { 'type': 'string', 'nullable': True},
+        #'codeshareIndicator' :  { 'type': 'boolean', 'nullable': True},
+        #'wetleaseIndicator' : { 'type': 'boolean', 'nullable': True},
+        #'codeshareInfo' : { 'type': 'list', 'nullable': True},
+        #'wetleaseInfo' : { 'type': 'string', 'nullable': True},
+        #'operationalSuffix' : { 'type': 'string', 'nullable': True},
+        #'ivi' : { 'type': 'integer', 'nullable': True},
+        #'leg' : { 'type': 'integer', 'nullable': True},
+        #'recordId' : { 'type': 'integer', 'nullable': True},
+        #'daysOfOperation' : { 'type': 'string', 'nullable': True},
+        #'totalFrequency' : { 'type': 'integer', 'nullable': True},
+        'weeklyFrequency' : { 'type': 'integer', 'nullable': True, 'required': False},
+        #'availSeatMi' : { 'type': 'integer', 'nullable': True},
+        #'availSeatKm' : { 'type': 'integer', 'nullable': True},
+        #'intStopArrivaltime' : { 'type': 'list', 'nullable': True},
+        #'intStopDepartureTime' : { 'type': 'list', 'nullable': True},
+        #'intStopNextDay' : { 'type': 'list', 'nullable': True},
+        #'physicalLegKey' : { 'type': 'list', 'nullable': True},
+        #'departureAirportName' : { 'type': 'string', 'nullable': True},
+        #'departureCityName' : { 'type': 'string', 'nullable': True},
+        #'departureCountryName' : { 'type': 'string', 'nullable': True},
+        #'arrivalAirportName' : { 'type': 'string', 'nullable': True},
+        #'arrivalCityName' : { 'type': 'string', 'nullable': True},
+        #'arrivalCountryName' : { 'type': 'string', 'nullable': True},
+        #'aircraftType' : { 'type': 'string', 'nullable': True},
+        #'carrierName' : { 'type': 'string', 'nullable': True},
+        'totalSeats' : { 'type': 'integer', 'nullable': True}}
+        #'firstClassSeats' : { 'type': 'integer', 'nullable': True},
+        #'businessClassSeats' : { 'type': 'integer', 'nullable': True},
+        #'premiumEconomyClassSeats' : { 'type': 'integer', 'nullable': True},
+        #'economyClassSeats' : { 'type': 'integer', 'nullable': True},
+        #'aircraftTonnage' : { 'type': 'integer', 'nullable': True}}
+
+    def __init__(self, header_row, provider_map, collection_name, row_count, mongo_connection, airport_cache=None):
         """ FlightRecord constructor
 
             Parameters
@@ -438,55 +607,44 @@ class FlightRecord(Record):
                     record
                 mongo_connection: object
                     The mongoDB connection
+                airport_cache: object
+                    Optional AirportCache from grits_mongo.py used to look up
+                    the departure, arrival and stop airports
         """
-        super(FlightRecord, self).__init__()
-        self.header_row = header_row
         if provider_map == None:
             raise InvalidRecordProperty('Record "provider_map" property is None')
-        self.provider_map = provider_map
-        self.provider_map_keys_lower = map(lambda x: x.lower(), provider_map.keys())
-        self.collection_name = collection_name
-        self.row_count = row_count
-        self.mongo_connection = mongo_connection
-        self.validator = Validator(self.schema, transparent_schema_rules=True)
+        context = RecordContext(FlightRecord, header_row, provider_map,
+            collection_name, mongo_connection, airport_cache)
+        super(FlightRecord, self).__init__(context, row_count)
 
     def gen_key(self):
         """ generate a unique key for this record """
 
-        if len(self.fields) == 0:
+        fields = self.fields
+        if len(fields) == 0:
             return None
 
         # we do not call self.validate() here as self._id will always be null,
         # so we call self.validator.validate on the schema.  This will validate
         # that 'effectiveDate', 'carrier', and 'flightNumber' are not None
         # and of valid data type
-        if self.validator.validate(self.fields) == False:
+        if self.validator.validate(fields) == False:
             return None
 
         h = hashlib.md5()
-        h.update(self.fields['effectiveDate'].isoformat())
-        h.update(str(self.fields['carrier']))
-        h.update(str(self.fields['flightNumber']))
+        h.update(fields['effectiveDate'].isoformat())
+        h.update(str(fields['carrier']))
+        h.update(str(fields['flightNumber']))
 
-        return h.hexdigest()
+        return encode_digest(h.digest())
 
     def gen_weeklyFrequency(self):
-        """ generate the weeklyFrequency for this record """
-
-        if len(self.fields) == 0:
+        """ generate the weeklyFrequency for this record, the number of days
+        set in its days bitmask """
+        days = self.get('days')
+        if days is None:
             return None
-
-        if self.validator.validate(self.fields) == False:
-            return None
-
-        weeklyFrequency = 0
-        dayFields = ['day1','day2','day3','day4','day5','day6','day7']
-        for dayField in dayFields:
-            if dayField in self.fields:
-                if self.fields[dayField] == True:
-                    weeklyFrequency += 1
-
-        return weeklyFrequency
+        return day_count(days)
 
     def create(self, row):
         """ populate the fields with the row data
@@ -509,81 +667,117 @@ class FlightRecord(Record):
                 InvalidRecordLength
                     If the record length does not equal the header.
         """
-        if not 'header_row' in self.__dict__:
+        if self.context is None:
             raise InvalidRecordProperty('Record is missing "header_row" property')
-        if self.header_row == None:
+        if self.context.header_row == None:
             raise InvalidRecordProperty('Record "header_row" property is None')
 
-        header_len = len(self.header_row)
+        header_len = len(self.context.header_row)
         field_len = len(row)
         if header_len != field_len:
             raise InvalidRecordLength('Record length does not equal header_row')
 
-        position = 0
-        for field in row:
-            header = self.map_header(self.header_row[position])
-            position += 1
-
+        coerce_start = profiler.clock()
+        airport_time = 0.0
+        days = 0
+        for header, field in zip(self.context.headers, row):
             # we ignore unmapped header
             if header == None:
                 continue
 
+            # the day columns are packed into days, and kept as day1 to day7
+            # unless settings._FLIGHT_DAY_FIELDS is off
+            if header in _DAY_BITS:
+                value = Record.parse_boolean(field)
+                if value:
+                    days |= _DAY_BITS[header]
+                if settings._FLIGHT_DAY_FIELDS:
+                    self.set(header, value)
+                continue
+
             # we ignore empty headers
             if Record.is_empty_str(header):
                 continue
 
             # special cases to convert to geoJSON
             if header.lower() == 'departureairport' or header.lower() == 'arrivalairport':
-                db = self.mongo_connection.db
-                airport = db[settings._AIRPORT_COLLECTION_NAME].find_one({'_id':field})
-                self.fields[header] = airport
+                with profiler.timer('airport') as timer:
+                    self.set(header, self.find_airport(field))
+                airport_time += timer.elapsed
                 continue
 
             # special case for stopCodes
             if header.lower() == 'stopcodes':
                 codes = field.split('!')
                 airports = []
-                for code in codes:
-                    airport = db[settings._AIRPORT_COLLECTION_NAME].find_one({'_id':code})
-                    if airport != None: airports.append(airport)
-                self.fields[header] = airports
+                with profiler.timer('airport') as timer:
+                    for code in codes:
+                        if code == '':
+                            continue
+                        airport = self.find_airport(code)
+                        if airport != None: airports.append(airport)
+                airport_time += timer.elapsed
+                self.set(header, airports)
 
             # all other cases set data-type based on schema
             self.set_field_by_schema(header, field)
+        profiler.add('coerce', profiler.clock() - coerce_start - airport_time)
+        self.set('days', days)
+
+        with profiler.timer('frequency'):
+            self.set('weeklyFrequency', self.gen_weeklyFrequency())
+        with profiler.timer('schedule'):
+            departures, arrivals = schedule_minutes(self)
+            self.set('departureMinutesUTC', departures)
+            self.set('arrivalMinutesUTC', arrivals)
+            departure, arrival = schedule_day_minutes(self)
+            self.set('departureMinuteOfDayUTC', departure)
+            self.set('arrivalMinuteOfDayUTC', arrival)
+        with profiler.timer('key'):
+            self.id = self.gen_key()
+
+    def find_airport(self, code):
+        """ find the airport document for the code
+
+            Parameters
+            ----------
+                code : str
+                    The airport code, which is the _id of the document
 
-        self.fields['weeklyFrequency'] = self.gen_weeklyFrequency()
-        self.id = self.gen_key()
+            Returns
+            -------
+                dict
+                    The airport document or None
+        """
+        if self.context.airport_cache is not None:
+            return self.context.airport_cache.get(code)
+        db = self.context.mongo_connection.db
+        return db[settings._AIRPORT_COLLECTION_NAME].find_one({'_id':code})
 
 class AirportRecord(Record):
     """ class that represents the mondoDB airport document """
-
-    @property
-    def schema(self):
-        """ the cerberus schema definition used for validation of a record """
-        return {
-            # _id is the airport 'Code'
-            'name': { 'type': 'string', 'required': True},
-            'city': { 'type': 'string', 'nullable': True},
-            'state': { 'type': 'string', 'nullable': True},
-            'stateName':{ 'type': 'string', 'nullable': True},
-            'loc': { 'type': 'dict', 'schema': {
-                'type': {'type': 'string'},
-                'coordinates': {'type': 'list'}}, 'nullable': False},
-            'country': { 'type': 'integer', 'nullable': True},
-            'countryName': { 'type': 'string', 'nullable': True},
-            'globalRegion': { 'type': 'string', 'nullable': True},
-            'WAC': { 'type': 'integer', 'nullable': True},
-            'notes': { 'type': 'string', 'nullable': True}}
-
-    def __init__(self, header_row, provider_map, collection_name, row_count, mongo_connection):
-        super(AirportRecord, self).__init__()
-        self.header_row = header_row
-        self.provider_map = provider_map
-        self.provider_map_keys_lower = map(lambda x: x.lower(), provider_map.keys())
-        self.collection_name = collection_name
-        self.row_count = row_count
-        self.mongo_connection = mongo_connection
-        self.validator = Validator(self.schema)
+    __slots__ = ()
+
+    # the cerberus schema definition used for validation of a record
+    schema = {
+        # _id is the airport 'Code'
+        'name': { 'type': 'string', 'required': True},
+        'city': { 'type': 'string', 'nullable': True},
+        'state': { 'type': 'string', 'nullable': True},
+        'stateName':{ 'type': 'string', 'nullable': True},
+        'loc': { 'type': 'dict', 'schema': {
+            'type': {'type': 'string'},
+            'coordinates': {'type': 'list'}}, 'nullable': False},
+        'country': { 'type': 'integer', 'nullable': True},
+        'countryName': { 'type': 'string', 'nullable': True},
+        'globalRegion': { 'type': 'string', 'nullable': True},
+        'WAC': { 'type': 'integer', 'nullable': True},
+        'notes': { 'type': 'string', 'nullable': True}}
+
+    def __init__(self, header_row, provider_map, collection_name, row_count, mongo_connection, airport_cache=None):
+        context = RecordContext(AirportRecord, header_row, provider_map,
+            collection_name, mongo_connection, airport_cache)
+        super(AirportRecord, self).__init__(context, row_count)
 
     @staticmethod
     def is_valid_coordinate_pair(coordinates):
@@ -631,12 +825,12 @@ class AirportRecord(Record):
                 InvalidRecordLength
                     If the record length does not equal the header.
         """
-        if not 'header_row' in self.__dict__:
+        if self.context is None:
             raise InvalidRecordProperty('Record is missing "header_row" property')
-        if self.header_row == None:
+        if self.context.header_row == None:
             raise InvalidRecordProperty('Record "header_row" property is None')
 
-        header_len = len(self.header_row)
+        header_len = len(self.context.header_row)
         field_len = len(row)
         if header_len != field_len:
             raise InvalidRecordLength('Record length does not equal header_row')
@@ -644,13 +838,8 @@ class AirportRecord(Record):
         # default coordinates are null
         coordinates = [None, None]
 
-        position= 0
-        for field in row:
-            header = self.map_header(self.header_row[position])
-            #logging.debug('self.header_row[position]: %r', self.header_row[position])
-            #logging.debug('header: %r', header)
-            position += 1
-
+        coerce_start = profiler.clock()
+        for header, field in zip(self.context.headers, row):
             # we ignore none header
             if header == None:
                 continue
@@ -679,6 +868,8 @@ class AirportRecord(Record):
             # all other cases set data-type based on schema
             self.set_field_by_schema(header, field)
 
+        profiler.add('coerce', profiler.clock() - coerce_start)
+
         #we cannot have invalid geoJSON objects in mongoDB
         if AirportRecord.is_valid_coordinate_pair(coordinates):
             loc = {
@@ -689,4 +880,4 @@ class AirportRecord(Record):
             loc = None
 
         #add the geoJSON 'loc'
-        self.fields['loc'] = loc
+        self.set('loc', loc)
@@ -0,0 +1,61 @@
+import logging
+import argparse
+
+from conf import settings
+from tools.grits_chunk_writer import replay
+from tools.grits_mongo import GritsMongoConnection, registry
+
+class GritsReplay(object):
+    """ Command line tool to write the operations of a dead letter file again """
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(description='script to write ' \
+            'the operations that failed during an import again.')
+
+    def add_args(self):
+        """ add arguments to the argparse command-line program """
+        self.parser.add_argument('-u', '--username',
+            default=settings._MONGO_USERNAME,
+            help='the username for mongoDB (Default: None)')
+
+        self.parser.add_argument('-p', '--password',
+            default=settings._MONGO_PASSWORD,
+            help='the password for mongoDB (Default: None)')
+
+        self.parser.add_argument('-d', '--database',
+            default=settings._MONGO_DATABASE,
+            help='the database for mongoDB (Default: grits)')
+
+        self.parser.add_argument('-m', '--mongohost',
+            default=settings._MONGO_HOST,
+            help='the hostname for mongoDB (Default: localhost)')
+
+        self.parser.add_argument('--mongo-profile',
+            choices=sorted(settings._MONGO_PROFILES.keys()),
+            default=settings._MONGO_PROFILE,
+            help='the write concern, pool size and compression of the ' \
+                'mongoDB client (Default: %s)' % settings._MONGO_PROFILE)
+
+        self.parser.add_argument('dead_letter_file',
+            nargs='?',
+            default=settings._DEAD_LETTER_FILE,
+            help='the dead letter file of the import (Default: %s)' % settings._DEAD_LETTER_FILE)
+
+    def run(self, *args):
+        """ kickoff the program """
+        self.add_args()
+
+        if len(args) > 0:
+            program_args = self.parser.parse_args(args)
+        else:
+            program_args = self.parser.parse_args()
+
+        mongo_connection = GritsMongoConnection(program_args, read_only=True)
+        try:
+            summary = replay(mongo_connection.db, program_args.dead_letter_file)
+        finally:
+            registry.close()
+        if summary['failed'] > 0:
+            logging.error('%d operations failed again, they are in %s',
+                summary['failed'], program_args.dead_letter_file)
+        return summary
@@ -0,0 +1,245 @@
+import re
+import collections
+
+""" the departure and arrival times of the flights as UTC minutes of the week
+
+The providers publish the local departureTimePub and arrivalTimePub as
+'HH:MM:SS' strings, with the UTC offset of each airport in
+departureUTCVariance and arrivalUTCVariance as signed HHMM integers (-500 is
+UTC-05:00), and the days after the departure day the flight arrives in
+flightArrivalDayIndicator.  The minutes of the week count from Monday 00:00
+UTC, day1 of the flights, up to 10079, so 'departing between 06:00 and 09:00
+UTC on Mondays' is a range of integers.  A flight has one departure and one
+arrival minute per operating day, at the same positions.  These fields are
+arrays, so their indexes are multikey and cannot cover a query.
+
+The UTC minute of the day of the departure and of the arrival, 0 to 1439, is
+the same on every operating day, so it is also kept as the integers
+departureMinuteOfDayUTC and arrivalMinuteOfDayUTC.  Indexed after days and
+before _id, they answer 'operating on Mondays and departing between 06:00 and
+09:00 UTC' from the index alone when only the _id is projected.
+
+The operating days are packed into days, a 7-bit integer with bit 0 for
+Monday, day1, to bit 6 for Sunday, day7, so the weeklyFrequency is its count
+of set bits and 'operates on any of these days' is a filter on one field.
+"""
+
+_MINUTES_PER_DAY = 24 * 60
+_MINUTES_PER_WEEK = 7 * _MINUTES_PER_DAY
+
+_DAY_FIELDS = ['day1', 'day2', 'day3', 'day4', 'day5', 'day6', 'day7']
+
+# the bit of each day field in days
+_DAY_BITS = collections.OrderedDict((name, 1 << number) for number, name in enumerate(_DAY_FIELDS))
+
+_ALL_DAYS = (1 << len(_DAY_FIELDS)) - 1
+
+_CLOCK = re.compile(r'^\s*(\d{1,2}):?(\d{2})')
+
+def clock_minutes(value):
+    """ the minutes after midnight of a 'HH:MM:SS' or 'HHMM' time, None when
+    it is not a time """
+    if value is None:
+        return None
+    match = _CLOCK.match(value)
+    if match is None:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 24 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+def offset_minutes(variance):
+    """ the minutes of a signed HHMM UTC variance, 0 when it is None """
+    if variance is None:
+        return 0
+    sign = -1 if variance < 0 else 1
+    return sign * (abs(variance) // 100 * 60 + abs(variance) % 100)
+
+def day_offset(indicator):
+    """ the days of a flightArrivalDayIndicator, 0 when it is not a number """
+    try:
+        return int(indicator)
+    except (TypeError, ValueError):
+        return 0
+
+def week_minutes(days, time_pub, variance, days_later=0):
+    """ the UTC minutes of the week of a time on each operating day
+
+        Parameters
+        ----------
+            days : list
+                The operating days, 1 for Monday to 7 for Sunday
+            time_pub : str
+                The published local time
+            variance : int
+                The UTC variance of the airport, signed HHMM
+            days_later : int
+                The days after the operating day, the
+                flightArrivalDayIndicator of an arrival
+
+        Returns
+        -------
+            list
+                A minute per day, None when the time is not known
+    """
+    minutes = clock_minutes(time_pub)
+    if minutes is None:
+        return None
+    utc = minutes - offset_minutes(variance) + days_later * _MINUTES_PER_DAY
+    return [((day - 1) * _MINUTES_PER_DAY + utc) % _MINUTES_PER_WEEK for day in days]
+
+def day_minute(time_pub, variance):
+    """ the UTC minute of the day, 0 to 1439, of a published local time, None
+    when it is not a time """
+    minutes = clock_minutes(time_pub)
+    if minutes is None:
+        return None
+    return (minutes - offset_minutes(variance)) % _MINUTES_PER_DAY
+
+def day_mask(days):
+    """ the days bitmask of operating days, 1 for Monday to 7 for Sunday """
+    mask = 0
+    for day in days:
+        if not 1 <= day <= len(_DAY_FIELDS):
+            raise ValueError('unknown day %r, expected 1 to 7' % (day,))
+        mask |= 1 << (day - 1)
+    return mask
+
+def mask_days(mask):
+    """ the operating days, 1 to 7, of a days bitmask """
+    return [number + 1 for number in range(len(_DAY_FIELDS)) if mask & (1 << number)]
+
+def day_count(mask):
+    """ the number of operating days of a days bitmask, the weeklyFrequency
+    of a flight """
+    return bin(mask).count('1')
+
+def operating_days(fields):
+    """ the operating days, 1 to 7, of the fields of a flight, from days or,
+    without it, from day1 to day7 """
+    mask = fields.get('days')
+    if mask is not None:
+        return mask_days(mask)
+    return [number + 1 for number, name in enumerate(_DAY_FIELDS) if fields.get(name)]
+
+def schedule_minutes(fields):
+    """ the departureMinutesUTC and arrivalMinutesUTC of the fields of a
+    flight, see week_minutes """
+    days = operating_days(fields)
+    departures = week_minutes(days, fields.get('departureTimePub'), fields.get('departureUTCVariance'))
+    arrivals = week_minutes(days, fields.get('arrivalTimePub'), fields.get('arrivalUTCVariance'),
+        day_offset(fields.get('flightArrivalDayIndicator')))
+    return departures, arrivals
+
+def schedule_day_minutes(fields):
+    """ the departureMinuteOfDayUTC and arrivalMinuteOfDayUTC of the fields
+    of a flight, see day_minute """
+    return (day_minute(fields.get('departureTimePub'), fields.get('departureUTCVariance')),
+        day_minute(fields.get('arrivalTimePub'), fields.get('arrivalUTCVariance')))
+
+def week_minute(day, clock):
+    """ the minute of the week of a day, 1 for Monday, and a 'HH:MM' time """
+    return (day - 1) * _MINUTES_PER_DAY + clock_minutes(clock)
+
+def time_window_query(days, start, end, field='departureMinutesUTC'):
+    """ the filter of the flights departing, or arriving, within a UTC time
+    window on any of some days
+
+        Parameters
+        ----------
+            days : list
+                The days, 1 for Monday to 7 for Sunday
+            start : str
+                The first minute of the window, 'HH:MM' UTC
+            end : str
+                The end of the window, 'HH:MM' UTC, excluded.  A window
+                ending before it starts ends the next day
+            field : str
+                'departureMinutesUTC' or 'arrivalMinutesUTC'
+
+        Returns
+        -------
+            dict
+                The mongoDB filter, served by the multikey index of the field
+    """
+    if field not in ('departureMinutesUTC', 'arrivalMinutesUTC'):
+        raise ValueError('unknown schedule field %r' % field)
+    length = (clock_minutes(end) - clock_minutes(start)) % _MINUTES_PER_DAY
+    ranges = []
+    for day in sorted(set(days)):
+        first = week_minute(day, start)
+        last = first + length
+        if last <= _MINUTES_PER_WEEK:
+            ranges.append((first, last))
+        else:
+            # the window of Sunday night ends on Monday
+            ranges.append((first, _MINUTES_PER_WEEK))
+            ranges.append((0, last - _MINUTES_PER_WEEK))
+    clauses = [{field: {'$elemMatch': {'$gte': first, '$lt': last}}} for first, last in ranges]
+    if len(clauses) == 1:
+        return clauses[0]
+    return {'$or': clauses}
+
+def days_query(days, every=False):
+    """ the filter of the flights operating on any, or every, of some days
+
+        Parameters
+        ----------
+            days : list
+                The days, 1 for Monday to 7 for Sunday
+            every : bool
+                Match the flights operating on every day instead of any
+
+        Returns
+        -------
+            dict
+                The mongoDB filter.  There are only 127 masks, so the filter
+                lists the matching ones with $in, point lookups in the index
+                of days, as a $bitsAnySet filter would scan every key of it
+    """
+    mask = day_mask(days)
+    if every:
+        masks = [value for value in range(1, _ALL_DAYS + 1) if value & mask == mask]
+    else:
+        masks = [value for value in range(1, _ALL_DAYS + 1) if value & mask]
+    return {'days': {'$in': masks}}
+
+def day_window_query(days, start, end, field='departureMinuteOfDayUTC', every=False):
+    """ the filter of the flights operating on any, or every, of some days and
+    departing, or arriving, within a UTC time window
+
+        The days are the operating days of the schedule, as in days_query,
+        and the window is matched on the UTC time of day, whichever day it
+        falls on.  time_window_query matches the UTC day and time instead.
+
+        Parameters
+        ----------
+            days : list
+                The days, 1 for Monday to 7 for Sunday
+            start : str
+                The first minute of the window, 'HH:MM' UTC
+            end : str
+                The end of the window, 'HH:MM' UTC, excluded.  A window
+                ending before it starts ends the next day
+            field : str
+                'departureMinuteOfDayUTC' or 'arrivalMinuteOfDayUTC'
+            every : bool
+                Match the flights operating on every day instead of any
+
+        Returns
+        -------
+            dict
+                The mongoDB filter.  Queried with a projection of {'_id': 1}
+                it is covered by the index of days, the field and _id
+    """
+    if field not in ('departureMinuteOfDayUTC', 'arrivalMinuteOfDayUTC'):
+        raise ValueError('unknown schedule field %r' % field)
+    first, last = clock_minutes(start), clock_minutes(end)
+    query = days_query(days, every)
+    if first <= last:
+        query[field] = {'$gte': first, '$lt': last}
+    else:
+        # the window ends the next day
+        query['$or'] = [{field: {'$gte': first}}, {field: {'$lt': last}}]
+    return query
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from conf import settings
+from tools.grits_keys import key_format_of
+
+""" the base of the import stages that keep a row per imported flight
+
+ODMatrixBuilder, FlightGraphBuilder and ColumnarSnapshotBuilder are given the
+flights of every write of a run and build their artifact once the import is
+done.  A flight written again, by a later row or a later file of a --batch,
+replaces its row, as the upsert replaces the document, so each stage keeps one
+row per flight _id at the position of its first write.
+
+The rows of each write are stored as a chunk of typed numpy arrays rather than
+as a Python object per cell.  In bounded memory mode (settings._MAX_MEMORY_MB,
+--max-memory) the chunks are spilled to .npy files as they are written and
+mapped back into memory one column at a time when the artifact is built, so
+the stages hold no row of the run in memory while it is imported.
+"""
+
+def key_column(keys):
+    """ the flight keys as an array
+
+        Binary keys are stored as 16 byte np.void, as numpy drops the
+        trailing NUL bytes of a fixed width string column.
+    """
+    if len(keys) > 0 and key_format_of(keys[0]) == 'binary':
+        return np.array([str(key) for key in keys], dtype='V16')
+    column = np.array(keys)
+    if column.dtype == object:
+        raise TypeError('the flight keys cannot be stored in a column')
+    return column
+
+def ragged_column(values, dtype):
+    """ the lists of a ragged column as the values of every flight, one after
+    the other, and the offset of the values of each flight """
+    lengths = np.array([len(value) for value in values], dtype=np.int64)
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.array([item for value in values for item in value], dtype=dtype), offsets
+
+class FlightRowStage(object):
+    """ keeps a row per flight written by the readers of a run
+
+        Subclasses set columns, the (name, dtype, ragged) of the cells of a
+        row, and implement row.  A ragged column holds a list per flight.
+        The row of a flight written again is resolved from the keys of the
+        chunks when the columns are read, the last row at the position of
+        the first.
+    """
+
+    columns = []
+
+    def __init__(self, spill=None):
+        """ FlightRowStage constructor
+
+            Parameters
+            ----------
+                spill : bool
+                    Write the chunks to .npy files, defaults to whether
+                    settings._MAX_MEMORY_MB is set
+        """
+        self.spill = settings._MAX_MEMORY_MB is not None if spill is None else spill
+        self.directory = None
+        self.chunks = []
+        self._selection = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.selection()[0])
+
+    def row(self, record):
+        """ the cells of a flight in the order of columns, None to skip it
+
+            Parameters
+            ----------
+                record : object
+                    A FlightRecord, or a SortedRecord of a --presort import
+        """
+        raise NotImplementedError()
+
+    def add(self, records):
+        """ add the flights of a write
+
+            Parameters
+            ----------
+                records : list
+                    The FlightRecords, or SortedRecords of a --presort import
+        """
+        with self._lock:
+            ids = []
+            rows = []
+            for record in records:
+                row = self.row(record)
+                if row is not None:
+                    ids.append(record.id)
+                    rows.append(row)
+            if len(ids) > 0:
+                self.append(ids, rows)
+
+    def append(self, ids, rows):
+        """ store the rows of a write as a chunk, spilled to the directory of
+        the stage in bounded memory mode """
+        chunk = {'_id': key_column(ids)}
+        for number, (name, dtype, ragged) in enumerate(self.columns):
+            values = [row[number] for row in rows]
+            if ragged:
+                chunk[name], chunk[name + 'Offsets'] = ragged_column(values, dtype)
+            else:
+                chunk[name] = np.array(values, dtype=dtype)
+        if self.spill:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix='grits-stage-', dir=settings._SPILL_DIRECTORY)
+            paths = {}
+            for name, array in chunk.items():
+                paths[name] = os.path.join(self.directory, '%d.%s.npy' % (len(self.chunks), name))
+                np.save(paths[name], array)
+            chunk = paths
+        self.chunks.append(chunk)
+        self._selection = None
+
+    def chunk_arrays(self, name):
+        """ the array of a name in every chunk, mapped from the spilled files """
+        return [np.load(chunk[name], mmap_mode='r') if self.spill else chunk[name]
+            for chunk in self.chunks]
+
+    def selection(self):
+        """ the keys of the flights, in the order they were first written, and
+        the position of the last row of each within the chunks """
+        if self._selection is None:
+            arrays = self.chunk_arrays('_id')
+            if len(arrays) == 0:
+                self._selection = (key_column([]), np.zeros(0, dtype=np.int64))
+            else:
+                keys = np.concatenate(arrays)
+                unique, first = np.unique(keys, return_index=True)
+                # the first row of a key in the reversed keys is its last
+                unique, last = np.unique(keys[::-1], return_index=True)
+                order = np.argsort(first, kind='mergesort')
+                self._selection = (unique[order], len(keys) - 1 - last[order])
+        return self._selection
+
+    def keys(self):
+        """ the _id of the flights, see key_column """
+        return self.selection()[0]
+
+    def column(self, name):
+        """ the cells of a column, in the order the flights were first written
+
+            Returns
+            -------
+                np.ndarray
+                    The cells, or for a ragged column a tuple of the values
+                    and the offsets, see ragged_column
+        """
+        for column_name, dtype, ragged in self.columns:
+            if column_name == name:
+                break
+        else:
+            raise KeyError(name)
+        rows = self.selection()[1]
+        if not ragged:
+            return np.concatenate(self.chunk_arrays(name) or [np.zeros(0, dtype=dtype)])[rows]
+        # the start of the values of every row of the chunks, one after the
+        # other, followed by the end of the last
+        values = self.chunk_arrays(name)
+        starts = []
+        end = 0
+        for chunk_values, offsets in zip(values, self.chunk_arrays(name + 'Offsets')):
+            starts.append(offsets[:-1] + end)
+            end += len(chunk_values)
+        starts = np.concatenate(starts + [[end]]).astype(np.int64)
+        values = np.concatenate(values or [np.zeros(0, dtype=dtype)])
+        lengths = starts[rows + 1] - starts[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        index = np.repeat(starts[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return values[index], offsets
+
+    def close(self):
+        """ discard the chunks and remove the spilled files """
+        self.chunks = []
+        self._selection = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,195 @@
+import os
+import heapq
+import logging
+import tempfile
+import collections
+
+import bson
+from bson.codec_options import CodecOptions
+
+from conf import settings
+
+# the orders the valid records of a chunk can be written in
+_WRITE_ORDERS = ['key', 'departure']
+
+# run files are decoded with the field order they were encoded with
+_RUN_CODEC_OPTIONS = CodecOptions(document_class=collections.OrderedDict)
+
+class InvalidWriteOrder(Exception):
+    """ custom exception that is thrown when an unknown write order is
+    configured """
+    def __init__(self, message, *args, **kwargs):
+        """ InvalidWriteOrder constructor
+
+            Parameters
+            ----------
+                message : str
+                    A descriptive message of the error
+        """
+        super(InvalidWriteOrder, self).__init__(message)
+
+def _key_order(record):
+    return record.id
+
+def _departure_order(record):
+    # the leading fields of idxFlights_DepartureAirportDatesStops...
+    airport = record.get('departureAirport')
+    code = None
+    if isinstance(airport, dict):
+        code = airport.get('_id')
+    return (code, record.get('discontinuedDate'), record.get('effectiveDate'), record.id)
+
+def order_records(records, write_order):
+    """ sort the records of a write so that neighbouring upserts touch
+    neighbouring pages of an index
+
+        The _ids are md5 digests, so in file order every upsert lands on a
+        random page of the _id index.  'key' sorts by _id, 'departure' by the
+        departure airport and dates that lead the compound flight index.  The
+        sort is stable, records that share a key keep their row order.
+
+        Parameters
+        ----------
+            records : list
+                The valid records of a chunk
+            write_order : str
+                One of _WRITE_ORDERS
+
+        Returns
+        -------
+            list
+                The sorted records
+
+        Raises
+        ------
+            InvalidWriteOrder
+                If the write order is unknown
+    """
+    if write_order not in _WRITE_ORDERS:
+        raise InvalidWriteOrder('unknown write order %r, expected one of %r' % (write_order, _WRITE_ORDERS))
+    if len(records) == 0:
+        return records
+    order = _key_order
+    # records without a departure airport, such as airports, are sorted by key
+    if write_order == 'departure' and 'departureAirport' in records[0].context.positions:
+        order = _departure_order
+    return sorted(records, key=order)
+
+class SortedRecord(object):
+    """ a record read back from the runs of an ExternalSorter """
+    __slots__ = ('id', 'fields')
+
+    def __init__(self, id, fields):
+        self.id = id
+        self.fields = fields
+
+class ExternalSorter(object):
+    """ sorts the valid records of a whole file by _id on disk
+
+        For a full reload the records are held back until the file has been
+        read and are then written in _id order, so the upserts append to the
+        _id index instead of splitting random pages.  Records are encoded to
+        BSON as they are added and every run_size of them are sorted and
+        spilled to a run file.  The runs are merged with heapq.merge, which
+        holds a single document of each run in memory.
+    """
+
+    def __init__(self, run_size=None, directory=None):
+        """ ExternalSorter constructor
+
+            Parameters
+            ----------
+                run_size : int
+                    The number of records sorted in memory per run, defaults
+                    to settings._PRESORT_RUN_SIZE
+                directory : str
+                    The directory of the run files, defaults to
+                    settings._PRESORT_DIRECTORY or the temporary directory
+        """
+        self.run_size = run_size or settings._PRESORT_RUN_SIZE
+        self.directory = directory or settings._PRESORT_DIRECTORY
+        self.buffer = []
+        self.runs = []
+        self.count = 0
+
+    def add(self, records):
+        """ add the valid records of a chunk
+
+            Parameters
+            ----------
+                records : list
+                    The records, in row order
+        """
+        for record in records:
+            document = bson.BSON.encode({'_id': record.id, 's': self.count, 'f': record.fields})
+            self.buffer.append((record.id, self.count, document))
+            self.count += 1
+            if len(self.buffer) >= self.run_size:
+                self.spill()
+
+    def spill(self):
+        """ write the sorted buffer to a new run file """
+        self.buffer.sort()
+        handle, path = tempfile.mkstemp(prefix='grits-run-', suffix='.bson', dir=self.directory)
+        self.runs.append(path)
+        with os.fdopen(handle, 'wb') as f:
+            for key, sequence, document in self.buffer:
+                f.write(document)
+        logging.debug('presort: spilled run %d of %d records', len(self.runs), len(self.buffer))
+        self.buffer = []
+
+    @staticmethod
+    def read_run(path):
+        """ the (key, sequence, fields) of the documents of a run file """
+        with open(path, 'rb') as f:
+            for document in bson.decode_file_iter(f, _RUN_CODEC_OPTIONS):
+                yield (document['_id'], document['s'], document['f'])
+
+    def records(self):
+        """ the records in _id order
+
+            Records that share a key are coalesced, the one added last wins
+            as it would have with upserts in row order.
+
+            Returns
+            -------
+                generator
+                    SortedRecords
+        """
+        if len(self.runs) == 0:
+            self.buffer.sort()
+            merged = ((key, sequence, bson.BSON(document).decode(_RUN_CODEC_OPTIONS)['f'])
+                for key, sequence, document in self.buffer)
+        else:
+            if len(self.buffer) > 0:
+                self.spill()
+            merged = heapq.merge(*[ExternalSorter.read_run(path) for path in self.runs])
+
+        previous = None
+        for key, sequence, fields in merged:
+            if previous is not None and previous.id != key:
+                yield previous
+            previous = SortedRecord(key, fields)
+        if previous is not None:
+            yield previous
+
+    def batches(self, size):
+        """ the records in _id order, in lists of at most size """
+        batch = []
+        for record in self.records():
+            batch.append(record)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def close(self):
+        """ remove the run files """
+        for path in self.runs:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warn('could not remove %s: %s', path, e)
+        self.runs = []
+        self.buffer = []
@@ -0,0 +1,220 @@
+import re
+import struct
+
+""" parsing of IATA SSIM Chapter 7 schedule files
+
+A SSIM file is a sequence of 200 byte fixed-width records.  The type of each
+record is its first byte: 1 (header), 2 (carrier), 3 (flight leg), 4 (segment
+data) and 5 (trailer), padded with records of zeros.  Only the flight leg
+records describe flights.  Their fields are cut out of each line with a single
+precompiled struct, which is much cheaper than tokenizing a delimited line,
+and converted to the same text the Flightglobal CSV uses so the rows can be
+created as FlightRecords unchanged.
+
+The legs of a flight with stops are consecutive records of the same flight
+number and itinerary variation, numbered by their leg sequence.  They are
+merged into one row, from the departure of the first leg to the arrival of the
+last, with the intermediate stations as its stopCodes, as they would otherwise
+share the key of the flight and all but the last would be coalesced away.
+"""
+
+_RECORD_LENGTH = 200
+
+# (name, first column, last column) of the fields of a type 3 flight leg
+# record, with the 1-based inclusive columns of the SSIM manual
+_LEG_RECORD_LAYOUT = [
+    ('operationalSuffix', 2, 2),
+    ('carrier', 3, 5),
+    ('flightNumber', 6, 9),
+    ('itineraryVariation', 10, 11),
+    ('legSequence', 12, 13),
+    ('serviceType', 14, 14),
+    ('effectiveDate', 15, 21),
+    ('discontinuedDate', 22, 28),
+    ('daysOfOperation', 29, 35),
+    ('departureAirport', 37, 39),
+    ('departureTimePub', 40, 43),
+    ('departureUTCVariance', 48, 52),
+    ('arrivalAirport', 55, 57),
+    ('arrivalTimePub', 62, 65),
+    ('arrivalUTCVariance', 66, 70),
+    ('aircraftConfiguration', 173, 192),
+    ('arrivalDateVariation', 194, 194),
+]
+
+def compile_layout(layout, record_length):
+    """ a struct that unpacks the fields of a fixed-width layout in one call
+
+        Parameters
+        ----------
+            layout : list
+                (name, first column, last column) tuples, 1-based inclusive
+            record_length : int
+                The length of a record
+
+        Returns
+        -------
+            struct.Struct
+                Unpacks the fields in the order of the layout
+    """
+    fmt = ''
+    position = 0
+    for name, first, last in sorted(layout, key=lambda field: field[1]):
+        if first - 1 > position:
+            fmt += '%dx' % (first - 1 - position)
+        fmt += '%ds' % (last - first + 1)
+        position = last
+    if record_length > position:
+        fmt += '%dx' % (record_length - position)
+    return struct.Struct(fmt)
+
+_LEG_RECORD = compile_layout(_LEG_RECORD_LAYOUT, _RECORD_LENGTH)
+
+# the names of the fields unpacked by _LEG_RECORD, in column order
+_LEG_FIELDS = [field[0] for field in sorted(_LEG_RECORD_LAYOUT, key=lambda field: field[1])]
+
+# the columns of the rows produced by SSIMReader, which are the names the
+# provider map of SSIMType maps onto the FlightRecord schema
+SSIM_COLUMNS = ['carrier', 'flightNumber', 'serviceType', 'effectiveDate',
+    'discontinuedDate', 'day1', 'day2', 'day3', 'day4', 'day5', 'day6', 'day7',
+    'departureAirport', 'departureTimePub', 'departureUTCVariance',
+    'arrivalAirport', 'arrivalTimePub', 'arrivalUTCVariance',
+    'flightArrivalDayIndicator', 'stops', 'stopCodes', 'totalSeats']
+
+_MONTHS = {'JAN': '01', 'FEB': '02', 'MAR': '03', 'APR': '04', 'MAY': '05',
+    'JUN': '06', 'JUL': '07', 'AUG': '08', 'SEP': '09', 'OCT': '10',
+    'NOV': '11', 'DEC': '12'}
+
+_SEATS = re.compile(r'\d+')
+
+# the discontinued date of a leg that runs 'until further notice', and the
+# date it is stored as, as the discontinuedDate of a flight is required
+_UNTIL_FURTHER_NOTICE = '00XXX00'
+_UNTIL_FURTHER_NOTICE_DATE = '31/12/2099'
+
+def ssim_date(value):
+    """ convert a SSIM date, e.g. 05NOV15, to the %d/%m/%Y of the CSV
+
+        The open-ended date 00XXX00 ('until further notice') becomes
+        _UNTIL_FURTHER_NOTICE_DATE.  Malformed dates become empty, which
+        leaves the field unset.
+    """
+    if value == _UNTIL_FURTHER_NOTICE:
+        return _UNTIL_FURTHER_NOTICE_DATE
+    month = _MONTHS.get(value[2:5])
+    if month is None:
+        return ''
+    return '%s/%s/20%s' % (value[0:2], month, value[5:7])
+
+def ssim_time(value):
+    """ convert a SSIM time, e.g. 0830, to the %H:%M:%S of the CSV """
+    if not value.isdigit():
+        return ''
+    return '%s:%s:00' % (value[0:2], value[2:4])
+
+def ssim_days(value):
+    """ the day1 to day7 columns from the days of operation, e.g. '1 3 5 7' """
+    return ['0' if day == ' ' else '1' for day in value]
+
+def ssim_seats(value):
+    """ the total seats of an aircraft configuration, e.g. 'J20Y150' """
+    seats = _SEATS.findall(value)
+    if len(seats) == 0:
+        return ''
+    return str(sum(int(number) for number in seats))
+
+def unpack_leg(line):
+    """ the fields of a flight leg record by the names of _LEG_RECORD_LAYOUT
+
+        Parameters
+        ----------
+            line : str
+                A type 3 record
+    """
+    if len(line) <= _RECORD_LENGTH:
+        # trailing spaces are often trimmed
+        line = line.rstrip('\r\n').ljust(_RECORD_LENGTH)
+    return dict(zip(_LEG_FIELDS, _LEG_RECORD.unpack_from(line)))
+
+def continues_flight(legs, leg):
+    """ whether a leg is the next leg of the flight of the legs before it,
+    of the same flight number and itinerary variation and a later leg
+    sequence """
+    last = legs[-1]
+    return (leg['legSequence'] > last['legSequence'] and
+        all(leg[name] == last[name] for name in
+            ('operationalSuffix', 'carrier', 'flightNumber', 'itineraryVariation')))
+
+def parse_flight(legs):
+    """ convert the unpacked legs of a flight to a row of SSIM_COLUMNS
+
+        The schedule, aircraft and departure are those of the first leg, the
+        arrival is that of the last leg and the departure stations of the
+        other legs are the stops.
+
+        Parameters
+        ----------
+            legs : list
+                The legs of the flight, see unpack_leg
+
+        Returns
+        -------
+            list
+                The fields in the order of SSIM_COLUMNS
+    """
+    first, last = legs[0], legs[-1]
+    arrival_day = last['arrivalDateVariation']
+    if arrival_day == 'A':
+        arrival_day = '-1'
+    stops = [leg['departureAirport'] for leg in legs[1:]]
+    row = [first['carrier'].strip(), first['flightNumber'].strip(), first['serviceType'],
+        ssim_date(first['effectiveDate']), ssim_date(first['discontinuedDate'])]
+    row.extend(ssim_days(first['daysOfOperation']))
+    row.extend([first['departureAirport'], ssim_time(first['departureTimePub']),
+        first['departureUTCVariance'], last['arrivalAirport'],
+        ssim_time(last['arrivalTimePub']), last['arrivalUTCVariance'],
+        arrival_day.strip(), str(len(stops)), '!'.join(stops),
+        ssim_seats(first['aircraftConfiguration'])])
+    return row
+
+def parse_leg(line):
+    """ convert a flight leg record to the row of a flight of one leg, see
+    parse_flight """
+    return parse_flight([unpack_leg(line)])
+
+class SSIMReader(object):
+    """ iterates over a SSIM file like a csv reader: a header row of
+    SSIM_COLUMNS followed by a row per flight, of one or more consecutive
+    flight leg records """
+
+    def __init__(self, f):
+        """ SSIMReader constructor
+
+            Parameters
+            ----------
+                f : object
+                    The SSIM file, opened in binary mode
+        """
+        self.lines = iter(f)
+        self.header_sent = False
+        self.legs = [] # the legs of the flight read so far
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.header_sent:
+            self.header_sent = True
+            return list(SSIM_COLUMNS)
+        for line in self.lines:
+            if line[:1] != '3':
+                continue
+            leg = unpack_leg(line)
+            if len(self.legs) > 0 and not continues_flight(self.legs, leg):
+                legs, self.legs = self.legs, [leg]
+                return parse_flight(legs)
+            self.legs.append(leg)
+        if len(self.legs) > 0:
+            legs, self.legs = self.legs, []
+            return parse_flight(legs)
+        raise StopIteration